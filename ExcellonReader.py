@@ -1,165 +1,527 @@
-
 """
 Read an Excellon drill file (minimal implementation)
-Only loads the details for drilling holes and their diameters.
+Only loads the details for drilling holes and their diameters, and the paths of the rout mode (G00 ... M15 ...
+M16) as polylines of the tool centre (arcs are split into segments). Cutter compensation (G41/G42) is ignored.
 No enforcement is made on the file structure. E.g. you could theoretically define a
 tool anywhere as long as it is defined before that tool is used.
 
+The file is read one line at a time and each line is dispatched on its leading character (see _CODES). The holes
+are accumulated in a packed coordinate array per tool (see DrillData), so large files load in one pass with
+little memory.
+
 Format specifications:
     http://web.archive.org/web/20071030075236/http://www.excellon.com/manuals/program.htm
 """
 
+import array
+import collections
+import math
+import re
+
+import ReaderCommon
+from ReaderCommon import Diagnostics
+
+""" Number format (integer digits, decimal digits) of coordinates without a decimal point by units (0 = mm,
+1 = in) until the file gives one (METRIC/INCH,000.000) """
+DEFAULT_FORMATS = {0: (3, 3), 1: (2, 4)}
+
+
+class DrillData:
+    """
+    Holes and slots of a drill file. The coordinates of the holes of each tool are kept in one flat array
+    [x0, y0, x1, y1, ...] in the order they are drilled. Repeated holes (R) are kept as (first hole, step, count)
+    records and slots (G85) as their end points, so neither is expanded until it is used.
+    Iterating gives [x, y, diameter] for every hole including the repeated ones (tool by tool, in order of first
+    use) so a DrillData can be used wherever a list of drill points is expected.
+    """
+
+    def __init__(self):
+        self.units = 0  # 0 = mm, 1 = in (same as Gerber)
+        self.tools = collections.OrderedDict()
+        """ tool number -> diameter """
+        self.holes = collections.OrderedDict()
+        """ tool number -> array of hole coordinates [x0, y0, x1, y1, ...]
+        :type holes: dict[int, array.array]"""
+        self.repeats = collections.OrderedDict()
+        """ tool number -> array of repeat records [x, y, step x, step y, count, ...] where x, y is the first
+        repeated hole
+        :type repeats: dict[int, array.array]"""
+        self.slots = collections.OrderedDict()
+        """ tool number -> array of slot end points [x1, y1, x2, y2, ...]
+        :type slots: dict[int, array.array]"""
+        self.routs = []
+        """ rout paths (tool down between M15 and M16/M17) in the order they are cut: (tool number, array of the
+        tool centre coordinates [x0, y0, x1, y1, ...])
+        :type routs: list[(int, array.array)]"""
+
+    def add(self, tool, x, y):
+        """ Adds a hole drilled with tool """
+        coords = self.coords(tool)
+        coords.append(x)
+        coords.append(y)
+
+    def coords(self, tool):
+        """ :return: coordinate array of the holes of tool (created if the tool has no holes yet) """
+        coords = self.holes.get(tool)
+        if coords is None: coords = self.holes[tool] = array.array('d')
+        return coords
+
+    def add_repeat(self, tool, x, y, dx, dy, count):
+        """ Adds count holes drilled with tool at x, y and the following steps of dx, dy """
+        records = self.repeats.get(tool)
+        if records is None: records = self.repeats[tool] = array.array('d')
+        records.extend((x, y, dx, dy, count))
+
+    def add_slot(self, tool, x1, y1, x2, y2):
+        """ Adds a slot cut with tool from x1, y1 to x2, y2 """
+        records = self.slots.get(tool)
+        if records is None: records = self.slots[tool] = array.array('d')
+        records.extend((x1, y1, x2, y2))
+
+    def tool_for(self, dia):
+        """ :return: number of the first tool of diameter dia, adding a tool if there is none """
+        for (tool, d) in self.tools.items():
+            if d == dia: return tool
+        tool = max(self.tools.keys() + [0]) + 1
+        self.tools[tool] = dia
+        return tool
+
+    def add_rout(self, tool, x, y):
+        """
+        Starts a rout path at x, y
+        :return: coordinate array of the path to which the following points are added
+        """
+        path = array.array('d', (x, y))
+        self.routs.append((tool, path))
+        return path
+
+    def __len__(self):
+        return sum(len(coords) for coords in self.holes.values()) // 2 + \
+            int(sum(sum(records[4::5]) for records in self.repeats.values()))
+
+    def __iter__(self):
+        for tool in self.holes.keys() + [tool for tool in self.repeats if tool not in self.holes]:
+            dia = self.tools.get(tool, 0)
+            coords = self.holes.get(tool, ())
+            for i in xrange(0, len(coords), 2):
+                yield [coords[i], coords[i + 1], dia]
+            records = self.repeats.get(tool, ())
+            for i in xrange(0, len(records), 5):
+                x, y, dx, dy, count = records[i:i + 5]
+                for k in xrange(int(count)):
+                    yield [x + k*dx, y + k*dy, dia]
+
+    def slotCount(self):
+        return sum(len(records) for records in self.slots.values()) // 4
+
+    def iterSlots(self):
+        """
+        :return: iterator of [x1, y1, x2, y2, diameter] for every slot
+        """
+        for (tool, records) in self.slots.items():
+            dia = self.tools.get(tool, 0)
+            for i in xrange(0, len(records), 4):
+                yield [records[i], records[i + 1], records[i + 2], records[i + 3], dia]
+
+    def iterRouts(self):
+        """
+        :return: iterator of (list of [x, y], diameter) for every rout path
+        """
+        for (tool, path) in self.routs:
+            yield [[path[i], path[i + 1]] for i in xrange(0, len(path), 2)], self.tools.get(tool, 0)
 
-def load_file(filename):
+    def scaled(self, scale):
+        """
+        :return: copy with all coordinates and diameters multiplied by scale (e.g. to convert to Gerber units)
+        :rtype: DrillData
+        """
+        dd = DrillData()
+        dd.units = self.units
+        dd.tools = collections.OrderedDict((tool, dia * scale) for (tool, dia) in self.tools.items())
+        for (tool, coords) in self.holes.items():
+            dd.holes[tool] = array.array('d', [v * scale for v in coords])
+        for (tool, records) in self.repeats.items():
+            dd.repeats[tool] = array.array('d', [v if i % 5 == 4 else v * scale for (i, v) in enumerate(records)])
+        for (tool, records) in self.slots.items():
+            dd.slots[tool] = array.array('d', [v * scale for v in records])
+        for (tool, path) in self.routs:
+            dd.routs.append((tool, array.array('d', [v * scale for v in path])))
+        return dd
+
+
+class ParseData:
+    """ State of the parser """
+
+    def __init__(self, diagnostics):
+        self.dd = DrillData()
+        self.diag = diagnostics
+        self.lineno = 0
+        self.started = False  # M48 found
+        self.header = False  # in the header (between M48 and % or M95)
+        self.finished = False  # end of program found
+        self.formatTZ = False  # True if trailing zeros are kept (leading zeros suppressed). Default is LZ
+        self.intDigits, self.decDigits = DEFAULT_FORMATS[self.dd.units]  # format of numbers without a decimal point
+        self.fmat = 2
+        self.absMode = True
+        self.rout = False  # in rout mode (G00 until G05)
+        self.interp = 1  # rout interpolation: 1 linear, 2 clockwise arc, 3 counter clockwise arc
+        self.path = None  # coordinate array of the rout path being cut, None while the tool is up
+        self.tool = 0  # active tool
+        self.coords = None  # coordinate array of the active tool (see DrillData.coords), None until first used
+        self.x = 0
+        self.y = 0
+
+    def warn(self, msg):
+        self.diag.warn(msg, self.lineno)
+
+    def readCoord(self, s):
+        return readCoord(s, self.formatTZ, self.intDigits, self.decDigits)
+
+
+def load_file(filename, diagnostics=None):
     """
-    Parse gerber file from file path
+    Parse drill file from file path. The file is read one line at a time
     :rtype filename: str
-    :rtype: [float[], float]
+    :param diagnostics: see parse()
+    :rtype: [DrillData, int]
     """
     file = open(filename, 'r')
-    str = file.read()
-    file.close()
+    try:
+        return read(file, diagnostics)
+    finally:
+        file.close()
+
 
-    return parse(str)
+def is_excellon(filename):
+    """
+    :return: True if the first command of the file (after blank lines and comments) is the Excellon header M48
+    """
+    file = open(filename, 'r')
+    try:
+        for line in file:
+            s = line.strip()
+            if s == '' or s[0] == ';': continue
+            return s.startswith("M48")
+    finally:
+        file.close()
+    return False
 
 
-def parse(str):
+def parse(str, diagnostics=None):
     """
     :type str: str
-    :rtype: [float[], float]
+    :param diagnostics: see read()
+    :rtype: [DrillData, int]
     """
+    return read(str.splitlines(), diagnostics)
 
-    str = str.split('\n')
-
-    if not str[0].startswith("M48"):
-        raise StandardError("Excellon file data is invalid. First line must br M48 command")
-    str = str[1:]
 
-    units = 0  # 0 = mm, 1 = in (same as Gerber)
-    tools = []  # stores tool diameters - very basic
-    drillPts = []  # list of X,Y,T where X,Y is the drill coordinate and T is tool number
-    formatTZ = False  # default is to leading zero (LZ)
-    absMode = True
-    tooln = 0  # active tool
-    x = 0
-    y = 0
+def read(lines, diagnostics=None):
+    """
+    :param lines: iterable of lines, e.g. a file object
+    :param diagnostics: Diagnostics the warnings are collected in. The positions are line numbers. None discards
+        the warnings
+    :return: holes (iterates as [x, y, diameter] drill points) and units (0 = mm, 1 = in)
+    :rtype: [DrillData, int]
+    """
+    if diagnostics is None: diagnostics = Diagnostics()
+    pd = ParseData(diagnostics)
+    codes = _CODES
 
-    for s in str:
+    for (lineno, s) in enumerate(lines, 1):
         s = s.strip()  # remove whitespaces
-        if s[0] == ';' or s[0] == '%':
+        if s == '' or s[0] == ';': continue
+        pd.lineno = lineno
+        if not pd.started:
+            if not s.startswith("M48"):
+                raise StandardError("Excellon file data is invalid. First line must br M48 command")
+            pd.started = True
+            pd.header = True
             continue
-        elif s[0] == 'X' or s[0] == 'Y':
-            # TODO: convert to float numbers formatted without decimal indicating some scaling will be required.
-            # The specifications aren't clear about how many decimal places should be used though
-            # The options are 2 or 3 places and chosen value appears to change depending on machine setting
-            if s[0] == 'X':
-                splitpos = s.find('Y', 1)
-                if splitpos == -1:
-                    # omit Y indicating it hasn't change
-                    if absMode:
-                        x = readCoord(s[1:], formatTZ)
-                    else:
-                        x += readCoord(s[1:], formatTZ)
-                else:
-                    if absMode:
-                        x = readCoord(s[1:splitpos], formatTZ)
-                        y = readCoord(s[splitpos+1:], formatTZ)
-                    else:
-                        x += readCoord(s[1:splitpos], formatTZ)
-                        y += readCoord(s[splitpos+1:], formatTZ)
-            else:  # s[0] == y
-                # omit x indicating it hasn't change
-                if absMode:
-                    y = readCoord(s[1:], formatTZ)
-                else:
-                    y += readCoord(s[1:], formatTZ)
-            drillPts.append([x, y, tools[tooln]])  # We should really store a ref to tool info but we only need
-                                    # the tool diameter here so we will be lazy here and store just that.
-                                    # If we care about feedrate and/or spindle speed, then we would need to store
-                                    # all of the tool information.
-        elif s[0] == 'T':
-            # Format:   T##C##[F##][S##]
-            # Where T is tool number, C is diameter, F is feedrate and S is spindle speed
-            # F and S are optional and are IGNORED by this parser
-            splitpos = s.find('C')
-            if splitpos == -1:
-                # we assume it is a tool set if C is not supplied.
-                # Proper checking would require a tool set to occur in the header section ONLY
-                tooln = int(s[1:])  # leading zero is sometimes dropped off but max of 2 digits
-                                    # T#### where 4 digits are specified indicate a compensation index is provided
-                                    # We ignore this here but if encountered, the program would likely crash
-                                    # trying to access the non-existant tool index.
-            else:
-                splitpos2 = s.find('F')
-                splitpos3 = s.find('S')
-                if splitpos2 == -1: splitpos2 = 10000
-                if splitpos3 == -1: splitpos3 = 10000
-                splitpos3 = min(splitpos2, splitpos3)
-                if splitpos3 == 10000:
-                    tooln = int(s[1:splitpos])
-                else:
-                    tooln = int(s[1:splitpos3])
-                tooldia = readCoord(s[splitpos+1:], formatTZ)
-                while len(tools) <= tooln: tools.append(0)
-                tools[tooln] = tooldia
-            pass
-        elif s[0] == 'G':
-            if s.startswith("00", 1):
-                raise StandardError("Rout mode not supported")
-            elif s.startswith("01", 1):
-                # linear interpolation - ignored
-                pass
-            elif s.startswith("02", 1):
-                # circular CW interpolation - ignored
-                pass
-            elif s.startswith("03", 1):
-                # circular CCW interpolation - ignored
-                pass
-            elif s.startswith("05", 1):
-                # drill mode - the ONLY mode supported
-                pass
-            elif s.startswith("90", 1):
-                # absolute coordinates - the only coordinate input type supported
-                absMode = True
-            elif s.startswith("91", 1):
-                # incremental input coordinates - NOT RECOMMENDED
-                print("WARNING: using incremental input mode is not recommended due to floating point imprecision")
-                absMode = False
-            else:
-                raise StandardError("Rout command '%s' is not supported" % s)
-        elif s.startswith("M95"):
-            pass  # end header - ignored
-        elif s.startswith("INCH"):
-            units = 1
-            formatTZ = s.find("TZ", 5) != -1
-        elif s.startswith("METRIC"):
-            units = 0
-            formatTZ = s.find("TZ", 7) != -1
-        elif s.startswith("M30"):
-            # End of program command.
-            break
+        handler = codes.get(s[0])
+        if handler is None:
+            pd.warn("Ignored unsupported command: " + s)
         else:
-            print("Ignored unsupported command: ", s)
+            handler(pd, s)
+        if pd.finished: break
 
     # Commands intentionally ignored but not so safe - i.e. it may affect some things
-    # VER, FMAT
+    # VER
+
+    return [pd.dd, pd.dd.units]
+
+
+# ===== Line handlers =====
+# Each handler is called with (ParseData, line) for the lines starting with its character
+
+""" Coordinates: X and/or Y followed by a number """
+_COORD_RE = re.compile(r'(?:X([-+]?[\d.]+))?(?:Y([-+]?[\d.]+))?$')
+""" Rout move: coordinates followed by the arc radius (A) or centre offsets (I, J) and an optional feed rate """
+_ROUT_RE = re.compile(r'(?:X([-+]?[\d.]+))?(?:Y([-+]?[\d.]+))?(?:A([-+]?[\d.]+)|(?:I([-+]?[\d.]+))?'
+                      r'(?:J([-+]?[\d.]+))?)?(?:F[\d.]+)?(?:S[\d.]+)?$')
+""" Repeat hole: R followed by the number of repeats and the step, e.g. R05X0.1 """
+_REPEAT_RE = re.compile(r'R(\d+)(?:X([-+]?[\d.]+))?(?:Y([-+]?[\d.]+))?$')
+""" Tool: T followed by the tool number and optional parameters, e.g. T01C0.8F200S65 """
+_TOOL_RE = re.compile(r'T(\d+)((?:[A-Z][-+]?[\d.]*)*)$')
+_PARAM_RE = re.compile(r'([A-Z])([-+]?[\d.]*)')
+
+
+def _e_coord(pd, s):
+    if pd.rout:
+        _rout_move(pd, s, pd.interp)
+        return
+    m = _COORD_RE.match(s)
+    if m is None:
+        slot = s.find("G85")
+        if slot != -1:  # slot - X##Y##G85X##Y##
+            _e_slot(pd, s[:slot], s[slot + 3:])
+        else:
+            pd.warn("Ignored unsupported command: " + s)
+        return
+    x, y = m.groups()
+    if x is not None:
+        x = pd.readCoord(x)
+        pd.x = x if pd.absMode else pd.x + x
+    if y is not None:
+        y = pd.readCoord(y)
+        pd.y = y if pd.absMode else pd.y + y
+    coords = pd.coords
+    if coords is None: coords = pd.coords = pd.dd.coords(pd.tool)
+    coords.append(pd.x)
+    coords.append(pd.y)
+
+
+def _e_slot(pd, start, end):
+    m1 = _COORD_RE.match(start)
+    m2 = _COORD_RE.match(end)
+    if m1 is None or m2 is None:
+        pd.warn("Ignored invalid slot: " + start + "G85" + end)
+        return
+    for m in (m1, m2):
+        x, y = m.groups()
+        if x is not None: pd.x = pd.readCoord(x) + (0 if pd.absMode else pd.x)
+        if y is not None: pd.y = pd.readCoord(y) + (0 if pd.absMode else pd.y)
+        if m is m1: x1, y1 = pd.x, pd.y
+    pd.dd.add_slot(pd.tool, x1, y1, pd.x, pd.y)
+
+
+def _e_repeat(pd, s):
+    # Repeats the last hole: R##X##Y## where ## is the number of repeats and X and Y are the (incremental) step
+    m = _REPEAT_RE.match(s)
+    if m is None:
+        pd.warn("Ignored unsupported command: " + s)
+        return
+    count, dx, dy = m.groups()
+    count = int(count)
+    dx = 0 if dx is None else pd.readCoord(dx)
+    dy = 0 if dy is None else pd.readCoord(dy)
+    if count == 0: return
+    pd.dd.add_repeat(pd.tool, pd.x + dx, pd.y + dy, dx, dy, count)
+    pd.x += count * dx
+    pd.y += count * dy
+
+
+def _rout_move(pd, s, interp):
+    """ Moves the tool in rout mode, adding the move to the rout path if the tool is down """
+    m = _ROUT_RE.match(s)
+    if m is None:
+        pd.warn("Ignored unsupported rout command: " + s)
+        return
+    x, y, a, i, j = m.groups()
+    if x is None and y is None: return  # no move
+    x0, y0 = pd.x, pd.y
+    if x is not None: pd.x = pd.readCoord(x) + (0 if pd.absMode else pd.x)
+    if y is not None: pd.y = pd.readCoord(y) + (0 if pd.absMode else pd.y)
+    if pd.path is None: return  # tool up
+    if interp == 1 or (a is None and i is None and j is None):
+        pd.path.extend((pd.x, pd.y))
+        return
+    if a is not None:
+        # Centre from the radius: the shorter arc, the centre lies to the right of the chord for clockwise arcs
+        r = pd.readCoord(a)
+        dx, dy = pd.x - x0, pd.y - y0
+        d = math.hypot(dx, dy)
+        if d == 0:
+            pd.warn("Ignored arc with the same start and end point: " + s)
+            return
+        h = math.sqrt(max(r*r - d*d/4, 0)) / d * (-1 if interp == 2 else 1)
+        cx = x0 + dx/2 - dy*h
+        cy = y0 + dy/2 + dx*h
+    else:
+        cx = x0 + (0 if i is None else pd.readCoord(i))
+        cy = y0 + (0 if j is None else pd.readCoord(j))
+    pd.path.extend(_arc_coords(pd, cx, cy, x0, y0, pd.x, pd.y, interp == 2))
+
+
+def _arc_coords(pd, cx, cy, x0, y0, x1, y1, isCW):
+    """
+    Splits an arc into segments no longer than ReaderCommon.MAX_ARC_LENGTH (at least MIN_SEG_PER_360 per turn)
+    :return: flat coordinates of the points of the arc after the start point
+    """
+    r = math.hypot(x0 - cx, y0 - cy)
+    startAngle = math.atan2(y0 - cy, x0 - cx)
+    deltaAngle = math.atan2(y1 - cy, x1 - cx) - startAngle
+    # sweep in the direction of the arc - a full circle if the ends are the same
+    if isCW and deltaAngle >= 0: deltaAngle -= 2*math.pi
+    if not isCW and deltaAngle <= 0: deltaAngle += 2*math.pi
+    maxLen = ReaderCommon.MAX_ARC_LENGTH / (25.4 if pd.dd.units == 1 else 1)
+    steps = max(ReaderCommon.MIN_SEG, int(abs(deltaAngle)*max(r/maxLen, ReaderCommon.MIN_SEG_PER_360/(2*math.pi))))
+    dr = math.hypot(x1 - cx, y1 - cy) - r
+    coords = ReaderCommon.arc_points(cx, cy, r, startAngle, deltaAngle/steps, steps + 1, dr/steps, True)
+    return list(coords[2:-2]) + [x1, y1]
+
+
+def _e_tool(pd, s):
+    # Format:   T##C##[F##][S##]
+    # Where T is tool number, C is diameter, F is feedrate and S is spindle speed
+    # F and S are optional and are IGNORED by this parser
+    m = _TOOL_RE.match(s)
+    if m is None:
+        pd.warn("Ignored unsupported command: " + s)
+        return
+    digits, params = m.groups()
+    tooln = int(digits)
+    params = dict(_PARAM_RE.findall(params))
+    if 'C' in params:  # tool definition - also selects the tool
+        pd.dd.tools[tooln] = pd.readCoord(params['C'])
+    elif tooln not in pd.dd.tools and tooln != 0:
+        # T#### where 4 digits are specified indicate a compensation index is provided
+        if len(digits) == 4 and int(digits[:2]) in pd.dd.tools:
+            tooln = int(digits[:2])
+        else:
+            pd.warn("Tool T" + digits + " is not defined")
+    pd.tool = tooln
+    pd.coords = None
+
+
+def _e_g(pd, s):
+    code = s[1:3]
+    if code == "00":
+        # rout mode - move with the tool up
+        pd.rout = True
+        pd.path = None
+        _rout_move(pd, s[3:], 1)
+    elif code in ("01", "02", "03"):
+        # linear and circular interpolation - only used in rout mode
+        pd.interp = int(code)
+        if pd.rout:
+            _rout_move(pd, s[3:], pd.interp)
+        elif len(s) > 3:
+            pd.warn("Ignored interpolation outside of rout mode: " + s)
+    elif code == "05":
+        # drill mode
+        pd.rout = False
+        pd.path = None
+    elif code == "40":
+        pass  # cutter compensation off
+    elif code in ("41", "42"):
+        pd.warn("Cutter compensation is not supported - rout paths are read as the centre of the tool")
+    elif code == "90":
+        pd.absMode = True  # absolute coordinates
+    elif code == "91":
+        # incremental input coordinates - NOT RECOMMENDED
+        pd.warn("using incremental input mode is not recommended due to floating point imprecision")
+        pd.absMode = False
+    else:
+        pd.warn("Ignored unsupported command: " + s)
+
+
+def _e_m(pd, s):
+    if s.startswith("METRIC"):
+        _units(pd, s, 0)
+    elif s.startswith("M30") or s.startswith("M00"):
+        pd.finished = True  # end of program
+    elif s.startswith("M15"):
+        # tool down - starts a rout path
+        if pd.rout and pd.path is None: pd.path = pd.dd.add_rout(pd.tool, pd.x, pd.y)
+    elif s.startswith("M16") or s.startswith("M17"):
+        pd.path = None  # tool up - ends the rout path
+    elif s.startswith("M95"):
+        pd.header = False  # end of header
+    elif s.startswith("M71"):
+        _units(pd, "METRIC", 0)
+    elif s.startswith("M72"):
+        _units(pd, "INCH", 1)
+    else:
+        pd.warn("Ignored unsupported command: " + s)
+
+
+def _e_i(pd, s):
+    if s.startswith("INCH"):
+        _units(pd, s, 1)
+    elif s.startswith("ICI"):
+        # incremental input of coordinates
+        pd.absMode = s.endswith(",OFF")
+        if not pd.absMode:
+            pd.warn("using incremental input mode is not recommended due to floating point imprecision")
+    else:
+        pd.warn("Ignored unsupported command: " + s)
+
+
+def _e_f(pd, s):
+    if s.startswith("FMAT"):
+        pd.fmat = int(s[5:]) if s[5:].isdigit() else 2
+        if pd.fmat == 1: pd.warn("Format 1 (FMAT,1) commands are read as format 2 commands")
+    else:
+        pd.warn("Ignored unsupported command: " + s)
+
+
+def _e_header_end(pd, s):
+    pd.header = False  # % rewind and stop - end of header
+
 
-    return [drillPts, units]
+def _e_ignored(pd, s):
+    pass  # VER - version of the format 1 and 2 commands - ignored
 
-def readCoord(str, formatTZ):
+
+def _units(pd, s, units):
+    """
+    METRIC/INCH[,LZ|,TZ][,000.000] - units, zero suppression and number format. The default number format is
+    given by DEFAULT_FORMATS
+    """
+    pd.dd.units = units
+    pd.formatTZ = False
+    pd.intDigits, pd.decDigits = DEFAULT_FORMATS[units]
+    for field in s.split(',')[1:]:
+        if field == "TZ":
+            pd.formatTZ = True
+        elif field == "LZ":
+            pd.formatTZ = False
+        elif field.strip('0.') == '' and '.' in field:
+            pd.intDigits = field.index('.')
+            pd.decDigits = len(field) - pd.intDigits - 1
+
+
+""" Line handlers by leading character """
+_CODES = {
+    'X': _e_coord,
+    'Y': _e_coord,
+    'T': _e_tool,
+    'R': _e_repeat,
+    'G': _e_g,
+    'M': _e_m,
+    'I': _e_i,
+    'F': _e_f,
+    '%': _e_header_end,
+    'V': _e_ignored,
+}
+
+
+def readCoord(str, formatTZ, intDigits=2, decDigits=4):
+    """
+    :param str: number with or without a decimal point
+    :param formatTZ: True if trailing zeros are kept (the number has decDigits decimal places), False if leading
+        zeros are kept (the number has intDigits integer digits)
+    """
     if str.find('.') != -1:
         return float(str)
+    sign = ''
+    if str[:1] in ('-', '+'):
+        sign = str[0]
+        str = str[1:]
+    if formatTZ:
+        str = str.rjust(decDigits + 1, '0')
+        return float(sign + str[:len(str) - decDigits] + '.' + str[len(str) - decDigits:])
     else:
-        if formatTZ:
-            return float(str)*0.0001  # assume 4 decimal places
-        else:
-            # what a horrible way to specify this. Converting to float is rather messy
-            if len(str) == 1:
-                return float(str)*10
-            elif len(str) == 2:
-                return float(str)
-            else:
-                return float(str[:2] + '.' + str[2:])
-
-# TODO: in matrix units, you can apparently specify values using 3 decimal places (in microns)
-# but the Excellon specifications make no mention of how you determine whether to use 2 or 3 DP?!?
+        str = str.ljust(intDigits, '0')
+        return float(sign + str[:intDigits] + '.' + str[intDigits:])
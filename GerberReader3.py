@@ -1,7 +1,24 @@
+import array
+import bisect
+import collections
+import cPickle
+import gc
+import hashlib
+import itertools
+import json
 import math
+import mmap
+import multiprocessing
+import operator
+import os
+import re
 import string
 import pyclipper
 import time
+import zlib
+
+import ReaderCommon
+from ReaderCommon import Diagnostics, arc_points, unit_arc
 
 __author__ = 'Thompson'
 
@@ -11,21 +28,60 @@ This methodology is more flexible to bad formatting of data file
 This is a fully compliant parser.
 """
 
-# Alternative is a MIN_SEG_360_R which is like MIN_SEG_360 but also dependent on radius
-# Larger r should have slightly higher segment counts
-""" Maximum arc length when drawing arc segments in mm. The unit must be in MM and NOT INCHES """
-MAX_ARC_LENGTH = 0.25
-""" Minimum number of segs per 360 degrees. THIS MUST BE >= 1 """
-MIN_SEG_PER_360 = 16
-""" Absolute minimum number of segments no matter the arc angle. THIS MUST BE >= 1 """
-MIN_SEG = 1
-
-""" Set to True to print warnings to console """
-PrintWarnings = True
-""" Set to True to print errors to console """
-PrintErrors = True
-""" Set to True to print deprecated uses to console """
-PrintDeprecatedUses = False
+# The arc segmentation settings MAX_ARC_LENGTH, MIN_SEG_PER_360 and MIN_SEG are in ReaderCommon as they apply to
+# the arcs of drill files as well
+""" Maximum deviation (sagitta) of an arc segment from the true arc in MM. When set, arcs are split into as few
+segments as this tolerance allows and MAX_ARC_LENGTH is not used. MIN_SEG_PER_360 and MIN_SEG still apply.
+None segments arcs by MAX_ARC_LENGTH. This may be overridden for each file loaded (see load_file) """
+MAX_CHORD_ERROR = None
+""" Chord error as a proportion of the tool diameter (see chord_error_for_tool) """
+TOOL_CHORD_RATIO = 0.05
+
+""" Set to True to print the timings and counters of every file loaded (see LoadStats) """
+PrintStats = False
+
+""" Set to True to parse using the block tokenizer (_parse1), False to use the character walking parser (_parse0).
+Both parsers produce identical results - the latter is retained for comparison. """
+UseTokenizer = True
+""" Set to True to memory map files loaded with the block tokenizer rather than reading them into a string """
+UseMemoryMap = True
+
+""" Set to True to store the polygons of layers in a PolygonSet (packed arrays) rather than in lists """
+UsePackedPolygons = True
+
+""" Maximum number of aperture shapes kept in the aperture cache. Set to 0 to disable the cache """
+ApertureCacheSize = 512
+""" File used to keep the aperture cache between sessions. None keeps the cache in memory only """
+ApertureCacheFile = None
+
+""" Directory used to cache the results of parsing files so files that were loaded before load instantly.
+None disables the cache. Entries are unpickled when read, so the directory must not be writable by others """
+ParseCacheDir = None
+""" Maximum size of the parse cache in bytes. The least recently used entries are removed first """
+ParseCacheSize = 256 * 1024 * 1024
+
+""" Number of worker processes that build the geometry of completed layers (LP blocks) while parsing continues.
+0 or 1 builds every layer in the parsing process, None uses one per CPU. The pool belongs to the file being parsed:
+it is started once the file changes polarity and closed when the file has been parsed. The workers import the main
+module on Windows, so programs that set this must guard their entry point (if __name__ == '__main__') """
+PipelineWorkers = 0
+
+""" Nonzero unions of at least this many polygons are partitioned into tiles (see tile_union). 0 disables tiling """
+TileUnionMinPolygons = 4000
+""" Target number of polygons per tile of a partitioned union """
+TileUnionPolygons = 1000
+""" Number of worker processes started by union_pool for partitioned unions. 0 or 1 unions the tiles in the calling
+process (which is still quicker than a single union of a large board), None uses one per CPU """
+UnionWorkers = 0
+
+""" Set to True to record the draw commands of files in GerberData.primitives so their geometry can be built again
+without parsing (see build_geometry). This may be overridden for each file loaded (see load_file) """
+RecordPrimitives = False
+
+""" Aperture functions (X2 .AperFunction attribute, e.g. "NonConductor", "ViaPad") of objects that are not loaded.
+Objects are skipped at parse time so no geometry is built for them. This may be overridden for each file loaded
+(see load_file) """
+SkipApertureFunctions = ()
 
 
 class GerberLayer:
@@ -44,10 +100,13 @@ class GerberLayer:
     points = []             # List of polygons where
                             #   polygon is a list of vertices where
                             #   vertex is [x,y] point
+                            # This is a PolygonSet if UsePackedPolygons is set
     visible = True          # False to hide the layer
     filled = True           # False means outline
     color = "dark green"    # default is green
     type = 0                # layer type
+    flashes = None          # Pad layers only: list of flash instances (aperture, x, y) where aperture
+                            #   is the index of the aperture polygon in GerberData.apertures
 
     def __init__(self, isDark, name, points=None, visible=True, filled=True, color="dark green", type=TYPE_OTHER):
         self.isDark = isDark
@@ -56,7 +115,8 @@ class GerberLayer:
         self.filled = filled
         self.color = color
         self.type = type
-        self.points = [] if points is None else points
+        if points is None: points = []
+        self.points = PolygonSet(points) if UsePackedPolygons and not isinstance(points, PolygonSet) else points
 
 
 class GerberData:
@@ -65,6 +125,28 @@ class GerberData:
     def __init__(self):
         self.layers = []
         """ :type layers: list[GerberLayer]"""
+        self.apertures = []
+        """ Aperture geometry table shared by the flash instances of pad layers. Each entry is a polygon
+        centred on (0,0). Entries are never modified once added (redefining an aperture adds a new entry)
+        :type apertures: list[list]"""
+        self.stats = LoadStats()
+        """ Timings and counters of loading the file
+        :type stats: LoadStats"""
+        self.diagnostics = Diagnostics()
+        """ Warnings, errors and deprecated uses found while loading the file
+        :type diagnostics: Diagnostics"""
+        self.primitives = None
+        """ Draw commands of the file if they were recorded (see RecordPrimitives), otherwise None
+        :type primitives: PrimitiveStream"""
+        self.fileAttributes = collections.OrderedDict()
+        """ X2 file attributes (TF): name -> tuple of values, e.g. ".FileFunction" -> ("Copper", "L1", "Top") """
+        self.apertureAttributes = []
+        """ X2 aperture attributes (TA) of each entry of the aperture table (apertures): name -> tuple of values
+        :type apertureAttributes: list[dict]"""
+        self.attributeIndex = collections.defaultdict(int)
+        """ (attribute name, value) -> number of objects (flashes, tracks and region contours) loaded with the
+        attribute, e.g. (".AperFunction", "ViaPad") or (".N", "GND"). Values of several fields are joined by commas
+        :type attributeIndex: dict"""
 
     units = 0       # 0 is mm, 1 is in
     digits = 0      # not used
@@ -94,22 +176,444 @@ class GerberData:
     # Mode assumed to be absolute
 
 
+class LoadStats:
+    """
+    Timings and counters of loading a file (GerberData.stats).
+    Each stage records the number of calls, the time taken and the number of polygons and vertices going
+    in and out of the stage. Stages run in worker processes are included (their time is the sum over all
+    workers). The stages are:
+        parse               tokenizing and dispatching commands (excluding store_to_gd)
+        aperture            creating apertures (AD)
+        store_to_gd         storing layers - includes the stages below unless run in a worker
+        expand_tracks       expanding track centrelines into outlines (capsules, sweeps and Minkowski sums)
+        expand_flashes      creating pad polygons of flashes
+        union.boundaries    union of tracks, pads and regions (union_boundary)
+        union.pads          union of pads
+        union.tracks        union of track outlines
+        closeOffPolys       closing off polygons
+        collect_layers      waiting for layers built by the worker pool
+        parse_cache.read    loading the result from the parse cache
+        parse_cache.write   storing the result in the parse cache
+        build_geometry      replaying the primitive stream (excluding store_to_gd, see build_geometry)
+    Users of the parse result may add their own stages (e.g. LoadGerberFile adds "bounds" and "SimplifyPolygons").
+    """
+
+    def __init__(self):
+        self.stages = collections.OrderedDict()
+        """ stage name -> [calls, seconds, polygons in, vertices in, polygons out, vertices out] """
+        self.commands = collections.defaultdict(int)
+        """ command code (e.g. "D01", "G36", "AD", "Dnn" for aperture selection) -> number of times parsed """
+        self.counters = collections.defaultdict(int)
+        """ other counters, e.g. "aperture.cached" """
+
+    def add(self, stage, seconds, polysIn=None, polysOut=None):
+        """
+        Records a call of a stage
+        :param seconds: time taken
+        :param polysIn: list of polygons (or track centrelines) going into the stage. None if not applicable
+        :param polysOut: list of polygons produced by the stage. None if not applicable
+        """
+        s = self.stages.get(stage)
+        if s is None: s = self.stages[stage] = [0, 0.0, 0, 0, 0, 0]
+        s[0] += 1
+        s[1] += seconds
+        if polysIn is not None:
+            s[2] += len(polysIn)
+            s[3] += vertex_count(polysIn)
+        if polysOut is not None:
+            s[4] += len(polysOut)
+            s[5] += vertex_count(polysOut)
+
+    def merge(self, other):
+        """
+        Adds the records of another LoadStats (or its asDict()) to this one
+        """
+        if isinstance(other, LoadStats): other = other.asDict()
+        for (stage, rec) in other["stages"].items():
+            s = self.stages.get(stage)
+            if s is None: s = self.stages[stage] = [0, 0.0, 0, 0, 0, 0]
+            for (i, key) in enumerate(_STAGE_FIELDS):
+                s[i] += rec[key]
+        for (key, n) in other["commands"].items(): self.commands[key] += n
+        for (key, n) in other["counters"].items(): self.counters[key] += n
+
+    def asDict(self):
+        """
+        :return: records as plain dictionaries (this is what toJSON writes)
+        """
+        return {"stages": collections.OrderedDict((stage, collections.OrderedDict(zip(_STAGE_FIELDS, s)))
+                                                  for (stage, s) in self.stages.items()),
+                "commands": dict(self.commands),
+                "counters": dict(self.counters)}
+
+    def toJSON(self, indent=1):
+        return json.dumps(self.asDict(), indent=indent)
+
+    def dump(self, filename):
+        """ Writes the records to a JSON file """
+        f = open(filename, 'w')
+        try:
+            f.write(self.toJSON())
+        finally:
+            f.close()
+
+    def report(self):
+        """
+        :return: records as a printable table
+        """
+        lines = ["  %-18s %6s %9s %9s %10s %9s %10s" % ("stage", "calls", "seconds", "polys in", "verts in",
+                                                       "polys out", "verts out")]
+        for (stage, s) in self.stages.items():
+            lines.append("  %-18s %6d %9.3f %9d %10d %9d %10d" % tuple([stage] + s))
+        lines.append("  commands: " + ", ".join("%s=%d" % kv for kv in sorted(self.commands.items())))
+        if self.counters:
+            lines.append("  counters: " + ", ".join("%s=%d" % kv for kv in sorted(self.counters.items())))
+        return "\n".join(lines)
+
+
+_STAGE_FIELDS = ("calls", "seconds", "polygons_in", "vertices_in", "polygons_out", "vertices_out")
+
+
+class PrimitiveStream:
+    """
+    Compact record of the draw commands of a file (GerberData.primitives). The geometry can be built from it
+    again without parsing the file (see build_geometry), e.g. to tessellate arcs with a different chord error.
+    Each record is an opcode (ops) followed by its integer (ints) and floating point (floats) arguments:
+        MOVE            x, y, aperture code         D02 - starts a track or region contour
+        LINE            x, y                        D01 in linear mode
+        ARC             start x, y, end x, y, centre x, y, clockwise        D01 in multi quadrant mode
+        QUADRANT_ARC    centre x, y, r, start angle, delta angle, dr (floats)   D01 in single quadrant mode
+        FLASH           x, y, aperture code         D03
+        APERTURE        aperture code, text         AD - text is the index of the description in texts
+        MACRO           text                        AM - text is the index of (name, lines) in texts
+        STEP_REPEAT     text                        SR - text is the index of the parameters in texts
+        LAYER           isDark, final               end of a layer (LP or end of file)
+        ATTRIBUTE       text                        TF/TA/TO/TD - text is the index of (command, body) in texts
+        REGION          on                          G36/G37
+        SCALE           fraction, units             FS/MO
+    Coordinates are in file units. REGION and SCALE records are only written when the state has changed by the
+    time the next record is written.
+    """
+
+    MOVE = 0
+    LINE = 1
+    ARC = 2
+    QUADRANT_ARC = 3
+    FLASH = 4
+    APERTURE = 5
+    MACRO = 6
+    STEP_REPEAT = 7
+    LAYER = 8
+    REGION = 9
+    SCALE = 10
+    ATTRIBUTE = 11
+
+    """ Number of (integer, floating point) arguments of each opcode """
+    ARGS = ((3, 0), (2, 0), (7, 0), (0, 6), (3, 0), (2, 0), (1, 0), (1, 0), (2, 0), (1, 0), (2, 0), (1, 0))
+
+    def __init__(self):
+        self.ops = array.array('B')
+        """ :type ops: array.array """
+        self.ints = array.array('l' if array.array('l').itemsize == 8 else 'd')
+        """ :type ints: array.array """
+        self.floats = array.array('d')
+        """ :type floats: array.array """
+        self.texts = []
+        self.regionMode = False  # state of the records written so far
+        self.scale = (0, 0)
+
+    def add(self, pd, op, ints=(), floats=()):
+        """
+        Writes a record, preceded by REGION and SCALE records if the state of the parser has changed
+        :type pd: ParseData
+        """
+        if pd.regionMode != self.regionMode:
+            self.regionMode = pd.regionMode
+            self.ops.append(self.REGION)
+            self.ints.append(int(self.regionMode))
+        if (pd.gd.fraction, pd.gd.units) != self.scale:
+            self.scale = (pd.gd.fraction, pd.gd.units)
+            self.ops.append(self.SCALE)
+            self.ints.extend(self.scale)
+        self.ops.append(op)
+        if ints: self.ints.extend(ints)
+        if floats: self.floats.extend(floats)
+
+    def addText(self, pd, op, text, ints=()):
+        """ Writes a record referring to text (stored in texts) """
+        self.texts.append(text)
+        self.add(pd, op, tuple(ints) + (len(self.texts) - 1,))
+
+    def records(self):
+        """
+        :return: iterator of (opcode, integer arguments, floating point arguments) records
+        """
+        args = self.ARGS
+        ints = self.ints
+        floats = self.floats
+        i = f = 0
+        for op in self.ops:
+            ni, nf = args[op]
+            yield op, ints[i:i + ni], floats[f:f + nf]
+            i += ni
+            f += nf
+
+    def __len__(self):
+        return len(self.ops)
+
+    def pack(self):
+        """
+        :return: the records as a tuple of binary strings and the texts (quick to pickle)
+        """
+        return self.ops.tostring(), self.ints.typecode, self.ints.tostring(), self.floats.tostring(), self.texts
+
+    def save(self, filename):
+        """ Writes the stream to a file (see load_primitives) """
+        f = open(filename, 'wb')
+        try:
+            f.write(zlib.compress(cPickle.dumps((PRIMITIVE_STREAM_VERSION, self.pack()),
+                                                cPickle.HIGHEST_PROTOCOL), 1))
+        finally:
+            f.close()
+
+
+class PolygonSet(object):
+    """
+    Compact storage for a list of polygons. The vertices of all polygons are kept in one flat array of
+    coordinates [x0, y0, x1, y1, ...] (64 bit integers, or doubles once a non-integer coordinate is added) and
+    polygon i is made up of the coordinates offsets[i] to offsets[i+1]-1. This takes 16 bytes per vertex
+    rather than the 100+ bytes of a list of [x, y] lists.
+    Polygons are returned as lists of [x, y] points so a PolygonSet can be used wherever a list of polygons
+    is expected, including pyclipper. The coords array supports the buffer interface so it can be handed to
+    other libraries (e.g. numpy.frombuffer) without copying.
+    """
+
+    def __init__(self, polys=None):
+        self.offsets = array.array('l', [0])
+        """ :type offsets: array.array """
+        self.coords = array.array('l' if array.array('l').itemsize == 8 else 'd')
+        """ :type coords: array.array """
+        if polys is not None: self.extend(polys)
+
+    def extend(self, polys):
+        """
+        Appends polygons to the set
+        :param polys: list of polygons or PolygonSet
+        """
+        if isinstance(polys, PolygonSet):
+            vals = polys.coords
+            lengths = [polys.offsets[i + 1] - polys.offsets[i] for i in xrange(len(polys))]
+        else:
+            polys = list(polys)
+            vals = [v for poly in polys for pt in poly for v in pt]
+            lengths = [2*len(poly) for poly in polys]
+        if len(vals) == 0 and len(lengths) == 0: return
+
+        if isinstance(vals, array.array):
+            if vals.typecode != self.coords.typecode:
+                if self.coords.typecode != 'd': self.coords = array.array('d', self.coords)
+                vals = array.array('d', vals)
+            self.coords.extend(vals)
+        else:
+            try:
+                self.coords.fromlist(vals)
+            except (TypeError, OverflowError):
+                # non-integer coordinates - store all coordinates as doubles from now on
+                self.coords = array.array('d', self.coords)
+                self.coords.fromlist(vals)
+
+        end = self.offsets[-1]
+        offsets = []
+        for n in lengths:
+            end += n
+            offsets.append(end)
+        self.offsets.fromlist(offsets)
+
+    def append(self, poly):
+        """ Appends a polygon (list of [x, y] points) to the set """
+        self.extend([poly])
+
+    def vertexCount(self):
+        return len(self.coords) // 2
+
+    def bounds(self):
+        """
+        :return: [xmin, ymin, xmax, ymax] of all vertices or None if there are no vertices
+        """
+        if len(self.coords) == 0: return None
+        xs = self.coords[0::2]
+        ys = self.coords[1::2]
+        return [min(xs), min(ys), max(xs), max(ys)]
+
+    def boxes(self):
+        """ :return: list of [xmin, ymin, xmax, ymax] of each polygon (None for empty polygons) """
+        c = self.coords
+        o = self.offsets
+        boxes = []
+        for i in xrange(len(o) - 1):
+            s = o[i]
+            e = o[i + 1]
+            if s == e:
+                boxes.append(None)
+                continue
+            xs = c[s:e:2]
+            ys = c[s + 1:e:2]
+            boxes.append([min(xs), min(ys), max(xs), max(ys)])
+        return boxes
+
+    def tolist(self):
+        """ :return: the polygons as a list of lists of [x, y] points """
+        return [self[i] for i in xrange(len(self))]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return PolygonSet([self[j] for j in xrange(*i.indices(len(self)))])
+        if i < 0: i += len(self)
+        if i < 0 or i >= len(self): raise IndexError("polygon index out of range")
+        s = self.offsets[i]
+        e = self.offsets[i + 1]
+        c = self.coords
+        return [[x, y] for (x, y) in itertools.izip(c[s:e:2], c[s + 1:e:2])]
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+    def __eq__(self, other):
+        if isinstance(other, PolygonSet):
+            return self.offsets == other.offsets and self.coords.tolist() == other.coords.tolist()
+        try:
+            if len(other) != len(self): return False
+        except TypeError:
+            return False
+        return self.tolist() == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+
+class ApertureCache:
+    """
+    Least recently used cache of aperture polygons shared by all files parsed in this session. The
+    polygons are keyed by the aperture description together with every setting that affects the
+    tessellation, so the same shape is only computed once no matter how many boards use it.
+    The cache is optionally kept on disk between sessions (see ApertureCacheFile).
+    """
+
+    def __init__(self):
+        self.entries = collections.OrderedDict()
+        self.filename = None    # file the entries were loaded from
+        self.dirty = False      # True if entries were added since the cache was loaded or saved
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        :return: (polygon, round aperture data) or None if the aperture is not cached. The polygon is
+            a copy so the caller is free to keep it.
+        """
+        if ApertureCacheFile != self.filename: self.load()
+        value = self.entries.pop(key, None)
+        if value is None:
+            self.misses += 1
+            return None
+        self.entries[key] = value  # move to the most recently used end
+        self.hits += 1
+        return [[x, y] for (x, y) in value[0]], value[1]
+
+    def put(self, key, poly, round=None):
+        if ApertureCacheSize <= 0: return
+        self.entries.pop(key, None)
+        self.entries[key] = (tuple((x, y) for (x, y) in poly), round)
+        while len(self.entries) > ApertureCacheSize:
+            self.entries.popitem(False)  # evict least recently used
+        self.dirty = True
+
+    def clear(self):
+        self.entries.clear()
+        self.dirty = self.filename is not None
+
+    def load(self):
+        """ Replaces the entries with those stored in ApertureCacheFile (if it exists) """
+        self.filename = ApertureCacheFile
+        self.entries.clear()
+        self.dirty = False
+        if self.filename is None: return
+        try:
+            f = open(self.filename, 'rb')
+            try:
+                entries = cPickle.load(f)
+            finally:
+                f.close()
+        except (EnvironmentError, EOFError, cPickle.UnpicklingError, ValueError, TypeError):
+            return  # no cache yet or the cache is unreadable - it will be rebuilt
+        for key, value in entries[-ApertureCacheSize:] if ApertureCacheSize > 0 else []:
+            self.entries[key] = value
+
+    def save(self, diagnostics=None):
+        """
+        Writes the entries to ApertureCacheFile if they changed
+        :param diagnostics: Diagnostics a failure to write the file is reported to
+        """
+        if not self.dirty or self.filename is None or self.filename != ApertureCacheFile: return
+        tmpname = self.filename + ".tmp"
+        try:
+            f = open(tmpname, 'wb')
+            try:
+                cPickle.dump(list(self.entries.items()), f, cPickle.HIGHEST_PROTOCOL)
+            finally:
+                f.close()
+            if os.path.exists(self.filename): os.remove(self.filename)  # rename does not replace on Windows
+            os.rename(tmpname, self.filename)
+            self.dirty = False
+        except EnvironmentError as e:
+            if diagnostics is not None:
+                diagnostics.warn("Unable to save aperture cache " + self.filename + ": " + str(e))
+
+
+""" Aperture cache shared by all parsers """
+apertureCache = ApertureCache()
+
+
 class ParseData:
     """
     :type str: str
     :type pos: int
     :type buffer: str
     """
-    def __init__(self, str):
-        self.str = str.replace('\n','').replace('\r','')
+    def __init__(self, str, stripNewlines=True, chordError=None, diagnostics=None, primitives=False,
+                 skipFunctions=None):
+        """
+        :param str: gerber data. This may be any buffer that supports slicing (e.g. str or mmap) if
+            stripNewlines is False
+        :param stripNewlines: set to False if the parser skips whitespace itself (_parse1 does). This
+            avoids making a copy of the data.
+        :param chordError: maximum deviation of arc segments from the true arc in mm. None uses the
+            module setting MAX_CHORD_ERROR
+        :param diagnostics: Diagnostics the messages are collected in (becomes GerberData.diagnostics).
+            None creates one that prints nothing
+        :param primitives: True to record the draw commands in GerberData.primitives
+        :param skipFunctions: aperture functions of objects that are not loaded. None uses the module setting
+            SkipApertureFunctions
+        """
+        self.str = str.replace('\n','').replace('\r','') if stripNewlines else str
         self.strlen = len(self.str)
         self.gd = GerberData()
         self.pos = -1
         self.layerSet = 0
         self.fscl = 1
         self.vars = {}
+        self.chordError = MAX_CHORD_ERROR if chordError is None else chordError
 
         self.gd = GerberData()
+        self.stats = self.gd.stats
+        if diagnostics is not None: self.gd.diagnostics = diagnostics
+        self.diag = self.gd.diagnostics
+        self.commands = self.stats.commands  # counted by the parsers and the draw methods
+        self.primitives = self.gd.primitives = PrimitiveStream() if primitives else None
         self.trackData = []
 
         self.isDark = True
@@ -122,24 +626,35 @@ class ParseData:
 
         self.tracks = []
         self.regions = []
-        self.pads = []
+        self.flashes = []
         self.trackseg = -1
-        self.padseg = -1
         self.regionseg = -1
         self.aperture = -1
         self.tracksize = []
+        self.srBlock = None  # (xrep, yrep, xinc, yinc, first track, first region, first flash) of open SR block
+        self.srSections = []  # parts of the open SR block ended by polarity changes: (isDark, tracks, ...)
+        self.repeats = []  # closed SR blocks: (offsets, tracks, tracksize, regions, flashes)
+        self.pool = None  # worker pool building the layer geometry (see PipelineWorkers)
+        self.pending = []  # (AsyncResult, [tracks, pads, boundaries layer]) of layers being built by the pool
         self.macros = []
         self.macrosName = []
+        self.macroLines = []  # source of the macros (used to identify cached macro apertures)
         self.macroParams = []
         self.N_macros = 0
         self.apertures = [[] for i in range(50)]
+        self.apertureIds = {}  # aperture code -> index of aperture in gd.apertures
+        self.roundApertures = {}  # aperture code -> (diameter, # of circle segments) of plain circle apertures
         self.interpMode = 1
         self.arcMode = 0
         self.regionMode = False
 
-        self.errors = 0
-        self.warnings = 0
-        self.deps = 0
+        self.skipFunctions = frozenset(SkipApertureFunctions if skipFunctions is None else skipFunctions)
+        self.attributed = False  # True once the file has used an attribute command
+        self.apertureAttrs = {}  # aperture code -> aperture attributes of the aperture
+        self.apertureDict = {}  # current aperture attribute dictionary (TA)
+        self.objectDict = {}  # current object attribute dictionary (TO)
+        self.skipPath = False  # True if the current track or region contour is skipped
+
 
     def parseUntil(self, marker):
         st = self.pos
@@ -204,62 +719,73 @@ class ParseData:
             val += self.parseInt()*(10**(op - self.pos))
         return val * self.fscl if scaled else val
 
-    def parseFloatScaled(self, str):
+    def parseFloatStr(self, s, scaled=True):
         """
-        Parses string in scaled format of gerber_data file. Performs variable substitution if needed.
-        :param str: string to parse
-        :return: scaled float value
+        Same as parseFloat but operates on a standalone number string. The value is computed in the same
+        way as parseFloat so both parsers produce identical results.
+        :type s: str
         """
-        if str.find('$') != -1:
-            return self.parseEvalExpression(str)
+        dot = s.find('.')
+        if dot == -1:
+            val = int(s)
         else:
-            return float(str) * self.fscl
+            val = int(s[:dot]) if s[:dot] not in ('', '-', '+') else 0
+            if dot + 1 < len(s):
+                val += int(s[dot+1:])*(10**(dot + 1 - len(s)))
+        return val * self.fscl if scaled else val
 
-    def store_to_gd(self):
+    def store_to_gd(self, final=False):
+        """
+        Ends the current layer (polarity change or end of file). Inside a step and repeat block the layer is kept
+        open: the part of the block drawn so far is set aside and the block is repeated with all its polarity
+        sections when it is closed (see end_step_repeat)
+        """
+        if self.primitives is not None: self.primitives.add(self, PrimitiveStream.LAYER, (self.isDark, final))
+        if self.srBlock is not None and not final:
+            self.srSections.append(self.take_block())
+            self.begin_step_repeat(*self.srBlock[:4])
+            return
+        self.end_step_repeat()
+        self.store_layer(final)
+
+    def store_layer(self, final=False):
         # Stores the existing set of layer data as polygonal data points
         # This is the equivalent of rasterisation of the draw commands
-        # Expand tracks from centrelines based on aperture
-        track_outlines = []
+        # The geometry of all but the final layer is built in a worker pool if PipelineWorkers is set. Layers are
+        # added to gd straight away (in order) and their polygons filled in once built.
+        stt = time.time()
         tracks = self.tracks
-        apertures = self.apertures
-        tracksize = self.tracksize
-
-        for ii in range(len(self.tracks)):
-            tmp = tracks[ii]
-            prev = tmp[-1]
-            for jj in range(len(tmp) - 2, -1, -1):
-                if tmp[jj] == prev:
-                    del tmp[jj]
-                else:
-                    prev = tmp[jj]
+        remove_duplicate_points(tracks)
+
+        # Step and repeat blocks: copy the centrelines, regions and flashes to each position. The outlines of
+        # the tracks and pads are copied by build_layer
+        allTracks = list(tracks)
+        regions = list(self.regions)
+        flashes = list(self.flashes)
+        for (offsets, btracks, bsizes, bregions, bflashes) in self.repeats:
+            for (dx, dy) in offsets:
+                regions.extend(translate_polys(bregions, dx, dy))
+                flashes.extend([(aperture, x + dx, y + dy) for (aperture, x, y) in bflashes])
+                allTracks.extend(translate_polys(btracks, dx, dy))
+
+        # The lists handed to build_layer are not modified afterwards as they may still be waiting to be sent to
+        # a worker. The aperture tables are copied as they keep growing.
+        args = (tracks, self.tracksize, regions, self.flashes,
+                [(offsets, btracks, bsizes, bflashes) for (offsets, btracks, bsizes, bregions, bflashes) in self.repeats],
+                list(self.apertures), list(self.gd.apertures), dict(self.roundApertures))
+        self.repeats = []
+
+        workers = multiprocessing.cpu_count() if PipelineWorkers is None else PipelineWorkers
+        if self.pool is None and not final and workers > 1:
+            self.pool = multiprocessing.Pool(workers)
+        if self.pool is not None and not final:
+            result = self.pool.apply_async(_build_layer_packed, args)
+            track_outlines = pads = mergedBounds = None
+        else:
+            result = None
+            track_outlines, pads, mergedBounds = build_layer(*args, stats=self.stats)
 
-        for seg in range(len(tracks)):
-            aperture = apertures[tracksize[seg]]
-            itr = iter(tracks[seg])
-            start = next(itr)
-            for end in itr:
-                singletrack = pyclipper.MinkowskiSum(aperture, [start, end], -1)
-                if len(singletrack) > 1:
-                    biggest = []
-                    myarea = 0
-                    for mypath in singletrack:
-                        newarea = pyclipper.Area(mypath)
-                        if newarea > myarea:
-                            biggest = mypath
-                            myarea = newarea
-                    singletrack = [[]]
-                    singletrack[0] = biggest
-                track_outlines.extend(singletrack)
-                start = end
-
-        mergedBounds = union_boundary(track_outlines + self.pads, self.regions)
-        self.pads = union(self.pads)
-        track_outlines = union(track_outlines)
-        closeOffPolys(self.pads)
-        closeOffPolys(track_outlines)
-        closeOffPolys(mergedBounds)
-
-        self.trackData.extend(self.tracks)
+        self.trackData.extend(allTracks)
 
         # Store data into layers.
         prefix = str(self.layerSet)
@@ -273,30 +799,549 @@ class ParseData:
 
         # Option 2: Retain layers even if empty
         self.gd.layers.append(GerberLayer(self.isDark, prefix + "_Tracks", track_outlines, type=GerberLayer.TYPE_TRACK))
-        self.gd.layers.append(GerberLayer(self.isDark, prefix + "_Regions", self.regions, type=GerberLayer.TYPE_REGION))
-        self.gd.layers.append(GerberLayer(self.isDark, prefix + "_Pads", self.pads, type=GerberLayer.TYPE_PAD, color="#009000"))
+        self.gd.layers.append(GerberLayer(self.isDark, prefix + "_Regions", regions, type=GerberLayer.TYPE_REGION))
+        self.gd.layers.append(GerberLayer(self.isDark, prefix + "_Pads", pads, type=GerberLayer.TYPE_PAD, color="#009000"))
+        self.gd.layers[-1].flashes = flashes
         self.gd.layers.append(GerberLayer(self.isDark, prefix + "_Boundaries", mergedBounds, False, False, "blue", GerberLayer.TYPE_BOUNDARY))
+        if result is not None:
+            self.pending.append((result, [self.gd.layers[-4], self.gd.layers[-2], self.gd.layers[-1]]))
 
         # clear cache
         self.regions = []
-        self.pads = []
+        self.flashes = []
         self.tracks = []
         self.tracksize = []
         self.trackseg = -1
-        self.padseg = -1
         self.regionseg = -1
+        self.stats.add("store_to_gd", time.time() - stt)
+        if final:
+            self.collect_layers()
+
+    def collect_layers(self):
+        """
+        Waits for the layers being built by the worker pool, fills in their polygons and closes the pool
+        """
+        if self.pool is None: return
+        stt = time.time()
+        try:
+            for (result, layers) in self.pending:
+                packedLayers, stats = result.get()
+                for (layer, packed) in zip(layers, packedLayers):
+                    points = _unpack_polys(packed)
+                    layer.points = points if UsePackedPolygons else points.tolist()
+                self.stats.merge(stats)
+            self.pool.close()
+            self.stats.add("collect_layers", time.time() - stt)
+        finally:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+            self.pending = []
+
+    def step_repeat(self, params):
+        """
+        SR - closes the current step and repeat block (if any) and opens a new one
+        :param params: body of the SR command, e.g. "X3Y2I5.0J4.0". An empty body only closes the current block
+        """
+        if self.primitives is not None: self.primitives.addText(self, PrimitiveStream.STEP_REPEAT, params)
+        self.end_step_repeat()
+        if params == '': return
+        m = _SR_RE.match(params)
+        if m is None:
+            self.error("Invalid step and repeat parameters " + params)
+            return
+        xrep = int(m.group(1))
+        yrep = int(m.group(2))
+        if xrep < 1 or yrep < 1:
+            self.error("Step and repeat count must be at least 1 " + params)
+            return
+        if xrep * yrep > 1:
+            self.begin_step_repeat(xrep, yrep, float(m.group(3)) * self.fscl, float(m.group(4)) * self.fscl)
+
+    def begin_step_repeat(self, xrep, yrep, xinc, yinc):
+        if not self.regionMode: self.start_path()  # start a new track so no track is shared with the block
+        self.srBlock = (xrep, yrep, xinc, yinc, len(self.tracks) - (0 if self.regionMode else 1),
+                        len(self.regions), len(self.flashes))
+
+    def take_block(self):
+        """
+        Removes the objects drawn since the step and repeat block was opened
+        :return: (isDark, tracks, tracksize, regions, flashes) - the single point tracks (moves, and the track
+            begin_step_repeat starts) are left out so they aren't copied to every position
+        """
+        xrep, yrep, xinc, yinc, t0, r0, f0 = self.srBlock
+        tracks = self.tracks[t0:]
+        remove_duplicate_points(tracks)
+        keep = [k for k in range(len(tracks)) if len(tracks[k]) > 1]
+        section = (self.isDark, [tracks[k] for k in keep], [self.tracksize[t0 + k] for k in keep],
+                   self.regions[r0:], self.flashes[f0:])
+        del self.tracks[t0:]
+        del self.tracksize[t0:]
+        del self.regions[r0:]
+        del self.flashes[f0:]
+        self.trackseg = len(self.tracks) - 1
+        self.regionseg = len(self.regions) - 1
+        return section
+
+    def end_step_repeat(self):
+        """
+        Moves the objects drawn since the step and repeat block was opened into a block which is repeated
+        by store_layer. A block with polarity changes is repeated as a whole: each copy draws all the polarity
+        sections in order before the next copy, which takes one layer per copy and section. If the copies do not
+        overlap the order makes no difference and all copies of a section share a layer.
+        """
+        if self.srBlock is None: return
+        xrep, yrep, xinc, yinc, t0, r0, f0 = self.srBlock
+        sections = self.srSections + [self.take_block()]
+        self.srBlock = None
+        self.srSections = []
+        # coordinates are whole numbers of file units, so are the offsets
+        offsets = [(int(round(i*xinc)), int(round(j*yinc))) for j in range(yrep) for i in range(xrep)]
+        groups = [offsets]
+        if len(sections) > 1:
+            bounds = self.block_bounds(sections)
+            if bounds is not None and ((xrep > 1 and bounds[2] - bounds[0] >= abs(xinc)) or
+                                       (yrep > 1 and bounds[3] - bounds[1] >= abs(yinc))):
+                groups = [[offset] for offset in offsets]
+        first = True
+        for group in groups:
+            for (isDark, tracks, tracksize, regions, flashes) in sections:
+                if not first: self.store_layer()
+                first = False
+                self.isDark = isDark
+                self.repeats.append((group, tracks, tracksize, regions, flashes))
+        if not self.regionMode: self.start_path()
+
+    def block_bounds(self, sections):
+        """
+        :param sections: parts of a step and repeat block (see take_block)
+        :return: (xmin, ymin, xmax, ymax) of the objects of the sections including their apertures, or None if
+            there are none
+        """
+        boxes = []
+        for (isDark, tracks, tracksize, regions, flashes) in sections:
+            for k in range(len(tracks)):
+                box = polygon_bounds([tracks[k]])
+                abox = polygon_bounds([self.apertures[tracksize[k]]]) or [0, 0, 0, 0]
+                boxes.append([box[0] + abox[0], box[1] + abox[1], box[2] + abox[2], box[3] + abox[3]])
+            boxes.append(polygon_bounds(regions))
+            boxes.append(polygon_bounds(expand_flashes(flashes, self.gd.apertures)))
+        return polygon_bounds([[box[:2], box[2:]] for box in boxes if box is not None])
+
+    def interpolate(self):
+        """ D01 - draw from the previous point to the current point using the current interpolation mode """
+        self.commands["D01"] += 1
+        if self.skipPath:
+            self.i = 0
+            self.j = 0
+            return
+        if self.interpMode == 1:  # linear interpolation
+            if self.primitives is not None: self.primitives.add(self, PrimitiveStream.LINE, (self.x, self.y))
+            if self.regionMode:
+                self.regions[self.regionseg].append([self.x, self.y])
+            else:
+                self.tracks[self.trackseg].append([self.x, self.y])
+        elif self.arcMode == 0:  # Single Quadrant Mode
+            # the specifications for single quadrant mode is barbaric in that it is very difficult to
+            # implement consistently and yet they spout how inherently unstable multi quadrant mode is.
+            # Single quadrant mode is less stable because there are multiple solutions depending on where
+            # the centre is located because we're meant to pick the signs such that:
+            # - CW/CCW mode is respected and that
+            # - 0<arcAngle<90 degrees is maintained
+            # It is possible for multiple combination of signs to meet the conditions above
+
+            # We'll actually keep the signs. Use them as defaults.
+            # I.e. if conditions aren't met, we twiddle signs such that they do
+            # # discard sign data when it should really be used...
+            # if self.i < 0:
+            #     self.warn("Negative sign for offset i was ignored for SINGLE QUADRANT mode")
+            #     self.i *= -1
+            # if self.j < 0:
+            #     self.warn("Negative sign for offset j was ignored for SINGLE QUADRANT mode")
+            #     self.j *= -1
+
+            # brute force try the signs (4 possible cases forming a rectangle of width 2i and
+            # height of 2j around the starting point) to see which one fulfils all the condition
+            sbreak = False
+            for m in range(2):
+                centreX = self.xold + self.i*(1 if m == 0 else -1)
+                for n in range(2):
+                    centreY = self.yold + self.j*(1 if n == 0 else -1)
+                    startAngle = math.atan2(self.yold - centreY, self.xold - centreX)
+                    deltaAngle = math.atan2(self.y - centreY, self.x - centreX) - startAngle
+                    if deltaAngle > math.pi:
+                        deltaAngle = 2*math.pi - deltaAngle
+                    elif deltaAngle < -math.pi:
+                        deltaAngle += 2*math.pi
+                    r = math.sqrt((self.xold - centreX)**2 + (self.yold - centreY)**2)
+                    dr = math.sqrt((self.x - centreX)**2 + (self.y - centreY)**2) - r
+                    if abs(deltaAngle) < math.pi/1.95:
+                        if (self.interpMode == 2) == (deltaAngle < 0):  # correct CW/CCW mode
+                            if self.primitives is not None:
+                                self.primitives.add(self, PrimitiveStream.QUADRANT_ARC, (),
+                                                    (centreX, centreY, r, startAngle, deltaAngle, dr))
+                            self.add_arc3(self.regions[self.regionseg] if self.regionMode else self.tracks[self.trackseg],
+                                     centreX, centreY, r, startAngle, deltaAngle, dr)
+                            sbreak = True
+                            break
+                if sbreak: break
+            if not sbreak:
+                self.error("Single quadrant arc coordinates do not specify a valid arc configuration")
+        else:  # Multi Quadrant Mode
+            # Implementation note:
+            # Draws a circle that passes through the start and end point with radius of distance
+            # from offset centre point to start point (i.e. the offset centre point will
+            # be moved such that the distance to the and end point become equal to the distance
+            # to the start point)
+            # r = pow(self.i, 2) + pow(self.j, 2)
+
+            # The line that perpendicular bisects the line joining A (start) and B (end) is where
+            # the centre point will lie. The distance from centre point to A and B is r (circle radius)
+            # The distance from the line connecting AB to centre point is thus sqrt(r^2-L^2)
+            # Where L is the distance between midpoint and A or B.
+            # To optimise, square root is not taken until the end and 2L is distance between A and B
+            # and is the value that the normal must be divided by to normalise to length 1
+
+            if self.primitives is not None:
+                self.primitives.add(self, PrimitiveStream.ARC, (self.xold, self.yold, self.x, self.y,
+                                    self.xold + self.i, self.yold + self.j, self.interpMode == 2))
+            self.add_arc2(self.regions[self.regionseg] if self.regionMode else self.tracks[self.trackseg],
+                     self.xold + self.i, self.yold + self.j,
+                     self.xold, self.yold, self.x, self.y, self.interpMode == 2)
+
+            # # Mid Point - OLD METHOD
+            # mx = (self.xold + self.x)/2
+            # my = (self.yold + self.y)/2
+            # # Normal
+            # ny = self.x - self.xold
+            # nx = self.yold - self.y
+            # tmp = nx*nx + ny*ny  # size of vector squared
+            # tmp = math.sqrt(float(r)/tmp - 0.25)  # normalise normal and scale by radius
+            # if abs(self.i - nx*tmp) + abs(self.j - ny*tmp) > abs(self.i + nx*tmp) + abs(self.j + ny*tmp):
+            #     # pick the side the offset point lies on
+            #     tmp *= -1
+            # centreX = mx + nx*tmp
+            # centreY = my + ny*tmp
+            # add_arc(self.regions[self.regionseg] if self.regionMode else self.tracks[self.trackseg],
+            #            math.sqrt(r), centreX, centreY,
+            #            math.atan2(self.yold - centreY, self.xold - centreX),
+            #            math.atan2(self.y - centreY, self.x - centreX), self.interpMode == 2)
+        # Consume offset
+        self.i = 0
+        self.j = 0
+
+    def move(self):
+        """ D02 - finish the current track (or region contour) and start a new one at the current point """
+        self.commands["D02"] += 1
+        self.skipPath = self.attributed and not self.add_object()
+        if self.skipPath: return
+        if self.primitives is not None:
+            self.primitives.add(self, PrimitiveStream.MOVE, (self.x, self.y, self.aperture))
+        self.start_path()
+
+    def start_path(self):
+        """ Finishes the current track (or region contour) and starts a new one at the current point """
+        if self.regionMode:  # Finish current region and creates a new one
+            self.regions.append([])
+            self.regionseg += 1
+            self.regions[self.regionseg].append([self.x, self.y])
+        else:  # Finish current track and creates a new one
+            self.tracksize.append(self.aperture)
+            self.trackseg += 1
+            self.tracks.append([[self.x, self.y]])
+
+    def flash(self):
+        """
+        D03 - flash the current aperture at the current point. Only a reference to the aperture is stored,
+        the pad polygon is created by expand_flashes when needed.
+        """
+        self.commands["D03"] += 1
+        if self.attributed and not self.add_object(): return
+        if self.primitives is not None:
+            self.primitives.add(self, PrimitiveStream.FLASH, (self.x, self.y, self.aperture))
+        aperture = self.apertureIds.get(self.aperture)
+        if aperture is not None:  # flashing an undefined aperture produces nothing
+            self.flashes.append((aperture, self.x, self.y))
+
+    def add_aperture(self, code, desc):
+        """
+        Defines aperture Dnn from the body of an AD command (the text following the aperture code)
+        and makes it the current aperture
+        :param code: aperture code (nn)
+        :param desc: aperture description, e.g. "C,0.0059X0.0045" or "RECT,0.08X0.1"
+        """
+        # IMPORTANT: All apertures must be in the CCW or POSITIVE direction
+        stt = time.time()
+        if self.primitives is not None: self.primitives.addText(self, PrimitiveStream.APERTURE, desc, (code,))
+        self.aperture = code
+        while len(self.apertures) <= code:
+            self.apertures.append([])
+        if len(self.apertures[code]) != 0:
+            self.warn("Aperture " + str(code) + " is added more than once. The existing aperture "
+                                                "has been overwritten")
+        self.roundApertures.pop(code, None)
+        key = self.getApertureKey(desc)
+        cached = apertureCache.get(key)
+        if cached is not None:
+            self.apertures[code] = cached[0]
+            if cached[1] is not None: self.roundApertures[code] = cached[1]
+            self.diag.info("read aperture " + str(code) + ": " + desc + " (cached)", self.pos)
+            self.stats.counters["aperture.cached"] += 1
+        else:
+            self.apertures[code] = []  # always a new list as flashes of the old aperture may still refer to it
+            problems = self.diag.warnings + self.diag.errors
+            if desc[1:2] == ',':  # single letter macro names are treated as built in apertures
+                self.add_standard_aperture(code, desc[0], desc[2:].split('X'))
+            else:
+                self.add_macro_aperture(code, desc)
+            if problems == self.diag.warnings + self.diag.errors:  # only cache apertures that were read cleanly
+                apertureCache.put(key, self.apertures[code], self.roundApertures.get(code))
+            self.stats.counters["aperture.built"] += 1
+        self.apertureIds[code] = len(self.gd.apertures)
+        self.gd.apertures.append(self.apertures[code])
+        self.apertureAttrs[code] = dict(self.apertureDict)
+        self.gd.apertureAttributes.append(self.apertureAttrs[code])
+        self.stats.add("aperture", time.time() - stt, None, [self.apertures[code]])
+
+    def getApertureKey(self, desc):
+        """
+        :return: key identifying the aperture shape and all the settings that affect its geometry
+        """
+        if desc[1:2] != ',':  # macro - identify by the content of the macro rather than its name
+            colpos = desc.find(',')
+            name = desc if colpos == -1 else desc[:colpos]
+            if name in self.macrosName:
+                desc = (self.macroLines[self.macrosName.index(name)], desc[len(name):])
+        return desc, self.fscl, self.gd.units, ReaderCommon.MAX_ARC_LENGTH, self.chordError, \
+            ReaderCommon.MIN_SEG_PER_360, ReaderCommon.MIN_SEG
+
+    def add_standard_aperture(self, code, shape, mods):
+        """
+        :param shape: one of the standard aperture shapes C, R, O or P
+        :param mods: list of modifier strings
+        """
+        aperture = self.apertures[code]
+        holesize = -1
+        if shape == 'C':  # Circle
+            size = self.parseFloatStr(mods[0])
+            self.add_circle(aperture, size, False)
+            if len(mods) > 1:
+                holesize = self.parseFloatStr(mods[1])
+                self.add_circle(aperture, holesize, True)
+            else:
+                self.roundApertures[code] = (size, self.getCircleSegments(size))
+            self.diag.info("read aperture " + str(code) + ": circle diameter " + str(size) + ", hole size " +
+                           str(holesize), self.pos)
+        elif shape == 'R' or shape == 'O':
+            if len(mods) < 2:
+                self.error("Aperture " + shape + " requires both width and height")
+                return
+            w = self.parseFloatStr(mods[0]) / 2.0
+            h = self.parseFloatStr(mods[1]) / 2.0
+            if shape == 'R':  # Rectangle
+                aperture.extend([[-w, -h], [w, -h], [w, h], [-w, h], [-w, -h]])
+            elif w > h:  # Rectangle capped with semicircles - round the top and bottom sides
+                self.add_arc3(aperture,  w - h, 0, h, -math.pi/2, math.pi)
+                self.add_arc3(aperture, -w + h, 0, h,  math.pi/2, math.pi)
+                aperture.append([w - h, -h])
+            else:  # Rectangle capped with semicircles - round the left and right sides
+                self.add_arc3(aperture, 0,  h - w, w,       0, math.pi)
+                self.add_arc3(aperture, 0, -h + w, w, math.pi, math.pi)
+                aperture.append([w, h - w])
+
+            if len(mods) > 2:
+                holesize = self.parseFloatStr(mods[2])
+                self.add_circle(aperture, holesize, True)
+            self.diag.info("read aperture " + str(code) + (": rectangle" if shape == 'R' else ": o-rectangle") +
+                           " W " + str(w) + ", H " + str(h) + ", hole size " + str(holesize), self.pos)
+        elif shape == 'P':  # Regular polygon
+            if len(mods) < 2:
+                self.error("Aperture P requires both diameter and number of vertices")
+                return
+            size = self.parseFloatStr(mods[0]) / 2.0
+            n = int(mods[1])
+            rot = 0
+            if len(mods) > 2:
+                rot = self.parseFloatStr(mods[2], False)
+            for i in range(n):
+                angle = i * -2.0 * math.pi / (n - 1.0)
+                x = size * math.cos(angle + rot)
+                y = size * math.sin(angle + rot)
+                aperture.append([x, y])
+
+            if len(mods) > 3:
+                holesize = self.parseFloatStr(mods[3])
+                self.add_circle(aperture, holesize, True)
+            self.diag.info("read aperture " + str(code) + ": polygon n " + str(n) + " diameter " + str(size) +
+                           ", rot " + str(rot) + " hole size " + str(holesize), self.pos)
+        else:
+            self.error("Unknown aperture shape " + shape)
+
+    def add_macro_aperture(self, code, desc):
+        """
+        Instantiates an aperture macro by running its compiled program (see compile_macro) with the
+        parameters supplied in the AD command
+        :param desc: macro name optionally followed by comma and parameters separated by X
+        """
+        self.vars = {}
+        colpos = desc.find(',')
+        if colpos == -1:
+            mindex = self.macrosName.index(desc)
+            self.diag.info("read aperture " + str(code) + ", name = " + desc + " (" + str(mindex) + "), params=nil",
+                           self.pos)
+        else:
+            mindex = self.macrosName.index(desc[:colpos])
+            self.assignVariables(desc[colpos+1:])
+            self.diag.info("read aperture " + str(code) + ", name = " + desc[:colpos] + " (" + str(mindex) +
+                           "), params=" + desc[colpos+1:], self.pos)
+
+        vars = self.vars
+        fscl = self.fscl
+        aperture = self.apertures[code]
+        for prim, isAdd, args in self.macros[mindex]:
+            if prim == '$':  # variable set - isAdd holds the variable name
+                vars[isAdd] = args(vars, fscl)
+                continue
+            elif prim == '!':  # primitive that failed to compile - args holds the error message
+                self.error(args)
+                continue
+            if not isAdd and len(aperture) == 0: continue  # subtracting from nothing
+
+            v = [f(vars, fscl) for f in args]
+            if prim == 1:  # circle primitive
+                r = v[0] / 2.0
+                centreX, centreY, rot = v[1], v[2], v[3]
+                tmp = []
+                if rot != 0: centreX, centreY = rotPoint([centreX, centreY], rot)
+                self.add_arc3(tmp, centreX, centreY, r, 0, math.pi*2)
+                mergePolys(aperture, tmp, isAdd)
+            elif prim == 20:  # line primitive - start and end point
+                w, x1, y1, x2, y2, rot = v
+                dx = x2 - x1
+                dy = y2 - y1
+                mag = w / math.sqrt(dx*dx + dy*dy) / 2.0
+                dx *= mag
+                dy *= mag
+                tmp = [[x1 + dy, y1 - dx], [x2 + dy, y2 - dx], [x2 - dy, y2 + dx], [x1 - dy, y1 + dx]]
+                if rot != 0: rotPoints(tmp, rot)
+                tmp.append(tmp[0])
+                mergePolys(aperture, tmp, isAdd)
+            elif prim == 21:  # line primitive - centre, w and h
+                w = v[0] / 2.0
+                h = v[1] / 2.0
+                centreX, centreY, rot = v[2], v[3], v[4]
+                tmp = [[centreX + w, centreY + h], [centreX - w, centreY + h],
+                       [centreX - w, centreY - h], [centreX + w, centreY - h]]
+                if rot != 0: rotPoints(tmp, rot)
+                tmp.append(tmp[0])  # close off polygon
+                mergePolys(aperture, tmp, isAdd)
+            elif prim == 22:  # line primitive - bottom left, w and h
+                # This primitive isn't explicitly explained in gerber specs but reversed engineered
+                # from the examples.
+                w, h, tx, ty, rot = v
+                tmp = [[tx + w, ty + h], [tx, ty + h], [tx, ty], [tx + w, ty]]
+                if rot != 0: rotPoints(tmp, rot)
+                tmp.append(tmp[0])  # close off polygon
+                mergePolys(aperture, tmp, isAdd)
+            elif prim == 4:  # outline primitive - v holds the x,y pairs followed by the rotation
+                rot = v[-1]
+                tmp = [[v[x], v[x + 1]] for x in range(0, len(v) - 1, 2)]
+
+                # We require all aperture polygons to be CCW. Since outline is a user supplied
+                # value, the data may not conform to this so we need to reverse the list if
+                # the data is supplied in CW direction.
+                if not pyclipper.Orientation(tmp): tmp.reverse()
+
+                if rot != 0: rotPoints(tmp, rot)
+                tmp.append(tmp[0])  # close off polygon
+                mergePolys(aperture, tmp, isAdd)
+            elif prim == 5:  # polygon primitive
+                n = int(v[0])
+                centreX, centreY = v[1], v[2]
+                r = v[3] / 2.0
+                rot = v[4]
+                if rot != 0 and (centreX != 0 or centreY != 0):
+                    self.warn("Rotation can only be used on polygon primitive if it is centred at (0,0). "
+                            "The rotation was applied as if the polygon was rotated first and then "
+                            "translated to specified centre coordinates")
+
+                tmp = []
+                stepAngle = -2.0 * math.pi / (n - 1.0)
+                for i in range(n):
+                    angle = i*stepAngle
+                    x = r * math.cos(angle + rot) + centreX
+                    y = r * math.sin(angle + rot) + centreY
+                    tmp.append([x, y])
+                mergePolys(aperture, tmp, isAdd)
+
+    def add_macro(self, name, lines):
+        """
+        Stores an aperture macro. The macro is compiled once here so AD commands using it only need to
+        run the compiled program.
+        :param name: macro name
+        :param lines: list of macro content lines (without the '*' terminators)
+        """
+        if self.primitives is not None: self.primitives.addText(self, PrimitiveStream.MACRO, (name, tuple(lines)))
+        self.macrosName.append(name)
+        self.macroLines.append(tuple(lines))
+        self.macros.append(compile_macro(lines))
+        self.N_macros += 1
+
+
+    def set_attribute(self, cmd, body):
+        """
+        X2 attribute commands. TA attributes are attached to the apertures defined afterwards (and to regions), TO
+        attributes to the objects drawn afterwards
+        :param cmd: TF (file), TA (aperture), TO (object) or TD (delete)
+        :param body: attribute name followed by its values separated by commas. For TD the name of the aperture or
+            object attribute to delete or empty to delete them all
+        """
+        if self.primitives is not None: self.primitives.addText(self, PrimitiveStream.ATTRIBUTE, (cmd, body))
+        self.attributed = True
+        fields = body.split(',')
+        name = fields[0]
+        if cmd == "TD":
+            if name == '':
+                self.apertureDict = {}
+                self.objectDict = {}
+            else:
+                self.apertureDict.pop(name, None)
+                self.objectDict.pop(name, None)
+        elif name == '':
+            self.error("Attribute name missing in " + cmd + " command")
+        elif cmd == "TF":
+            self.gd.fileAttributes[name] = tuple(fields[1:])
+        elif cmd == "TA":
+            self.apertureDict[name] = tuple(fields[1:])
+        else:
+            self.objectDict[name] = tuple(fields[1:])
+
+    def add_object(self):
+        """
+        Checks the attributes of the object about to be drawn (flash, track or region contour). The aperture
+        attributes of regions are those of the current attribute dictionary, otherwise those of the current aperture
+        :return: False if the object is skipped (see skipFunctions), otherwise True and the object is counted in
+            GerberData.attributeIndex
+        """
+        attrs = self.apertureDict if self.regionMode else self.apertureAttrs.get(self.aperture, {})
+        function = attrs.get(".AperFunction")
+        if function and function[0] in self.skipFunctions:
+            self.stats.counters["skipped." + function[0]] += 1
+            return False
+        index = self.gd.attributeIndex
+        for (name, values) in attrs.items(): index[(name, ",".join(values))] += 1
+        for (name, values) in self.objectDict.items(): index[(name, ",".join(values))] += 1
+        return True
 
     def warn(self, msg):
-        self.warnings += 1
-        if PrintWarnings: print("  WARNING: " + msg + "   (pos = " + str(self.pos) + ")")
+        self.diag.warn(msg, self.pos)
 
     def error(self, msg):
-        self.errors += 1
-        if PrintErrors: print("  ERROR: " + msg + "   (pos = " + str(self.pos) + ") " + self.str[max(0,self.pos - 20):self.pos])
+        self.diag.error(msg, self.pos, self.str[max(0,self.pos - 20):self.pos])
 
     def error_line(self, msg, marker='*'):
-        self.errors += 1
-        if PrintErrors: print("  WARNING: " + msg + "Ignoring data: " + self.parseUntil(marker))
+        pos = self.pos
+        self.diag.error(msg + "Data was ignored", pos, self.parseUntil(marker))
 
     def check_char(self, chr='*'):
         if self.getChar() == chr:
@@ -305,23 +1350,36 @@ class ParseData:
             self.error("Command missing '" + chr + "' symbol")
 
     def dep(self, msg):
-        self.deps += 1
-        if PrintDeprecatedUses: print("  DEPRECATED COMMAND: " + msg + "   (pos = " + str(self.pos) + ")")
+        self.diag.dep(msg, self.pos)
 
     def getMaxArcLength(self):
-        maxLenScalar = MAX_ARC_LENGTH * self.fscl
+        maxLenScalar = ReaderCommon.MAX_ARC_LENGTH * self.fscl
         if self.gd.units == 1: maxLenScalar /= 25.4
         return int(maxLenScalar)
 
+    def getMaxSegmentAngle(self, r):
+        """
+        Largest angle an arc segment of radius r may span without deviating from the true arc by more than
+        the chord error. Only valid if a chord error is set.
+        """
+        tol = self.chordError * self.fscl
+        if self.gd.units == 1: tol /= 25.4
+        if tol >= r: return math.pi
+        return 2*math.acos(1 - tol/r)
+
+    def getCircleSegments(self, diameter):
+        """ Number of segments used to draw a full circle """
+        if self.chordError is not None:
+            return max(int(math.ceil(2*math.pi/self.getMaxSegmentAngle(diameter/2.0))), ReaderCommon.MIN_SEG_PER_360)
+        return max(int(diameter/(2*self.getMaxArcLength())), ReaderCommon.MIN_SEG_PER_360)
+
     def add_circle(self, ptlist, diameter, isCW=True):
-        steps = max(int(diameter/(2*self.getMaxArcLength())), MIN_SEG_PER_360) + 1
+        steps = self.getCircleSegments(diameter) + 1
         angleStep = 2.0 * math.pi / (steps - 1) * (-1 if isCW else 1)
         # print "  Circle: # of segs = ", steps, "dia", diameter
-        for i in range(steps):
-            angle = i*angleStep
-            x = (diameter / 2.0) * math.cos(angle)
-            y = (diameter / 2.0) * math.sin(angle)
-            ptlist.append([x, y])
+        r = diameter / 2.0
+        tcos, tsin = unit_arc(steps, angleStep)
+        ptlist.extend([[r*c, r*s] for (c, s) in itertools.izip(tcos, tsin)])
 
     def add_arc2(self, ptlist, centreX, centreY, startX, startY, endX, endY, isCW=True):
         startX -= centreX
@@ -340,22 +1398,34 @@ class ParseData:
 
         self.add_arc3(ptlist, centreX, centreY, r1, startAngle, deltaAngle, dr)
 
-    def add_arc3(self, ptlist, centreX, centreY, r, startAngle, deltaAngle, dr=0.0):
+    def getArcSteps(self, r, deltaAngle, dr=0.0):
+        """ Number of points used to draw an arc (i.e. one more than the number of segments) """
         # steps is chosen such that minimum arc segments (overall and fraction) are held.
-        # More steps are added if arc length will be larger than MAX_ARC_LENGTH
-        steps = max(MIN_SEG, int(abs(deltaAngle)*max(max(r, r+dr)/self.getMaxArcLength(),
-                                                     MIN_SEG_PER_360/(2*math.pi)))) + 1
-        dr /= (steps - 1)
-        deltaAngle /= (steps - 1)
+        # More steps are added if arc length will be larger than MAX_ARC_LENGTH or if the segments deviate
+        # from the arc by more than the chord error
+        if self.chordError is not None:
+            maxAngle = min(self.getMaxSegmentAngle(max(r, r+dr)), 2*math.pi/ReaderCommon.MIN_SEG_PER_360)
+            return max(ReaderCommon.MIN_SEG, int(math.ceil(abs(deltaAngle)/maxAngle))) + 1
+        return max(ReaderCommon.MIN_SEG, int(abs(deltaAngle)*max(max(r, r+dr)/self.getMaxArcLength(),
+                                                                 ReaderCommon.MIN_SEG_PER_360/(2*math.pi)))) + 1
+
+    def add_arc3(self, ptlist, centreX, centreY, r, startAngle, deltaAngle, dr=0.0):
+        steps = self.getArcSteps(r, deltaAngle, dr)
 
         # print "  ARC: ", centreX, ",", centreY, "  angle: ", (180*startAngle/(2*math.pi)), \
         #     " deltaAngle: ", (180*deltaAngle/(2*math.pi)), " r ", r, ", ", "  steps ", steps
-        # print "arc length ", r*deltaAngle/self.fscl, "  steps ", steps, "  angle ", deltaAngle*180/(2*math.pi)
 
-        for i in range(steps):
-            xarcseg = centreX + (r + i*dr)*math.cos(startAngle + i*deltaAngle)
-            yarcseg = centreY + (r + i*dr)*math.sin(startAngle + i*deltaAngle)
-            ptlist.append([xarcseg, yarcseg])
+        ptlist.extend(arc_points(centreX, centreY, r, startAngle, deltaAngle / (steps - 1), steps,
+                                 dr / (steps - 1)))
+
+    def arc_coords(self, centreX, centreY, r, startAngle, deltaAngle, dr=0.0):
+        """
+        Same as add_arc3 but returns the points as a flat coordinate array [x0, y0, x1, y1, ...]
+        (a numpy array if numpy is available)
+        """
+        steps = self.getArcSteps(r, deltaAngle, dr)
+        return arc_points(centreX, centreY, r, startAngle, deltaAngle / (steps - 1), steps,
+                          dr / (steps - 1), True)
 
     def assignVariables(self, s):
         ss = s.split('X')
@@ -363,49 +1433,203 @@ class ParseData:
             self.vars['$' + str(i + 1)] = float(ss[i]) * self.fscl
         # for i in self.vars: print "assign", i, self.vars[i]
 
-    def parseAssignExpression(self, s):
-        pos = s.find('=')
-        self.vars[s[:pos]] = self.parseEvalExpression(s[pos+1:])
-        # print "set", s[:pos], self.vars[s[:pos]]
-        pass
 
-    def parseEvalExpression(self, s):
-        """
-        :type s: str
-        """
-        pos = 0
-        slen = len(s)
-        ns = ""
-        while pos < slen:
-            tmp = s[pos]
-            if tmp == '$':
-                # Replace with variable value - variable names consists of $ symbol followed by digits
-                varlen = 1
-                while pos + varlen < slen and s[pos+varlen].isdigit(): varlen += 1
-                # print 'var', s[pos:pos + varlen]
-                ns += str(self.vars.get(s[pos:pos + varlen], 0))
-                pos += varlen
-            elif tmp == 'x':
-                # Use multiplication symbol '*' not 'x'
-                ns += '*'
-                pos += 1
-            elif tmp == '-' or tmp == '+' or tmp == '/' or tmp == '(' or tmp == ')' or \
-                            tmp == '.' or tmp.isdigit():
-                ns += s[pos]
-                pos += 1
-            else:
-                # We filter out invalid characters to prevent user from inputting in bad text that
-                # could crash python
-                self.error("Expression contains invalid characters '" + tmp + "' from string: " + s)
-                return 0
+# ===== Aperture macro compiler =====
+# Each %AM macro is compiled once into a list of steps. A step is a tuple (prim, isAdd, args):
+#   ('$', name, fn)         variable assignment - fn(vars, fscl) gives the value of the variable
+#   ('!', None, msg)        primitive that could not be compiled - msg is reported each time it is used
+#   (prim, isAdd, [fn...])  primitive - each fn(vars, fscl) gives one modifier of the primitive
+# Expressions are compiled into closures so no eval takes place when an aperture is instantiated.
+
+_EXPR_TOKEN_RE = re.compile(r'\s*(?:(\d+\.?\d*|\.\d+)|(\$\d+)|([-+xX/()]))')
+
+_EXPR_OPS = {
+    '+': operator.add,
+    '-': operator.sub,
+    'x': operator.mul,
+    'X': operator.mul,
+    '/': operator.truediv,
+}
+
+""" Number of modifiers (excluding exposure) and the modifiers that are NOT scaled by the coordinate format
+(i.e. rotations and counts) for each macro primitive. The rotation of the circle primitive is optional. """
+_MACRO_PRIMITIVES = {
+    1: (4, (3,)),
+    20: (6, (5,)),
+    21: (5, (4,)),
+    22: (5, (4,)),
+    5: (5, (0, 4)),
+}
+
+
+def _tokenize_expression(s):
+    tokens = []
+    s = s.strip()
+    pos = 0
+    while pos < len(s):
+        m = _EXPR_TOKEN_RE.match(s, pos)
+        if m is None:
+            raise ValueError("Expression contains invalid characters '" + s[pos:].strip()[:1] + "' from string: " + s)
+        pos = m.end()
+        num, var, op = m.groups()
+        if num is not None:
+            tokens.append(('n', float(num)))
+        elif var is not None:
+            tokens.append(('v', var))
+        else:
+            tokens.append(('o', op))
+    return tokens
+
+
+def _binary_node(op, a, b):
+    """
+    Combines two expression nodes. A node is a (value, fn) pair where fn is None for constants
+    (which are folded at compile time) or a function fn(vars) otherwise.
+    """
+    f = _EXPR_OPS[op]
+    if a[1] is None and b[1] is None:
+        return f(a[0], b[0]), None
+    fa = a[1]
+    fb = b[1]
+    if fa is None:
+        ca = a[0]
+        return None, lambda vars: f(ca, fb(vars))
+    if fb is None:
+        cb = b[0]
+        return None, lambda vars: f(fa(vars), cb)
+    return None, lambda vars: f(fa(vars), fb(vars))
+
+
+def _parse_expression(tokens, i):
+    node, i = _parse_term(tokens, i)
+    while i < len(tokens) and tokens[i][0] == 'o' and tokens[i][1] in '+-':
+        op = tokens[i][1]
+        right, i = _parse_term(tokens, i + 1)
+        node = _binary_node(op, node, right)
+    return node, i
+
+
+def _parse_term(tokens, i):
+    node, i = _parse_factor(tokens, i)
+    while i < len(tokens) and tokens[i][0] == 'o' and tokens[i][1] in 'xX/':
+        op = tokens[i][1]
+        right, i = _parse_factor(tokens, i + 1)
+        node = _binary_node(op, node, right)
+    return node, i
+
+
+def _parse_factor(tokens, i):
+    if i >= len(tokens):
+        raise ValueError("Unexpected end of expression")
+    kind, val = tokens[i]
+    if kind == 'n':
+        return (val, None), i + 1
+    elif kind == 'v':
+        return (None, lambda vars: vars.get(val, 0)), i + 1
+    elif val == '(':
+        node, i = _parse_expression(tokens, i + 1)
+        if i >= len(tokens) or tokens[i] != ('o', ')'):
+            raise ValueError("Missing ')' in expression")
+        return node, i + 1
+    elif val == '-' or val == '+':
+        node, i = _parse_factor(tokens, i + 1)
+        return (_binary_node(val, (0.0, None), node)), i
+    raise ValueError("Unexpected '" + val + "' in expression")
+
+
+def compile_expression(s):
+    """
+    Compiles an aperture macro arithmetic expression (e.g. "$2-$3x2") into a function. Constant terms
+    are NOT scaled; variables hold scaled values already.
+    :param s: expression string
+    :return: function fn(vars, fscl) where vars is a dict of variable name ('$n') -> value
+    :raises ValueError: if the expression is malformed
+    """
+    tokens = _tokenize_expression(s)
+    (val, fn), i = _parse_expression(tokens, 0)
+    if i != len(tokens):
+        raise ValueError("Unexpected '" + str(tokens[i][1]) + "' in expression: " + s)
+    if fn is None:
+        return lambda vars, fscl: val
+    return lambda vars, fscl: fn(vars)
+
+
+def compile_value(s, scaled=True):
+    """
+    Compiles a macro modifier. Plain numbers are scaled by the coordinate format if scaled is True,
+    expressions are compiled with compile_expression.
+    :return: function fn(vars, fscl)
+    """
+    try:
+        val = float(s)
+    except ValueError:
+        return compile_expression(s)
+    if scaled:
+        return lambda vars, fscl: val * fscl
+    return lambda vars, fscl: val
+
+
+def compile_macro(lines):
+    """
+    Compiles the content of an aperture macro into a list of steps executed by
+    ParseData.add_macro_aperture
+    :param lines: list of macro content lines (without the '*' terminators)
+    :return: list of (prim, isAdd, args) steps
+    """
+    program = []
+    for line in lines:
+        line = line.strip()
+        if len(line) == 0 or line[0] == '0':
+            continue  # macro comment - ignore
+        try:
+            if line[0] == '$':
+                # variable set
+                pos = line.find('=')
+                if pos == -1: raise ValueError("Missing '=' in variable definition " + line)
+                program.append(('$', line[:pos].strip(), compile_expression(line[pos+1:])))
+                continue
 
-        return eval(ns)
+            vals = line.split(',')
+            prim = int(vals[0])
+            isAdd = len(vals) > 1 and vals[1].strip() == "1"
+            mods = vals[2:]
+            if prim == 4:  # outline primitive
+                n = int(mods[0]) if len(mods) > 0 else 0
+                if len(vals) != (n+1)*2 + 4 and len(vals) != (n+1)*2 + 3:
+                    raise ValueError("Invalid number of arguments in polygon primitive.")
+                # Note: we ignore the last point if n+1 points was specified. The last point is
+                # redundant as it just loops back to start and we add the closing point regardless
+                # of whether it was provided or not. It also ensures that if the supplied data does
+                # not conform with specifications, it is effectively fixed silently.
+                args = [compile_value(mods[k]) for k in range(1, 2*n + 1)]
+                args.append(compile_value(mods[-1], False))
+            elif prim in _MACRO_PRIMITIVES:
+                nmods, unscaled = _MACRO_PRIMITIVES[prim]
+                if prim == 1 and len(mods) == 3: mods.append("0")  # rotation is optional
+                if len(mods) < nmods:
+                    raise ValueError("Missing modifiers in macro primitive " + line)
+                args = [compile_value(mods[k], k not in unscaled) for k in range(nmods)]
+            elif prim == 6:
+                raise ValueError("Moire primitive is not implemented yet")
+            elif prim == 7:
+                raise ValueError("Thermal primitive is not implemented yet")
+            else:
+                raise ValueError("Unknown macro primitive: " + str(prim))
+            program.append((prim, isAdd, args))
+        except ValueError as e:
+            program.append(('!', None, str(e)))
+    return program
 
 
-def union(paths, union_type=pyclipper.PFT_NONZERO):
+def union(paths, union_type=pyclipper.PFT_NONZERO, strictlySimple=False, pool=None):
     # performs union on list, or list of lists
+    # Large nonzero unions are partitioned into tiles (see tile_union), which are unioned in pool if given
+    # strictlySimple=True is the equivalent of pyclipper.SimplifyPolygons
     if len(paths) != 0:
+        if union_type == pyclipper.PFT_NONZERO and 0 < TileUnionMinPolygons <= len(paths):
+            return tile_union(paths, strictlySimple, pool)
         c = pyclipper.Pyclipper()
+        c.StrictlySimple = strictlySimple
         c.AddPaths(paths, pyclipper.PT_SUBJECT, True)
         paths = c.Execute(pyclipper.CT_UNION, union_type, union_type)
         c.Clear()
@@ -413,6 +1637,251 @@ def union(paths, union_type=pyclipper.PFT_NONZERO):
     # return pyclipper.SimplifyPolygons(paths, union_type)
 
 
+# ===== Partitioned union =====
+# The cost of a Clipper union grows faster than the number of edges, so a large union is split up spatially.
+# Polygons are binned into a 2^k x 2^k grid of tiles by the centre of their bounding box and every tile is unioned
+# on its own. The tiles are then merged pairwise in Z order (each merge joins two adjacent blocks of tiles) until
+# a single block remains. Only the regions of a block that reach into the bounds of the other block take part in
+# a merge - the rest cannot touch anything in the other block and are passed through.
+# Polygons are never cut at the tile edges, so there are no seams to stitch. A polygon winding the other way to
+# most (a hole, e.g. from a clear layer or a region drawn clockwise) only cancels the polygons it overlaps, so it
+# is binned together with every polygon whose box overlaps its box (see _overlap_groups). The result of each union
+# is kept as regions - an outer polygon together with its holes - and regions are only passed through or merged
+# as a whole, so a hole is never separated from its outer polygon. The result covers the same area as a single
+# union. The unions of each level are independent and can be run in a pool of worker processes owned by the
+# caller (see union_pool).
+# Clipper's StrictlySimple pass is quadratic in the number of vertices of each polygon, which dominates the union
+# of a large pour. Partitioned unions are run without it and strictly simple results are made by splitting each
+# polygon at its repeated vertices (see _split_touching), which leaves the winding of every point unchanged.
+
+
+def tile_union(paths, strictlySimple=False, pool=None):
+    """
+    Nonzero union of a large number of polygons (see Partitioned union)
+    :param paths: list of polygons or PolygonSet
+    :param strictlySimple: see union()
+    :param pool: multiprocessing.Pool the tiles are unioned in (see union_pool) or None to union them in this process
+    :return: list of polygons
+    """
+    polys = []
+    boxes = []
+    for poly in paths:
+        if len(poly) < 3: continue
+        xs = [pt[0] for pt in poly]
+        ys = [pt[1] for pt in poly]
+        polys.append(poly)
+        boxes.append((min(xs), min(ys), max(xs), max(ys)))
+    if len(polys) == 0: return []
+    box = _total_bounds(boxes)
+
+    side = 1
+    while side * side * TileUnionPolygons < len(polys): side *= 2
+    sx = float(side) / max(box[2] - box[0], 1)
+    sy = float(side) / max(box[3] - box[1], 1)
+    tiles = [[] for i in range(side * side)]
+    for group in _overlap_groups(polys, boxes):
+        b = _total_bounds([boxes[i] for i in group])
+        tx = min(int(((b[0] + b[2]) * 0.5 - box[0]) * sx), side - 1)
+        ty = min(int(((b[1] + b[3]) * 0.5 - box[1]) * sy), side - 1)
+        tiles[_zorder(tx, ty)].extend(polys[i] for i in group)
+
+    if pool is None or side == 1:
+        blocks = [_union_tile(tile) for tile in tiles]
+        while len(blocks) > 1:
+            blocks = [_merge_blocks(blocks[i], blocks[i + 1]) for i in range(0, len(blocks), 2)]
+        result = [poly for region in blocks[0][0] for poly in region]
+    else:
+        # Blocks are sent to and from the workers packed
+        blocks = pool.map(_union_tile_packed, [_pack_polys(tile) for tile in tiles])
+        while len(blocks) > 1:
+            blocks = pool.map(_merge_blocks_packed, [(blocks[i], blocks[i + 1]) for i in range(0, len(blocks), 2)])
+        result = _unpack_polys(blocks[0][0][0]).tolist()
+    if strictlySimple: result = [loop for poly in result for loop in _split_touching(poly)]
+    return result
+
+
+def _split_touching(poly):
+    """
+    Splits a polygon where it touches itself (at a repeated vertex) into loops without repeated vertices. Each loop
+    keeps its direction, so a pocket closed off by the touch becomes a hole. Loops of no area are dropped.
+    :return: list of polygons
+    """
+    loops = []
+    path = []
+    index = {}  # vertex -> position in path
+    for pt in poly:
+        key = (pt[0], pt[1])
+        i = index.get(key)
+        if i is None:
+            index[key] = len(path)
+            path.append(pt)
+            continue
+        loop = path[i:]
+        for p in path[i + 1:]: del index[(p[0], p[1])]
+        del path[i + 1:]
+        if len(loop) > 2 and pyclipper.Area(loop) != 0: loops.append(loop)
+    if len(path) > 2 and pyclipper.Area(path) != 0: loops.append(path)
+    return loops
+
+
+def union_pool():
+    """
+    Starts a pool of UnionWorkers processes for partitioned unions (see merge_copper). The caller owns the pool and
+    stops it (terminate and join) when done. The workers import the main module on Windows, so the entry point of
+    the program must be guarded (if __name__ == '__main__')
+    :return: multiprocessing.Pool or None if UnionWorkers is 0 or 1
+    """
+    workers = multiprocessing.cpu_count() if UnionWorkers is None else UnionWorkers
+    if workers <= 1: return None
+    return multiprocessing.Pool(workers)
+
+
+def _overlap_groups(polys, boxes):
+    """
+    Groups the polygons that must be unioned together. Every polygon winding the less common way is grouped with
+    all polygons whose box overlaps its box (and so with anything it could cancel). Any other polygon is a group
+    of its own.
+    :return: list of lists of polygon indices
+    """
+    n = len(polys)
+    orient = [pyclipper.Orientation(poly) for poly in polys]
+    odd = orient.count(True) * 2 < n  # orientation of the less common winding
+    odds = [i for i in range(n) if orient[i] == odd]
+    if len(odds) == 0: return [[i] for i in range(n)]
+
+    # Grid of cells holding the polygons winding the odd way
+    box = _total_bounds([boxes[i] for i in odds])
+    side = max(1, int(math.sqrt(len(odds))))
+    cell = max(box[2] - box[0], box[3] - box[1], 1) / float(side)
+    cells = {}
+
+    def cellRange(b):
+        return (max(int((b[0] - box[0]) // cell), 0), max(int((b[1] - box[1]) // cell), 0),
+                min(int((b[2] - box[0]) // cell), side), min(int((b[3] - box[1]) // cell), side))
+
+    for i in odds:
+        ca, ra, cb, rb = cellRange(boxes[i])
+        for c in xrange(ca, cb + 1):
+            for r in xrange(ra, rb + 1):
+                cells.setdefault((c, r), []).append(i)
+
+    parent = range(n)
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i in range(n):
+        b = boxes[i]
+        if b[2] < box[0] or b[3] < box[1] or b[0] > box[2] or b[1] > box[3]: continue
+        ca, ra, cb, rb = cellRange(b)
+        for c in xrange(ca, cb + 1):
+            for r in xrange(ra, rb + 1):
+                for j in cells.get((c, r), ()):
+                    o = boxes[j]
+                    if o[0] <= b[2] and o[2] >= b[0] and o[1] <= b[3] and o[3] >= b[1]:
+                        ri, rj = find(i), find(j)
+                        if ri != rj: parent[ri] = rj
+
+    groups = {}
+    for i in range(n):
+        groups.setdefault(find(i), []).append(i)
+    return [groups[k] for k in sorted(groups)]
+
+
+def _zorder(x, y):
+    """ Interleaves the bits of x and y """
+    z = 0
+    bit = 0
+    while (x | y) >> bit:
+        z |= ((x >> bit) & 1) << (2 * bit) | ((y >> bit) & 1) << (2 * bit + 1)
+        bit += 1
+    return z
+
+
+def _total_bounds(boxes):
+    """ :return: bounds of a list of (xmin, ymin, xmax, ymax) boxes or None if empty """
+    if len(boxes) == 0: return None
+    return (min(b[0] for b in boxes), min(b[1] for b in boxes), max(b[2] for b in boxes), max(b[3] for b in boxes))
+
+
+def _union_tile(polys):
+    """
+    :return: block (unioned regions - each a list of an outer polygon followed by its holes, their bounding boxes)
+    """
+    if len(polys) == 0: return [], []
+    c = pyclipper.Pyclipper()
+    try:
+        c.AddPaths(polys, pyclipper.PT_SUBJECT, True)
+    except pyclipper.ClipperException:
+        return [], []  # only degenerate polygons
+    nodes = list(c.Execute2(pyclipper.CT_UNION, pyclipper.PFT_NONZERO, pyclipper.PFT_NONZERO).Childs)
+    regions = []
+    boxes = []
+    for node in nodes:  # nodes is extended with the islands inside the holes
+        region = [node.Contour]
+        for hole in node.Childs:
+            region.append(hole.Contour)
+            nodes.extend(hole.Childs)
+        xs = [pt[0] for pt in node.Contour]
+        ys = [pt[1] for pt in node.Contour]
+        regions.append(region)
+        boxes.append((min(xs), min(ys), max(xs), max(ys)))
+    return regions, boxes
+
+
+def _merge_blocks(a, b):
+    """
+    Merges two blocks of unioned regions
+    :return: block (unioned regions, their bounding boxes)
+    """
+    ba = _total_bounds(a[1])
+    bb = _total_bounds(b[1])
+    if ba is None: return b
+    if bb is None: return a
+    regions = []
+    boxes = []
+    touching = []
+    for (block, other) in ((a, bb), (b, ba)):
+        for (region, box) in zip(*block):
+            if box[0] <= other[2] and box[2] >= other[0] and box[1] <= other[3] and box[3] >= other[1]:
+                touching.extend(region)
+            else:
+                regions.append(region)
+                boxes.append(box)
+    merged = _union_tile(touching)
+    regions.extend(merged[0])
+    boxes.extend(merged[1])
+    return regions, boxes
+
+
+def _pack_regions(block):
+    """ Packs a block as ((packed polygons of all regions, number of polygons of each region), boxes) """
+    regions, boxes = block
+    return (_pack_polys([poly for region in regions for poly in region]), [len(region) for region in regions]), boxes
+
+
+def _unpack_regions(packed):
+    (polys, counts), boxes = packed
+    polys = _unpack_polys(polys).tolist()
+    regions = []
+    i = 0
+    for n in counts:
+        regions.append(polys[i:i + n])
+        i += n
+    return regions, boxes
+
+
+def _union_tile_packed(packed):
+    return _pack_regions(_union_tile(_unpack_polys(packed).tolist()))
+
+
+def _merge_blocks_packed(args):
+    return _pack_regions(_merge_blocks(_unpack_regions(args[0]), _unpack_regions(args[1])))
+
+
 def union_boundary(boundarys, regions):
     # union intersecting polygons on boundary
 
@@ -439,6 +1908,336 @@ def union_boundary(boundarys, regions):
     return boundary
 
 
+class TrackShape:
+    """
+    Aperture prepared for expanding track segments. Round apertures produce capsules (two semicircles joined
+    by straight lines) generated directly from the segment direction.
+    Other convex apertures are swept analytically: the outline of a segment is the convex hull of the
+    aperture at both ends which is made up of one chain of aperture vertices at the start point and one chain
+    at the end point. The chains only depend on the direction of the segment and are found by binary search
+    of the edge angles. Remaining apertures use Minkowski sums.
+    A track still gives one polygon per segment, merged by the union of the layer: sweeping a whole polyline in one
+    Minkowski call makes Clipper union the overlapping segments and is slower than the per-segment outlines.
+    """
+
+    def __init__(self, aperture, round=None):
+        """
+        :param aperture: aperture polygon
+        :param round: (diameter, # of segments per circle) if the aperture is a plain circle, otherwise None
+        """
+        self.round = round is not None
+        if self.round:
+            # Semicircle from -90 to 90 degrees for a segment pointing in the +x direction. Segment count is
+            # the same as the circle drawn by ParseData.add_circle
+            r = round[0] / 2.0
+            steps = max(1, (round[1] + 1) // 2)
+            self.semicircle = [(r * math.cos(math.pi * (i / float(steps) - 0.5)),
+                                r * math.sin(math.pi * (i / float(steps) - 0.5))) for i in range(steps + 1)]
+            return
+        # Clipper truncates coordinates to integers so we do the same to the aperture. This ensures the
+        # outlines of adjoining segments line up exactly.
+        verts = [[int(vx), int(vy)] for (vx, vy) in aperture]
+        if len(verts) > 1 and verts[0] == verts[-1]: del verts[-1]  # closing point
+        for i in range(len(verts) - 1, 0, -1):
+            if verts[i] == verts[i - 1]: del verts[i]
+        self.aperture = aperture
+        self.verts = verts
+        self.convex = False
+        if len(verts) < 3: return
+
+        if pyclipper.Area(verts) < 0: verts.reverse()  # CCW
+        k = len(verts)
+        angles = []
+        for i in range(k):
+            ex = verts[(i + 1) % k][0] - verts[i][0]
+            ey = verts[(i + 1) % k][1] - verts[i][1]
+            # all turns must be left turns
+            fx = verts[(i + 2) % k][0] - verts[(i + 1) % k][0]
+            fy = verts[(i + 2) % k][1] - verts[(i + 1) % k][1]
+            if ex*fy - ey*fx < 0: return
+            angles.append(math.atan2(ey, ex) % (2*math.pi))
+
+        # Rotate so that the edge angles are increasing
+        first = angles.index(min(angles))
+        self.verts = verts = verts[first:] + verts[:first]
+        self.angles = angles[first:] + angles[:first]
+        for i in range(1, k):
+            if self.angles[i] < self.angles[i - 1]: return  # winds more than once
+        self.verts2 = verts + verts
+        self.convex = True
+
+    def sweep(self, path, outlines):
+        """
+        Expands a track into one polygon per segment and adds them to outlines
+        :param path: list of [x,y] points with consecutive duplicates removed
+        """
+        if self.round:
+            self.sweep_round(path, outlines)
+            return
+        if not self.convex:
+            self.sweep_minkowski(path, outlines)
+            return
+        verts = self.verts
+        verts2 = self.verts2
+        angles = self.angles
+        k = len(verts)
+        twopi = 2*math.pi
+        atan2 = math.atan2
+        bisect_left = bisect.bisect_left
+        bisect_right = bisect.bisect_right
+
+        x = int(path[0][0])
+        y = int(path[0][1])
+        for pt in path[1:]:
+            x2 = int(pt[0])
+            y2 = int(pt[1])
+            if x2 == x and y2 == y:
+                continue
+            theta = atan2(y2 - y, x2 - x) % twopi
+            # edges pointing within (theta, theta + pi) face forward and are swept by the end point
+            i0 = bisect_right(angles, theta) % k
+            i1 = bisect_left(angles, (theta + math.pi) % twopi) % k
+            back = verts[i1:i0 + 1] if i0 >= i1 else verts2[i1:k + i0 + 1]
+            front = verts[i0:i1 + 1] if i1 >= i0 else verts2[i0:k + i1 + 1]
+            poly = [[x + vx, y + vy] for (vx, vy) in back]
+            poly.extend([[x2 + vx, y2 + vy] for (vx, vy) in front])
+            outlines.append(poly)
+            x = x2
+            y = y2
+
+    def sweep_round(self, path, outlines):
+        """ Expands a track drawn with a round aperture into one capsule per segment """
+        semicircle = self.semicircle
+        sqrt = math.sqrt
+        x, y = path[0][0], path[0][1]
+        for pt in path[1:]:
+            x2, y2 = pt[0], pt[1]
+            dx = x2 - x
+            dy = y2 - y
+            d = sqrt(dx*dx + dy*dy)
+            if d == 0: continue
+            c = dx / d
+            s = dy / d
+            # semicircle around the end point followed by the one around the start point (rotated by 180 deg)
+            poly = [[x2 + tx*c - ty*s, y2 + tx*s + ty*c] for (tx, ty) in semicircle]
+            poly.extend([[x - tx*c + ty*s, y - tx*s - ty*c] for (tx, ty) in semicircle])
+            outlines.append(poly)
+            x = x2
+            y = y2
+
+    def sweep_minkowski(self, path, outlines):
+        """ Fallback for non-convex apertures - one Minkowski sum per segment """
+        aperture = self.aperture
+        if len(aperture) == 0: return
+        itr = iter(path)
+        start = next(itr)
+        for end in itr:
+            singletrack = pyclipper.MinkowskiSum(aperture, [start, end], -1)
+            if len(singletrack) > 1:
+                # Only the edges of the aperture are swept so short segments will produce holes
+                biggest = []
+                myarea = 0
+                for mypath in singletrack:
+                    newarea = pyclipper.Area(mypath)
+                    if newarea > myarea:
+                        biggest = mypath
+                        myarea = newarea
+                singletrack = [biggest]
+            outlines.extend(singletrack)
+            start = end
+
+
+def expand_tracks(tracks, tracksize, apertures, roundApertures=None):
+    """
+    Expands track centrelines into outlines. The tracks are grouped by aperture so that the aperture only
+    needs to be prepared once (see TrackShape).
+    :param tracks: list of tracks where track is a list of [x,y] points (consecutive duplicates removed)
+    :param tracksize: aperture index of each track
+    :param apertures: list of aperture polygons
+    :param roundApertures: dictionary of aperture index -> (diameter, # of circle segments) for apertures
+        that are plain circles. These are expanded into capsules.
+    :return: list of polygons (not merged)
+    """
+    shapes = {}
+    outlines = []
+    # The many small lists created here would otherwise trigger the garbage collector over and over again
+    gcEnabled = gc.isenabled()
+    gc.disable()
+    try:
+        for seg in range(len(tracks)):
+            if len(tracks[seg]) < 2: continue
+            code = tracksize[seg]
+            shape = shapes.get(code)
+            if shape is None:
+                shape = shapes[code] = TrackShape(apertures[code],
+                                                  None if roundApertures is None else roundApertures.get(code))
+            shape.sweep(tracks[seg], outlines)
+    finally:
+        if gcEnabled: gc.enable()
+    return outlines
+
+
+def build_layer(tracks, tracksize, regions, flashes, repeats, apertures, padApertures, roundApertures, stats=None):
+    """
+    Builds the polygons of a layer from its draw commands. Only depends on its arguments so it can be run
+    in a worker process (see ParseData.store_to_gd)
+    :param tracks: list of track centrelines (consecutive duplicates removed)
+    :param tracksize: aperture index of each track
+    :param regions: list of region polygons (including those of step and repeat blocks)
+    :param flashes: list of (aperture, x, y) flash instances
+    :param repeats: step and repeat blocks as (offsets, tracks, tracksize, flashes). The outlines of a block are
+        built once and copied to each offset
+    :param apertures: aperture polygons indexed by aperture code (ParseData.apertures)
+    :param padApertures: aperture geometry table of the flashes (GerberData.apertures)
+    :param roundApertures: see expand_tracks
+    :param stats: LoadStats the stages are recorded in
+    :return: (track outlines, pads, boundaries) - merged and closed off
+    """
+    if stats is None: stats = LoadStats()
+    stt = time.time()
+    track_outlines = expand_tracks(tracks, tracksize, apertures, roundApertures)
+    for (offsets, btracks, bsizes, bflashes) in repeats:
+        boutlines = expand_tracks(btracks, bsizes, apertures, roundApertures)
+        for (dx, dy) in offsets:
+            track_outlines.extend(translate_polys(boutlines, dx, dy))
+    stats.add("expand_tracks", time.time() - stt, tracks, track_outlines)
+
+    stt = time.time()
+    pads = expand_flashes(flashes, padApertures)
+    for (offsets, btracks, bsizes, bflashes) in repeats:
+        bpads = expand_flashes(bflashes, padApertures)
+        for (dx, dy) in offsets:
+            pads.extend(translate_polys(bpads, dx, dy))
+    stats.add("expand_flashes", time.time() - stt, None, pads)
+
+    stt = time.time()
+    mergedBounds = union_boundary(track_outlines + pads, regions)
+    stats.add("union.boundaries", time.time() - stt, track_outlines + pads + regions, mergedBounds)
+    stt = time.time()
+    padsIn = pads
+    pads = union(pads)
+    stats.add("union.pads", time.time() - stt, padsIn, pads)
+    stt = time.time()
+    tracksIn = track_outlines
+    track_outlines = union(track_outlines)
+    stats.add("union.tracks", time.time() - stt, tracksIn, track_outlines)
+
+    stt = time.time()
+    closeOffPolys(pads)
+    closeOffPolys(track_outlines)
+    closeOffPolys(mergedBounds)
+    stats.add("closeOffPolys", time.time() - stt)
+    return track_outlines, pads, mergedBounds
+
+
+def _build_layer_packed(*args):
+    """
+    build_layer for the worker pool - the polygons are sent back packed as that is much quicker to pickle
+    :return: (list of packed polygons, LoadStats.asDict())
+    """
+    stats = LoadStats()
+    return [_pack_polys(polys) for polys in build_layer(*args, stats=stats)], stats.asDict()
+
+
+def expand_flashes(flashes, apertures):
+    """
+    Creates the absolute pad polygons of flash instances
+    :param flashes: list of (aperture, x, y) flash instances
+    :param apertures: aperture geometry table (GerberData.apertures)
+    :return: list of polygons
+    """
+    pads = []
+    for (aperture, x, y) in flashes:
+        pads.append([[x + vx, y + vy] for (vx, vy) in apertures[aperture]])
+    return pads
+
+
+def remove_duplicate_points(tracks):
+    """
+    Removes consecutive repeated points of tracks in place
+    :param tracks: list of tracks (lists of points)
+    """
+    for tmp in tracks:
+        prev = tmp[-1]
+        for jj in range(len(tmp) - 2, -1, -1):
+            if tmp[jj] == prev:
+                del tmp[jj]
+            else:
+                prev = tmp[jj]
+
+
+def polygon_bounds(polys):
+    """
+    :param polys: list of polygons or PolygonSet
+    :return: [xmin, ymin, xmax, ymax] of all vertices or None if there are no vertices
+    """
+    if isinstance(polys, PolygonSet): return polys.bounds()
+    xs = [pt[0] for poly in polys for pt in poly]
+    if len(xs) == 0: return None
+    ys = [pt[1] for poly in polys for pt in poly]
+    return [min(xs), min(ys), max(xs), max(ys)]
+
+
+def polygon_boxes(polys):
+    """
+    :param polys: list of polygons or PolygonSet
+    :return: list of [xmin, ymin, xmax, ymax] of each polygon (None for empty polygons)
+    """
+    if isinstance(polys, PolygonSet): return polys.boxes()
+    boxes = []
+    for poly in polys:
+        if len(poly) == 0:
+            boxes.append(None)
+            continue
+        xs = [pt[0] for pt in poly]
+        ys = [pt[1] for pt in poly]
+        boxes.append([min(xs), min(ys), max(xs), max(ys)])
+    return boxes
+
+
+def vertex_count(polys):
+    """
+    :param polys: list of polygons or PolygonSet
+    :return: total number of vertices
+    """
+    if isinstance(polys, PolygonSet): return polys.vertexCount()
+    return sum(len(poly) for poly in polys)
+
+
+def merge_copper(layers, stats=None, pool=None):
+    """
+    Merges the boundary layers into the merged copper. Dark layers are added and clear layers are subtracted in
+    the order of the layers.
+    :param layers: list of GerberLayer - only boundary layers are used
+    :param stats: LoadStats the stages ("difference" and "SimplifyPolygons") are recorded in
+    :param pool: worker pool for a partitioned union (see union_pool) or None
+    :return: list of strictly simple, closed off polygons
+    """
+    if stats is None: stats = LoadStats()
+    cbounds = pyclipper.Pyclipper()
+    boundarys = []
+    for gl in layers:
+        if gl.type != GerberLayer.TYPE_BOUNDARY: continue
+        if gl.isDark:
+            boundarys.extend(gl.points)
+        else:
+            polysIn = list(boundarys) + list(gl.points)
+            stt = time.time()
+            cbounds.AddPaths(boundarys, pyclipper.PT_SUBJECT)
+            cbounds.AddPaths(gl.points, pyclipper.PT_CLIP)
+            boundarys = cbounds.Execute(pyclipper.CT_DIFFERENCE, pyclipper.PFT_NONZERO, pyclipper.PFT_NONZERO)
+            cbounds.Clear()
+            stats.add("difference", time.time() - stt, polysIn, boundarys)
+
+    stt = time.time()
+    polysIn = boundarys
+    boundarys = union(boundarys, pyclipper.PFT_NONZERO, True, pool)  # same as SimplifyPolygons
+    stats.add("SimplifyPolygons", time.time() - stt, polysIn, boundarys)
+    # boundarys = replace_holes_with_seams(boundarys)
+    closeOffPolys(boundarys)
+    return boundarys
+
+
 def closeOffPolys(paths):
     for i in range(len(paths)-1, -1, -1):  # iterate backwards as we're modifying the list in situ
         tmp = paths[i]
@@ -451,29 +2250,557 @@ def closeOffPolys(paths):
             tmp.append(tmp[0])
 
 
-def load_file(filename):
+def chain_edges(edges, tolerance=10):
     """
-    Parse gerber file from file path
-    :rtype filename: str
-    :rtype: [GerberData, list]
+    Joins edge segments end to end into closed outlines. A segment is joined to the end of the chain if one of its
+    ends is less than tolerance from it in x and y (it is reversed if joined by its last point) and a chain is
+    closed once its ends are within tolerance. The segment ends are indexed in a hash grid of cells of the size of
+    the tolerance, so each join only looks at the nine cells around the end of the chain and chaining is linear.
+    When several segments could be joined the first in edges is used.
+    :param edges: list of segments (lists of [x, y])
+    :param tolerance: snap distance in file units
+    :return: (list of closed outlines, list of open chains) - the open chains are the segments that could not be
+        joined into closed outlines, chained as far as they go (the gap is between the last and first point)
     """
-    file = open(filename, 'r')
-    str = file.read()
-    file.close()
+    def key(pt):
+        return int(math.floor(pt[0] / tolerance)), int(math.floor(pt[1] / tolerance))
+
+    def near(pt, pt2):
+        return abs(pt[0] - pt2[0]) < tolerance and abs(pt[1] - pt2[1]) < tolerance
+
+    cells = {}
+    for i in range(len(edges)):
+        cells.setdefault(key(edges[i][0]), []).append(i)
+        cells.setdefault(key(edges[i][-1]), []).append(i)
+    used = [False] * len(edges)
+
+    def take(i):
+        used[i] = True
+        for pt in (edges[i][0], edges[i][-1]):
+            cell = cells[key(pt)]
+            if i in cell: cell.remove(i)  # both ends may be in the same cell
+
+    def join(pt):
+        """ :return: first unused segment with an end near pt, starting at that end, or None """
+        cx, cy = key(pt)
+        best = None
+        for kx in (cx - 1, cx, cx + 1):
+            for ky in (cy - 1, cy, cy + 1):
+                for i in cells.get((kx, ky), ()):
+                    if (best is None or i < best) and (near(edges[i][0], pt) or near(edges[i][-1], pt)): best = i
+        if best is None: return None
+        take(best)
+        seg = edges[best]
+        return seg if near(seg[0], pt) else seg[::-1]
+
+    outlines = []
+    chains = []
+    first = 0
+    while True:
+        while first < len(edges) and used[first]: first += 1
+        if first == len(edges): break
+        take(first)
+        chain = list(edges[first])
+        turned = False
+        while abs(chain[0][0] - chain[-1][0]) > tolerance or abs(chain[0][1] - chain[-1][1]) > tolerance:
+            seg = join(chain[-1])
+            if seg is not None:
+                chain.extend(seg)
+            elif not turned:
+                chain.reverse()  # continue from the other end to find the whole open chain
+                turned = True
+            else:
+                chains.append(chain)
+                chain = None
+                break
+        if chain is not None: outlines.append(chain)
+    return outlines, chains
 
-    return parse(str)
+
+def rout_outlines(routs, tolerance=10):
+    """
+    Board outlines from rout paths (e.g. of an Excellon rout file). The paths of each tool are chained (see
+    chain_edges). The chains that close are the tool centre around the board or a cut out, so they are offset by
+    the tool radius to the side that is kept: outlines inside an even number of others shrink, the rest (cut
+    outs) grow. The chains that do not close are slots.
+    :param routs: list of (list of [x, y] tool centre points, tool diameter)
+    :param tolerance: see chain_edges
+    :return: (list of closed board outlines, list of slots (list of [x, y] tool centre points, tool diameter))
+    """
+    tools = collections.OrderedDict()
+    for (path, dia) in routs:
+        if len(path) > 1: tools.setdefault(dia, []).append(path)
+    contours = []
+    slots = []
+    for (dia, paths) in tools.items():
+        closed, chains = chain_edges(paths, tolerance)
+        contours.extend((contour, dia) for contour in closed)
+        slots.extend((chain, dia) for chain in chains)
+
+    outlines = []
+    for (contour, dia) in contours:
+        depth = sum(1 for (other, d) in contours if other is not contour and
+                    pyclipper.PointInPolygon(contour[0], other) != 0)
+        offset = pyclipper.PyclipperOffset()
+        offset.ArcTolerance = max(dia * TOOL_CHORD_RATIO, 0.25)
+        offset.AddPath(contour, pyclipper.JT_ROUND, pyclipper.ET_CLOSEDPOLYGON)
+        outlines.extend(offset.Execute(dia / 2.0 if depth % 2 == 1 else -dia / 2.0))
+    return outlines, slots
+
+
+# ===== Containment =====
+# Copper is checked against the board edge (outlines and cut outs, even-odd) with a grid of cells over the edge.
+# Cells crossed by an edge segment are boundary cells, the others are inside or outside the board (decided by
+# counting the edge crossings along each row of cell centres). Prefix sums over the cells give, for the box of a
+# copper polygon, whether it only covers inside cells (fits), only outside cells (entirely off the board) or
+# neither. Only the polygons in the last group are clipped against the edge.
+
+""" Number of cells along the longer side of the containment grid """
+ContainmentGridSize = 128
+
+
+def copper_outside_edge(boundarys, edges, tolerance=10, stats=None):
+    """
+    Finds the copper outside the board edge
+    :param boundarys: merged copper (list of polygons or PolygonSet)
+    :param edges: closed edge outlines (see chain_edges) - areas inside an odd number of outlines are on the board
+    :param tolerance: copper regions outside the edge smaller than tolerance x tolerance are ignored
+    :param stats: LoadStats the "containment" stage is recorded in
+    :return: list of polygons: the parts of the copper outside the edge (empty if the copper fits)
+    """
+    stt = time.time()
+    edgeBounds = polygon_bounds(edges)
+    if edgeBounds is None: return [poly for poly in boundarys if len(poly) > 0]
+    x0, y0, x1, y1 = edgeBounds
+    x0 -= tolerance
+    y0 -= tolerance
+    cell = max(x1 - x0, y1 - y0, 1.0) / ContainmentGridSize
+    cols = int((x1 + tolerance - x0) / cell) + 1
+    rows = int((y1 + tolerance - y0) / cell) + 1
+
+    # Boundary cells (0 = outside, 1 = inside, 2 = boundary) and the edge crossings of each row of cell centres
+    state = [[0] * cols for r in xrange(rows)]
+    crossings = [[] for r in xrange(rows)]
+    for poly in edges:
+        for k in xrange(len(poly)):
+            xa, ya = poly[k - 1]
+            xb, yb = poly[k]
+            # cells within tolerance of the segment, column by column
+            ca = max(int((min(xa, xb) - tolerance - x0) / cell), 0)
+            cb = min(int((max(xa, xb) + tolerance - x0) / cell), cols - 1)
+            for c in xrange(ca, cb + 1):
+                if xa == xb:
+                    lo, hi = min(ya, yb), max(ya, yb)
+                else:
+                    ta = min(max((x0 + c * cell - xa) / float(xb - xa), 0.0), 1.0)
+                    tb = min(max((x0 + (c + 1) * cell - xa) / float(xb - xa), 0.0), 1.0)
+                    lo, hi = sorted((ya + ta * (yb - ya), ya + tb * (yb - ya)))
+                ra = max(int((lo - tolerance - y0) / cell), 0)
+                rb = min(int((hi + tolerance - y0) / cell), rows - 1)
+                for r in xrange(ra, rb + 1):
+                    state[r][c] = 2
+            if ya == yb: continue
+            if ya > yb: xa, ya, xb, yb = xb, yb, xa, ya
+            # rows whose centre y satisfies ya <= y < yb
+            for r in xrange(max(int(math.ceil((ya - y0) / cell - 0.5)), 0),
+                            min(int(math.ceil((yb - y0) / cell - 0.5)), rows)):
+                yc = y0 + (r + 0.5) * cell
+                crossings[r].append(xa + (yc - ya) * (xb - xa) / float(yb - ya))
+
+    # Prefix sums of the cells that are not inside and of the cells that are not outside
+    notIn = [[0] * (cols + 1) for r in xrange(rows + 1)]
+    notOut = [[0] * (cols + 1) for r in xrange(rows + 1)]
+    for r in xrange(rows):
+        xs = sorted(crossings[r])
+        row = state[r]
+        accIn = accOut = 0
+        for c in xrange(cols):
+            s = row[c]
+            if s != 2 and bisect.bisect(xs, x0 + (c + 0.5) * cell) % 2 == 1: s = 1
+            if s != 1: accIn += 1
+            if s != 0: accOut += 1
+            notIn[r + 1][c + 1] = notIn[r][c + 1] + accIn
+            notOut[r + 1][c + 1] = notOut[r][c + 1] + accOut
+
+    # Only the polygons that do not fit are taken out of boundarys (a PolygonSet builds each polygon on access)
+    outside = []
+    candidates = []
+    i = -1
+    for box in polygon_boxes(boundarys):
+        i += 1
+        if box is None: continue
+        ca = int((box[0] - x0) // cell)
+        ra = int((box[1] - y0) // cell)
+        cb = int((box[2] - x0) // cell) + 1
+        rb = int((box[3] - y0) // cell) + 1
+        if ca >= 0 and ra >= 0 and cb <= cols and rb <= rows:
+            if notIn[rb][cb] - notIn[ra][cb] - notIn[rb][ca] + notIn[ra][ca] == 0: continue  # fits
+        elif cb <= 0 or rb <= 0 or ca >= cols or ra >= rows:
+            outside.append(boundarys[i])  # off the grid
+            continue
+        else:
+            ca, ra, cb, rb = max(ca, 0), max(ra, 0), min(cb, cols), min(rb, rows)
+        if notOut[rb][cb] - notOut[ra][cb] - notOut[rb][ca] + notOut[ra][ca] == 0:
+            outside.append(boundarys[i])
+        else:
+            candidates.append(boundarys[i])
+
+    if len(candidates) > 0:
+        pc = pyclipper.Pyclipper()
+        pc.AddPaths(candidates, pyclipper.PT_SUBJECT)
+        pc.AddPaths([poly for poly in edges if len(poly) > 2], pyclipper.PT_CLIP)
+        outside.extend(pc.Execute(pyclipper.CT_DIFFERENCE, pyclipper.PFT_NONZERO, pyclipper.PFT_EVENODD))
+    outside = [poly for poly in outside if abs(pyclipper.Area(poly)) >= tolerance * tolerance]
+    if stats is not None: stats.add("containment", time.time() - stt, boundarys, outside)
+    return outside
 
 
-def parse(str):
+def chord_error_for_tool(toolDiameter):
+    """
+    Chord error suited to a tool. Arc segments deviating less than this from the true arc are not
+    resolved by the tool, so using more segments only adds work.
+    :param toolDiameter: diameter of the tool (or laser spot) in mm
+    :return: chord error in mm
+    """
+    return toolDiameter * TOOL_CHORD_RATIO
+
+
+def load_file(filename, tokenize=None, memoryMap=None, chordError=None, useCache=True, verbosity=None,
+              primitives=None, skipFunctions=None):
+    """
+    Parse gerber file from file path
+    :rtype filename: str
+    :param tokenize: see parse()
+    :param memoryMap: True to parse directly off a memory mapped file (block tokenizer only) so peak memory
+        stays close to the file size. None uses the module setting UseMemoryMap
+    :param chordError: see parse()
+    :param useCache: see parse()
+    :param verbosity: see parse()
+    :param primitives: see parse()
+    :param skipFunctions: see parse()
+    :rtype: [GerberData, list]
+    """
+    if tokenize is None: tokenize = UseTokenizer
+    if memoryMap is None: memoryMap = UseMemoryMap
+    if primitives is None: primitives = RecordPrimitives
+    if skipFunctions is None: skipFunctions = SkipApertureFunctions
+    file = open(filename, 'rb' if memoryMap and tokenize else 'r')
+    try:
+        if memoryMap and tokenize:
+            try:
+                buf = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, EnvironmentError):
+                buf = None  # empty file or file cannot be mapped
+            if buf is not None:
+                try:
+                    diagnostics = Diagnostics(verbosity)
+                    return _parse_cached(buf, lambda: _parse1(ParseData(buf, False, chordError, diagnostics,
+                                                                        primitives, skipFunctions)),
+                                         chordError, useCache, diagnostics, primitives, skipFunctions)
+                finally:
+                    buf.close()
+            file.seek(0)
+        str = file.read()
+    finally:
+        file.close()
+
+    return parse(str, tokenize, chordError, useCache, verbosity, primitives, skipFunctions)
+
+
+def parse(str, tokenize=None, chordError=None, useCache=True, verbosity=None, primitives=None, skipFunctions=None):
     """
     Parses Gerber data file
     :return GerberData object and tracks list
     :type lines: str
+    :param tokenize: True to use the block tokenizer, False to use the character walking parser.
+        None uses the module setting UseTokenizer
+    :param chordError: maximum deviation of arc segments from the true arc in mm (see
+        chord_error_for_tool). None uses the module setting MAX_CHORD_ERROR
+    :param useCache: False to always parse the data even if the result is in the parse cache (see
+        ParseCacheDir). The result is not cached either.
+    :param verbosity: messages of this level and above are printed, e.g. Diagnostics.WARNING. None prints nothing.
+        All messages are collected in GerberData.diagnostics regardless
+    :param primitives: True to record the draw commands in GerberData.primitives (see build_geometry). None uses
+        the module setting RecordPrimitives
+    :param skipFunctions: aperture functions (X2 .AperFunction attribute, e.g. "NonConductor") of objects that are
+        not loaded. None uses the module setting SkipApertureFunctions
+    :rtype [GerberData,list]
+    """
+
+    if tokenize is None: tokenize = UseTokenizer
+    if primitives is None: primitives = RecordPrimitives
+    if skipFunctions is None: skipFunctions = SkipApertureFunctions
+    diagnostics = Diagnostics(verbosity)
+    if tokenize:
+        parser = lambda: _parse1(ParseData(str, False, chordError, diagnostics, primitives, skipFunctions))
+    else:
+        parser = lambda: _parse0(ParseData(str, True, chordError, diagnostics, primitives, skipFunctions))
+    return _parse_cached(str, parser, chordError, useCache, diagnostics, primitives, skipFunctions)
+
+
+# ===== Geometry from primitives =====
+# The draw commands recorded while parsing (PrimitiveStream) are replayed through the same ParseData methods the
+# parsers use, so the result is identical to parsing the file with the same settings. Only the tessellation of
+# arcs and apertures depends on the settings, so the stream itself can be kept (or saved) and used to build the
+# geometry for any chord error.
+
+""" Version of the primitive stream file format (see PrimitiveStream.save) """
+PRIMITIVE_STREAM_VERSION = 2
+
+
+def build_geometry(primitives, chordError=None, verbosity=None, skipFunctions=None):
+    """
+    Builds the layers of a file from its draw commands without parsing the file
+    :param primitives: draw commands recorded while parsing (GerberData.primitives)
+    :type primitives: PrimitiveStream
+    :param chordError: see parse(). This need not be the chord error the file was parsed with
+    :param verbosity: see parse()
+    :param skipFunctions: see parse(). Objects skipped while parsing are not in the primitives
+    :return: GerberData object (sharing the primitives) and tracks list - the same as parse() returns
     :rtype [GerberData,list]
     """
+    stt = time.time()
+    pd = ParseData('', False, chordError, Diagnostics(verbosity), False, skipFunctions)
+    pd.gd.primitives = primitives
+    texts = primitives.texts
+    for op, ints, floats in primitives.records():
+        if op == PrimitiveStream.LINE:
+            pd.commands["D01"] += 1
+            if pd.skipPath: continue
+            (pd.regions[pd.regionseg] if pd.regionMode else pd.tracks[pd.trackseg]).append([ints[0], ints[1]])
+        elif op == PrimitiveStream.MOVE:
+            pd.x, pd.y, pd.aperture = ints
+            pd.move()
+        elif op == PrimitiveStream.FLASH:
+            pd.x, pd.y, pd.aperture = ints
+            pd.flash()
+        elif op == PrimitiveStream.ARC:
+            pd.commands["D01"] += 1
+            if pd.skipPath: continue
+            pd.add_arc2(pd.regions[pd.regionseg] if pd.regionMode else pd.tracks[pd.trackseg],
+                        ints[4], ints[5], ints[0], ints[1], ints[2], ints[3], bool(ints[6]))
+        elif op == PrimitiveStream.QUADRANT_ARC:
+            pd.commands["D01"] += 1
+            if pd.skipPath: continue
+            pd.add_arc3(pd.regions[pd.regionseg] if pd.regionMode else pd.tracks[pd.trackseg], *floats)
+        elif op == PrimitiveStream.APERTURE:
+            pd.add_aperture(ints[0], texts[ints[1]])
+        elif op == PrimitiveStream.MACRO:
+            name, lines = texts[ints[0]]
+            pd.add_macro(name, list(lines))
+        elif op == PrimitiveStream.STEP_REPEAT:
+            pd.step_repeat(texts[ints[0]])
+        elif op == PrimitiveStream.LAYER:
+            pd.isDark = bool(ints[0])
+            pd.store_to_gd(bool(ints[1]))
+        elif op == PrimitiveStream.REGION:
+            pd.regionMode = bool(ints[0])
+        elif op == PrimitiveStream.SCALE:
+            pd.gd.fraction, pd.gd.units = ints
+            pd.fscl = 10 ** pd.gd.fraction
+        elif op == PrimitiveStream.ATTRIBUTE:
+            pd.set_attribute(*texts[ints[0]])
+    pd.stats.add("build_geometry", time.time() - stt - pd.stats.stages.get("store_to_gd", [0, 0.0])[1])
+    apertureCache.save(pd.diag)
+    if PrintStats: print pd.stats.report()
+    return [pd.gd, pd.trackData]
+
+
+def _unpack_primitives(packed):
+    """
+    :param packed: PrimitiveStream.pack()
+    :rtype: PrimitiveStream
+    """
+    primitives = PrimitiveStream()
+    primitives.ops.fromstring(packed[0])
+    primitives.ints = array.array(packed[1])
+    primitives.ints.fromstring(packed[2])
+    primitives.floats.fromstring(packed[3])
+    primitives.texts = packed[4]
+    return primitives
+
+
+def load_primitives(filename):
+    """
+    Reads a primitive stream written by PrimitiveStream.save
+    :rtype: PrimitiveStream
+    """
+    f = open(filename, 'rb')
+    try:
+        version, packed = cPickle.loads(zlib.decompress(f.read()))
+    finally:
+        f.close()
+    if version != PRIMITIVE_STREAM_VERSION:
+        raise ValueError("Unsupported primitive stream version " + str(version) + " in " + filename)
+    return _unpack_primitives(packed)
 
-    pd = ParseData(str)
-    return _parse0(pd)
+
+# ===== Parse result cache =====
+# Parsed files are stored in ParseCacheDir, one file per entry named after the SHA1 hash of the file content, the
+# source of this module and the settings that affect the geometry. The polygons are stored as the packed arrays of
+# a PolygonSet (compressed) which is both compact and quick to load. The modification time of an entry is updated
+# on every hit so the least recently used entries are removed first when the cache grows beyond ParseCacheSize.
+
+""" Version of the parse cache format. Entries of other versions are ignored """
+PARSE_CACHE_VERSION = 6
+
+""" SHA1 of the source of this module and ReaderCommon (see _code_hash) """
+_codeHash = None
+
+
+def _code_hash():
+    """
+    :return: hash of the source of this module and ReaderCommon (arcs). It is part of the cache keys so results
+        built by other versions of the geometry code (track and aperture expansion, unions) are not used
+    """
+    global _codeHash
+    if _codeHash is None:
+        h = hashlib.sha1(str(PARSE_CACHE_VERSION))
+        for module in (__file__, ReaderCommon.__file__):
+            try:
+                f = open(os.path.splitext(os.path.abspath(module))[0] + ".py", 'rb')
+                try:
+                    h.update(f.read())
+                finally:
+                    f.close()
+            except EnvironmentError:
+                pass  # no source (e.g. a frozen application) - only the version is used
+        _codeHash = h.hexdigest()
+    return _codeHash
+
+
+def _parse_cached(data, parser, chordError, useCache, diagnostics, primitives=False, skipFunctions=()):
+    """
+    Returns the cached result for data if there is one, otherwise parses data with parser() and caches the result
+    :param diagnostics: Diagnostics used by parser(). The messages of a cached result are added to it
+    :param primitives: True if the result must include the primitive stream. Entries without one are ignored
+    """
+    key = None
+    if useCache and ParseCacheDir is not None:
+        h = hashlib.sha1(data)
+        h.update(repr((_code_hash(), ReaderCommon.MAX_ARC_LENGTH, ReaderCommon.MIN_SEG_PER_360, ReaderCommon.MIN_SEG,
+                       MAX_CHORD_ERROR if chordError is None else chordError, sorted(skipFunctions))))
+        key = h.hexdigest()
+        stt = time.time()
+        result = read_parse_cache(key, diagnostics, primitives)
+        if result is not None:
+            diagnostics.info("Loaded from parse cache " + key)
+            result[0].stats.add("parse_cache.read", time.time() - stt)
+            if PrintStats: print result[0].stats.report()
+            return result
+
+    result = parser()
+    apertureCache.save(diagnostics)
+    if key is not None:
+        stt = time.time()
+        write_parse_cache(key, result)
+        result[0].stats.add("parse_cache.write", time.time() - stt)
+    if PrintStats: print result[0].stats.report()
+    return result
+
+
+def _pack_polys(polys):
+    """
+    Packs a list of polygons (or PolygonSet) into a (typecode, offsets, coordinates) tuple of binary strings
+    """
+    if not isinstance(polys, PolygonSet): polys = PolygonSet(polys)
+    return polys.coords.typecode, polys.offsets.tostring(), polys.coords.tostring()
+
+
+def _unpack_polys(packed):
+    """
+    :rtype: PolygonSet
+    """
+    polys = PolygonSet()
+    polys.offsets = array.array('l')
+    polys.offsets.fromstring(packed[1])
+    polys.coords = array.array(packed[0])
+    polys.coords.fromstring(packed[2])
+    return polys
+
+
+def read_parse_cache(key, diagnostics=None, primitives=False):
+    """
+    :param diagnostics: Diagnostics the cached messages are added to (becomes GerberData.diagnostics)
+    :param primitives: True to ignore entries without a primitive stream
+    :return: cached [GerberData, list] parse result or None if there is no (valid) entry for key
+    """
+    path = os.path.join(ParseCacheDir, key + ".gbc")
+    try:
+        f = open(path, 'rb')
+        try:
+            entry = cPickle.loads(zlib.decompress(f.read()))
+        finally:
+            f.close()
+        if entry[0] != PARSE_CACHE_VERSION or (primitives and entry[-1] is None): return None
+        os.utime(path, None)  # mark as recently used
+    except (EnvironmentError, EOFError, zlib.error, cPickle.UnpicklingError, ValueError, TypeError, IndexError):
+        return None
+
+    version, units, digits, fraction, layers, apertures, trackData, messages, attributes, packedPrimitives = entry
+    gd = GerberData()
+    if diagnostics is not None: gd.diagnostics = diagnostics
+    gd.diagnostics.extend(messages)
+    gd.units = units
+    gd.digits = digits
+    gd.fraction = fraction
+    gd.apertures = _unpack_polys(apertures).tolist()
+    gd.fileAttributes, gd.apertureAttributes, attributeIndex = attributes
+    gd.attributeIndex.update(attributeIndex)
+    if packedPrimitives is not None: gd.primitives = _unpack_primitives(packedPrimitives)
+    for isDark, name, visible, filled, color, type, points, flashes in layers:
+        points = _unpack_polys(points)
+        layer = GerberLayer(isDark, name, points if UsePackedPolygons else points.tolist(), visible, filled,
+                            color, type)
+        layer.flashes = flashes
+        gd.layers.append(layer)
+    return [gd, _unpack_polys(trackData).tolist()]
+
+
+def write_parse_cache(key, result):
+    """
+    Stores a [GerberData, list] parse result in the parse cache and evicts the least recently used entries if
+    the cache is larger than ParseCacheSize
+    """
+    gd, trackData = result
+    layers = [(layer.isDark, layer.name, layer.visible, layer.filled, layer.color, layer.type,
+               _pack_polys(layer.points), layer.flashes) for layer in gd.layers]
+    entry = (PARSE_CACHE_VERSION, gd.units, gd.digits, gd.fraction, layers, _pack_polys(gd.apertures),
+             _pack_polys(trackData), gd.diagnostics.items(),
+             (gd.fileAttributes, gd.apertureAttributes, dict(gd.attributeIndex)),
+             None if gd.primitives is None else gd.primitives.pack())
+    path = os.path.join(ParseCacheDir, key + ".gbc")
+    try:
+        if not os.path.isdir(ParseCacheDir): os.makedirs(ParseCacheDir)
+        f = open(path + ".tmp", 'wb')
+        try:
+            f.write(zlib.compress(cPickle.dumps(entry, cPickle.HIGHEST_PROTOCOL), 1))
+        finally:
+            f.close()
+        if os.path.exists(path): os.remove(path)
+        os.rename(path + ".tmp", path)
+
+        # Evict least recently used entries
+        entries = []
+        for name in os.listdir(ParseCacheDir):
+            if not name.endswith(".gbc"): continue
+            st = os.stat(os.path.join(ParseCacheDir, name))
+            entries.append((st.st_mtime, st.st_size, name))
+        entries.sort()
+        total = sum(e[1] for e in entries)
+        for mtime, size, name in entries:
+            if total <= ParseCacheSize: break
+            os.remove(os.path.join(ParseCacheDir, name))
+            total -= size
+    except EnvironmentError as e:
+        gd.diagnostics.warn("Unable to write parse cache " + path + ": " + str(e))
+
+
+def clear_parse_cache():
+    """ Removes all entries from the parse cache """
+    if ParseCacheDir is None or not os.path.isdir(ParseCacheDir): return
+    for name in os.listdir(ParseCacheDir):
+        if name.endswith(".gbc"): os.remove(os.path.join(ParseCacheDir, name))
 
 
 def _parse0(pd):
@@ -493,116 +2820,22 @@ def _parse0(pd):
             if cd == 0 or (3 < cd < 10) or cd >= len(pd.apertures):
                 pd.error_line("Invalid aperture code D" + str(cd) + ". ")
             if cd == 1:  # interpolate
-                if pd.interpMode == 1:  # linear interpolation
-                    if pd.regionMode:
-                        pd.regions[pd.regionseg].append([pd.x, pd.y])
-                    else:
-                        pd.tracks[pd.trackseg].append([pd.x, pd.y])
-                elif pd.arcMode == 0:  # Single Quadrant Mode
-                    # the specifications for single quadrant mode is barbaric in that it is very difficult to
-                    # implement consistently and yet they spout how inherently unstable multi quadrant mode is.
-                    # Single quadrant mode is less stable because there are multiple solutions depending on where
-                    # the centre is located because we're meant to pick the signs such that:
-                    # - CW/CCW mode is respected and that
-                    # - 0<arcAngle<90 degrees is maintained
-                    # It is possible for multiple combination of signs to meet the conditions above
-
-                    # We'll actually keep the signs. Use them as defaults.
-                    # I.e. if conditions aren't met, we twiddle signs such that they do
-                    # # discard sign data when it should really be used...
-                    # if pd.i < 0:
-                    #     pd.warn("Negative sign for offset i was ignored for SINGLE QUADRANT mode")
-                    #     pd.i *= -1
-                    # if pd.j < 0:
-                    #     pd.warn("Negative sign for offset j was ignored for SINGLE QUADRANT mode")
-                    #     pd.j *= -1
-
-                    # brute force try the signs (4 possible cases forming a rectangle of width 2i and
-                    # height of 2j around the starting point) to see which one fulfils all the condition
-                    sbreak = False
-                    for m in range(2):
-                        centreX = pd.xold + pd.i*(1 if m == 0 else -1)
-                        for n in range(2):
-                            centreY = pd.yold + pd.j*(1 if n == 0 else -1)
-                            startAngle = math.atan2(pd.yold - centreY, pd.xold - centreX)
-                            deltaAngle = math.atan2(pd.y - centreY, pd.x - centreX) - startAngle
-                            if deltaAngle > math.pi:
-                                deltaAngle = 2*math.pi - deltaAngle
-                            elif deltaAngle < -math.pi:
-                                deltaAngle += 2*math.pi
-                            r = math.sqrt((pd.xold - centreX)**2 + (pd.yold - centreY)**2)
-                            dr = math.sqrt((pd.x - centreX)**2 + (pd.y - centreY)**2) - r
-                            if abs(deltaAngle) < math.pi/1.95:
-                                if (pd.interpMode == 2) == (deltaAngle < 0):  # correct CW/CCW mode
-                                    pd.add_arc3(pd.regions[pd.regionseg] if pd.regionMode else pd.tracks[pd.trackseg],
-                                             centreX, centreY, r, startAngle, deltaAngle, dr)
-                                    sbreak = True
-                                    break
-                        if sbreak: break
-                    if not sbreak:
-                        pd.error("Single quadrant arc coordinates do not specify a valid arc configuration")
-                else:  # Multi Quadrant Mode
-                    # Implementation note:
-                    # Draws a circle that passes through the start and end point with radius of distance
-                    # from offset centre point to start point (i.e. the offset centre point will
-                    # be moved such that the distance to the and end point become equal to the distance
-                    # to the start point)
-                    # r = pow(pd.i, 2) + pow(pd.j, 2)
-
-                    # The line that perpendicular bisects the line joining A (start) and B (end) is where
-                    # the centre point will lie. The distance from centre point to A and B is r (circle radius)
-                    # The distance from the line connecting AB to centre point is thus sqrt(r^2-L^2)
-                    # Where L is the distance between midpoint and A or B.
-                    # To optimise, square root is not taken until the end and 2L is distance between A and B
-                    # and is the value that the normal must be divided by to normalise to length 1
-
-                    pd.add_arc2(pd.regions[pd.regionseg] if pd.regionMode else pd.tracks[pd.trackseg],
-                             pd.xold + pd.i, pd.yold + pd.j,
-                             pd.xold, pd.yold, pd.x, pd.y, pd.interpMode == 2)
-
-                    # # Mid Point - OLD METHOD
-                    # mx = (pd.xold + pd.x)/2
-                    # my = (pd.yold + pd.y)/2
-                    # # Normal
-                    # ny = pd.x - pd.xold
-                    # nx = pd.yold - pd.y
-                    # tmp = nx*nx + ny*ny  # size of vector squared
-                    # tmp = math.sqrt(float(r)/tmp - 0.25)  # normalise normal and scale by radius
-                    # if abs(pd.i - nx*tmp) + abs(pd.j - ny*tmp) > abs(pd.i + nx*tmp) + abs(pd.j + ny*tmp):
-                    #     # pick the side the offset point lies on
-                    #     tmp *= -1
-                    # centreX = mx + nx*tmp
-                    # centreY = my + ny*tmp
-                    # add_arc(pd.regions[pd.regionseg] if pd.regionMode else pd.tracks[pd.trackseg],
-                    #            math.sqrt(r), centreX, centreY,
-                    #            math.atan2(pd.yold - centreY, pd.xold - centreX),
-                    #            math.atan2(pd.y - centreY, pd.x - centreX), pd.interpMode == 2)
-                # Consume offset
-                pd.i = 0
-                pd.j = 0
+                pd.interpolate()
             elif cd == 2:  # move
-                if pd.regionMode:  # Finish current region and creates a new one
-                    pd.regions.append([])
-                    pd.regionseg += 1
-                    pd.regions[pd.regionseg].append([pd.x, pd.y])
-                else:  # Finish current track and creates a new one
-                    pd.tracksize.append(pd.aperture)
-                    pd.trackseg += 1
-                    pd.tracks.append([[pd.x, pd.y]])
+                pd.move()
             else:
                 if pd.regionMode:
                     pd.error("Command D" + str(cd) + " is not allowed in region mode")
                 if cd == 3:  # flash aperture
-                    pd.padseg += 1
-                    pd.pads.append([])
-                    for verts in pd.apertures[pd.aperture]:
-                        pd.pads[pd.padseg].append([pd.x + verts[0], pd.y + verts[1]])
+                    pd.flash()
                 else:  # Set aperture
+                    pd.commands["Dnn"] += 1
                     pd.aperture = cd
             pd.check_char('*')
         elif tmp == 'G':
             pd.pos += 1
             cd = pd.parseInt()
+            pd.commands["G%02d" % cd] += 1
             if 0 < cd < 4:  # Linear interpolation
                 pd.interpMode = cd
                 if pd.getChar() != '*':
@@ -625,6 +2858,7 @@ def _parse0(pd):
                     if cd < 10 or cd >= len(pd.apertures):
                         pd.error("Invalid aperture index D" + str(cd) + " in deprecated commands G70.")
                     else:
+                        pd.commands["Dnn"] += 1
                         pd.aperture = cd
                         pd.dep("Deprecated command found: G54 (command was parsed but should be removed)")
             elif cd == 70:  # Set mode to INCH
@@ -647,6 +2881,7 @@ def _parse0(pd):
         elif tmp == 'M':
             pd.pos += 1
             cd = pd.parseInt()
+            pd.commands["M%02d" % cd] += 1
             if cd == 2:
                 pd.check_char('*')
                 if pd.regionMode:
@@ -677,6 +2912,7 @@ def _parse0(pd):
             pd.j = pd.parseSign()
         elif tmp == '%':  # Extended command codes are surrounded by %
             cmd = pd.str[pd.pos+1:pd.pos+3]
+            pd.commands[cmd] += 1
             pd.pos += 3
             if cmd == "FS":  # File format
                 op = string.find(pd.str,'X',pd.pos)
@@ -715,216 +2951,14 @@ def _parse0(pd):
                 else:
                     pd.error_line("Invalid unit specifier " + pd.parseUntil('*'))
             elif cmd == "AD":  # Add aperture
-                # IMPORTANT: All apertures must be in the CCW or POSITIVE direction
                 if pd.str[pd.pos] != 'D':
                     pd.error("Aperture index must be specified after AD command")
                     continue
                 pd.pos += 1
-                pd.aperture = pd.parseInt()
-                while len(pd.apertures) <= pd.aperture:
-                    pd.apertures.append([])
-                if len(pd.apertures[pd.aperture]) != 0:
-                    pd.warn("Aperture " + str(pd.aperture) + " is added more than once. The existing aperture "
-                                                             "has been overwritten")
-                    pd.apertures[pd.aperture] = []
-                holesize = -1
-                if pd.str[pd.pos + 1] == ',':  # single letter macro names are treated as built in apertures
-                    tmp = pd.str[pd.pos]
-                    pd.pos += 2
-                    if tmp == 'C':  # Circle
-                        size = pd.parseFloat()
-                        pd.add_circle(pd.apertures[pd.aperture], size, False)
-                        if pd.getChar() == 'X':
-                            pd.pos += 1
-                            holesize = pd.parseFloat()
-                            pd.add_circle(pd.apertures[pd.aperture], holesize, True)
-                        print "   read aperture", pd.aperture, ": circle diameter", size, ", hole size", holesize
-                    elif tmp == 'R':  # Rectangle
-                        w = pd.parseFloat() / 2.0
-                        pd.check_char('X')
-                        h = pd.parseFloat() / 2.0
-                        pd.apertures[pd.aperture].extend([[-w, -h], [w, -h], [w, h], [-w, h], [-w, -h]])
-                        if pd.getChar() == 'X':
-                            pd.pos += 1
-                            holesize = pd.parseFloat()
-                            pd.add_circle(pd.apertures[pd.aperture], holesize, True)
-                        print "   read aperture", pd.aperture, ": rectangle W", w, ", H", h, ", hole size", holesize
-                    elif tmp == 'O':  # Rectangle capped with semicircles
-                        w = pd.parseFloat() / 2.0
-                        pd.check_char('X')
-                        h = pd.parseFloat() / 2.0
-
-                        if w > h:  # round the top and bottom sides
-                            pd.add_arc3(pd.apertures[pd.aperture],  w - h, 0, h, -math.pi/2, math.pi)
-                            pd.add_arc3(pd.apertures[pd.aperture], -w + h, 0, h,  math.pi/2, math.pi)
-                            pd.apertures[pd.aperture].append([w - h, -h])
-                        else:  # round the left and right sides
-                            pd.add_arc3(pd.apertures[pd.aperture], 0,  h - w, w,       0, math.pi)
-                            pd.add_arc3(pd.apertures[pd.aperture], 0, -h + w, w, math.pi, math.pi)
-                            pd.apertures[pd.aperture].append([w, h - w])
-
-                        if pd.getChar() == 'X':
-                            pd.pos += 1
-                            holesize = pd.parseFloat()
-                            pd.add_circle(pd.apertures[pd.aperture], holesize, True)
-                        print "   read aperture", pd.aperture, ": o-rectangle ", w, " x ", h, ", hole size", holesize
-                    elif tmp == 'P':  # Regular polygon
-                        size = pd.parseFloat() / 2.0
-                        pd.check_char('X')
-                        n = pd.parseInt()
-                        rot = 0
-                        if pd.getChar() == 'X':
-                            pd.pos += 1
-                            rot = pd.parseFloat(False)
-                        for i in range(n):
-                            angle = i * -2.0 * math.pi / (n - 1.0)
-                            x = size * math.cos(angle + rot)
-                            y = size * math.sin(angle + rot)
-                            pd.apertures[pd.aperture].append([x, y])
-
-                        if pd.getChar() == 'X':
-                            pd.pos += 1
-                            holesize = pd.parseFloat()
-                            pd.add_circle(pd.apertures[pd.aperture], holesize, True)
-                        print "   read aperture", pd.aperture, ": polygon n", n, " diameter ", size, ", rot ", rot, \
-                            " hole size", holesize
-                    else:
-                        pd.error("Unknown aperture shape " + tmp)
-                else:  # Macro
-                    tmp = pd.parseUntil('*')
-                    colpos = tmp.find(',')
-                    if colpos == -1:
-                        mindex = pd.macrosName.index(tmp)
-                        print "   read aperture", pd.aperture, ", name = ",tmp," (", mindex, "), params=nil"
-                    else:
-                        mindex = pd.macrosName.index(tmp[:colpos])
-                        pd.assignVariables(tmp[colpos+1:])
-                        print "   read aperture", pd.aperture, ", name = ",tmp[:colpos]," (", mindex, "), params=",tmp[colpos+1:]
-
-                    for line in pd.macros[mindex]:
-                        if line[0] == '$':
-                            # variable set
-                            pd.parseAssignExpression(line)
-                            continue
-                        elif line[0] == '0':
-                            # macro comment - ignore
-                            continue
-
-                        vals = line.split(',')
-                        prim = int(vals[0])
-                        if prim == 1:  # circle primitive specified using start and end point
-                            isAdd = vals[1] == "1"
-                            if not isAdd and len(pd.apertures[pd.aperture]) == 0: continue  # subtracting from nothing
-
-                            tmp = []
-                            rot = 0 if len(vals) < 6 else float(vals[5])
-                            r = pd.parseFloatScaled(vals[2]) / 2.0
-                            centreX = pd.parseFloatScaled(vals[3])
-                            centreY = pd.parseFloatScaled(vals[4])
-                            if rot != 0: centreX, centreY = rotPoint([centreX, centreY], rot)
-                            pd.add_arc3(tmp, centreX, centreY, r, 0, math.pi*2)
-                            mergePolys(pd.apertures[pd.aperture], tmp, isAdd)
-                        elif prim == 20:  # line primitive - start and end point
-                            isAdd = vals[1] == "1"
-                            if not isAdd and len(pd.apertures[pd.aperture]) == 0: continue  # subtracting from nothing
-                            w = pd.parseFloatScaled(vals[2])
-                            x1 = pd.parseFloatScaled(vals[3])
-                            y1 = pd.parseFloatScaled(vals[4])
-                            x2 = pd.parseFloatScaled(vals[5])
-                            y2 = pd.parseFloatScaled(vals[6])
-                            rot = float(vals[7])
-                            dx = x2 - x1
-                            dy = y2 - y1
-                            mag = w / math.sqrt(dx*dx + dy*dy) / 2.0
-                            dx *= mag
-                            dy *= mag
-                            tmp = [[x1 + dy, y1 - dx], [x2 + dy, y2 - dx], [x2 - dy, y2 + dx], [x1 - dy, y1 + dx]]
-                            if rot != 0: rotPoints(tmp, rot)
-                            tmp.append(tmp[0])
-                            mergePolys(pd.apertures[pd.aperture], tmp, isAdd)
-                        elif prim == 21:  # line primitive - centre, w and h
-                            isAdd = vals[1] == "1"
-                            if not isAdd and len(pd.apertures[pd.aperture]) == 0: continue  # subtracting from nothing
-                            w = pd.parseFloatScaled(vals[2]) / 2.0
-                            h = pd.parseFloatScaled(vals[3]) / 2.0
-                            centreX = pd.parseFloatScaled(vals[4])
-                            centreY = pd.parseFloatScaled(vals[5])
-                            rot = float(vals[6])
-                            tmp = [[centreX + w, centreY + h], [centreX - w, centreY + h],
-                                   [centreX - w, centreY - h], [centreX + w, centreY - h]]
-                            if rot != 0: rotPoints(tmp, rot)
-                            tmp.append(tmp[0])  # close off polygon
-                            mergePolys(pd.apertures[pd.aperture], tmp, isAdd)
-                        elif prim == 22:  # line primitive - bottom left, w and h
-                            # This primitive isn't explicitly explained in gerber specs but reversed engineered
-                            # from the examples.
-                            isAdd = vals[1] == "1"
-                            if not isAdd and len(pd.apertures[pd.aperture]) == 0: continue  # subtracting from nothing
-                            w = pd.parseFloatScaled(vals[2])
-                            h = pd.parseFloatScaled(vals[3])
-                            tx = pd.parseFloatScaled(vals[4])
-                            ty = pd.parseFloatScaled(vals[5])
-                            rot = float(vals[6])
-                            tmp = [[tx + w, ty + h], [tx, ty + h], [tx, ty], [tx + w, ty]]
-                            if rot != 0: rotPoints(tmp, rot)
-                            tmp.append(tmp[0])  # close off polygon
-                            mergePolys(pd.apertures[pd.aperture], tmp, isAdd)
-                        elif prim == 4:  # outline primitive
-                            isAdd = vals[1] == "1"
-                            if not isAdd and len(pd.apertures[pd.aperture]) == 0: continue  # subtracting from nothing
-                            n = int(vals[2])
-                            rot = float(vals[-1])
-                            if len(vals) != (n+1)*2 + 4 and len(vals) != (n+1)*2 + 3:
-                                pd.error("Invalid number of arguments in polygon primitive.")
-                            else:
-                                tmp = [[pd.parseFloatScaled(vals[3]), pd.parseFloatScaled(vals[4])]]
-                                for x in (range(1, n)):
-                                    tmp.append([pd.parseFloatScaled(vals[x*2 + 3]), pd.parseFloatScaled(vals[x*2 + 4])])
-
-                                # We require all aperture polygons to be CCW. Since outline is a user supplied
-                                # value, the data may not conform to this so we need to reverse the list if
-                                # the data is supplied in CW direction.
-                                if not pyclipper.Orientation(tmp): tmp.reverse()
-
-                                # Note: we ignore the last point if n+1 points was specified. The last point is
-                                # redundant as it just loops back to start and we add the closing point regardless
-                                # of whether it was provided or not. It also ensures that if the supplied data does
-                                # not conform with specifications, it is effectively fixed silently.
-                                if rot != 0: rotPoints(tmp, rot)
-                                tmp.append(tmp[0])  # close off polygon
-                                mergePolys(pd.apertures[pd.aperture], tmp, isAdd)
-                        elif prim == 5:  # polygon primitive
-                            isAdd = vals[1] == "1"
-                            if not isAdd and len(pd.apertures[pd.aperture]) == 0: continue  # subtracting from nothing
-                            n = int(vals[2])
-                            centreX = pd.parseFloatScaled(vals[3])
-                            centreY = pd.parseFloatScaled(vals[4])
-                            r = pd.parseFloatScaled(vals[5]) / 2.0
-                            rot = float(vals[6])
-                            if rot != 0 and (centreX != 0 or centreY != 0):
-                                pd.warn("Rotation can only be used on polygon primitive if it is centred at (0,0). "
-                                        "The rotation was applied as if the polygon was rotated first and then "
-                                        "translated to specified centre coordinates")
-
-                            tmp = []
-                            stepAngle = -2.0 * math.pi / (n - 1.0)
-                            for i in range(n):
-                                angle = i*stepAngle
-                                x = r * math.cos(angle + rot) + centreX
-                                y = r * math.sin(angle + rot) + centreY
-                                tmp.append([x, y])
-                            mergePolys(pd.apertures[pd.aperture], tmp, isAdd)
-                        elif prim == 6:  # moire primitive
-                            pd.error("Moire primitive is not implemented yet")
-                            continue
-                        elif prim == 7:  # thermal primitive
-                            pd.error("Thermal primitive is not implemented yet")
-                            continue
-                        else:
-                            pd.error("Unknown macro primitive: " + str(prim))
-                            continue
+                cd = pd.parseInt()
+                pd.add_aperture(cd, pd.parseUntil('*'))
             elif cmd == "AM":  # Create aperture macro
-                pd.macrosName.append(pd.parseUntil('*'))  # Parse name of macro
+                name = pd.parseUntil('*')  # Parse name of macro
                 tmp = pd.findNextChar()
                 tmplines = []
                 while tmp != '%':  # Store macro commands (only parsed when added)
@@ -933,22 +2967,14 @@ def _parse0(pd):
                     if tmp == -2:
                         # This is required to prevent infinite loop
                         pd.check_char('%')
-                pd.macros.append(tmplines)
-                pd.N_macros += 1
+                pd.add_macro(name, tmplines)
                 pd.pos += 1
                 continue
-            elif cmd == "SR":  # Set and repeat
-                # Close and apply step and repeat block (if any)
-
-
-                if pd.getChar() != '*':
-                    # Start step and repeat block
-                    xrep = int(pd.parseUntil('Y'))
-                    yrep = int(pd.parseUntil('I'))
-                    xinc = float(pd.parseUntil('J'))
-                    yinc = float(pd.parseUntil('*'))
-                pd.error("Step repeat not yet implemented")
-                pass
+            elif cmd == "SR":  # Step and repeat
+                # Close and apply step and repeat block (if any) and start a new block if parameters are given
+                pd.step_repeat(pd.parseUntil('*'))
+            elif cmd in ("TF", "TA", "TO", "TD"):  # X2 attributes
+                pd.set_attribute(cmd, pd.parseUntil('*'))
             elif cmd == "LP":  # Create new layer
                 tmp = pd.getChar()
                 if tmp == 'D':
@@ -968,12 +2994,318 @@ def _parse0(pd):
         else:
             pd.error("Unknown command code " + tmp + ". Rest of file was not parsed")
             break
-    print "Execution time: ", (time.time() - stt)
+    pd.stats.add("parse", time.time() - stt - pd.stats.stages.get("store_to_gd", [0, 0.0])[1])
+    # Finalise parsing
+    pd.store_to_gd(True)
+    pd.diag.info(pd.diag.summary())
+    return [pd.gd, pd.trackData]
+
+# ===== Block tokenizer =====
+# Instead of walking the file one character at a time, the data is split into whole blocks using compiled
+# regular expressions and each block is dispatched on its command code. The drawing itself is delegated to
+# the same ParseData methods used by _parse0.
+# Whitespace between blocks is skipped by the tokenizer and newlines are only removed from the (rare) blocks
+# that span several lines, so the data can be parsed straight off a memory mapped file without any copies.
+
+""" Matches a whole block: G04 comment (which may contain '%'), extended command or data block """
+_BLOCK_RE = re.compile(r'\s*(?:(G0*4(?![0-9])[^*]*)\*|%([^%]*)%|([^%*]*)\*)')
+""" Matches whitespace """
+_SPACE_RE = re.compile(r'\s*')
+""" Matches the common data block consisting only of coordinates and an optional D code """
+_COORD_RE = re.compile(r'(?:X([+-]?\d+))?(?:Y([+-]?\d+))?(?:I([+-]?\d+))?(?:J([+-]?\d+))?(?:D0*(\d+))?$')
+""" Matches a single word (code letter and value) of a data block """
+_WORD_RE = re.compile(r'([A-Z])([+-]?\d+)')
+""" Matches the aperture code and description of an AD command """
+_AD_RE = re.compile(r'D0*(\d+)(.*)$')
+""" Matches the parameters of a step and repeat (SR) command """
+_SR_RE = re.compile(r'X(\d+)Y(\d+)I([+-]?[\d.]+)J([+-]?[\d.]+)$')
+
+
+def _d_code(pd, cd):
+    if cd == 0 or (3 < cd < 10) or cd >= len(pd.apertures):
+        pd.error("Invalid aperture code D" + str(cd) + ".")
+    if cd == 1:  # interpolate
+        pd.interpolate()
+    elif cd == 2:  # move
+        pd.move()
+    else:
+        if pd.regionMode:
+            pd.error("Command D" + str(cd) + " is not allowed in region mode")
+        if cd == 3:  # flash aperture
+            pd.flash()
+        else:  # Set aperture
+            pd.commands["Dnn"] += 1
+            pd.aperture = cd
+
+
+def _g_interp(pd, cd):
+    pd.interpMode = cd
+
+
+def _g_region_on(pd, cd):
+    pd.regionMode = True
+
+
+def _g_region_off(pd, cd):
+    pd.regionMode = False
+
+
+def _g_select_aperture(pd, cd):
+    # the aperture itself is set by the D code that follows in the same block
+    pd.dep("Deprecated command found: G54 (command was parsed but should be removed)")
+
+
+def _g_inch(pd, cd):
+    pd.gd.units = 1
+    pd.dep("Deprecated command found: G70 (command was parsed but should be removed)")
+
+
+def _g_mm(pd, cd):
+    pd.gd.units = 0
+    pd.dep("Deprecated command found: G71 (command was parsed but should be removed)")
+
+
+def _g_single_quadrant(pd, cd):
+    pd.arcMode = 0
+
+
+def _g_multi_quadrant(pd, cd):
+    pd.arcMode = 1
+
+
+def _g_ignored(pd, cd):
+    pd.dep("Deprecated command found: G" + str(cd) + " (command was IGNORED)")
+
+
+""" G code dispatch table. Each handler is called with (ParseData, code) """
+_G_CODES = {
+    1: _g_interp,
+    2: _g_interp,
+    3: _g_interp,
+    36: _g_region_on,
+    37: _g_region_off,
+    54: _g_select_aperture,
+    70: _g_inch,
+    71: _g_mm,
+    74: _g_single_quadrant,
+    75: _g_multi_quadrant,
+    90: _g_ignored,
+    91: _g_ignored,
+}
+
+
+def _parse_data_block(pd, block):
+    """
+    Parses a data block (without the terminating '*')
+    :return: True if parsing should stop, i.e. end of file command or unrecoverable error
+    """
+    m = _COORD_RE.match(block)
+    if m is not None:  # fast path - coordinate data with optional D code
+        x, y, i, j, d = m.groups()
+        if x is not None:
+            pd.xold = pd.x
+            pd.x = int(x)
+        if y is not None:
+            pd.yold = pd.y
+            pd.y = int(y)
+        if i is not None: pd.i = int(i)
+        if j is not None: pd.j = int(j)
+        if d is not None: _d_code(pd, int(d))
+        return False
+
+    pos = 0
+    for m in _WORD_RE.finditer(block):
+        if m.start() != pos: break
+        code, val = m.groups()
+        if code not in 'XYIJDGM': break
+        pos = m.end()
+        if code == 'X':
+            pd.xold = pd.x
+            pd.x = int(val)
+        elif code == 'Y':
+            pd.yold = pd.y
+            pd.y = int(val)
+        elif code == 'I':
+            pd.i = int(val)
+        elif code == 'J':
+            pd.j = int(val)
+        elif code == 'D':
+            _d_code(pd, int(val))
+        elif code == 'G':
+            cd = int(val)
+            pd.commands["G%02d" % cd] += 1
+            handler = _G_CODES.get(cd)
+            if handler is None:
+                pd.error("Unknown code: G" + str(cd) + ". Ignoring data: " + block)
+                return False
+            handler(pd, cd)
+            if 0 < cd < 4 and pos != len(block):
+                pd.dep("Use of G" + str(cd) + " in a data block is deprecated")
+        elif code == 'M':
+            cd = int(val)
+            pd.commands["M%02d" % cd] += 1
+            if cd == 2:
+                if pd.regionMode:
+                    pd.warn("End of file reached while in region mode")
+                return True
+            pd.error("Invalid code: M" + str(cd) + ". Ignoring data: " + block)
+            return False
+    if pos != len(block):
+        pd.error("Unknown command code " + block[pos:pos+1] + ". Rest of file was not parsed")
+        return True
+    return False
+
+
+def _x_format(pd, body, lines):
+    # we only care about the fractional digit
+    pd.gd.fraction = int(body[body.find('X') + 2])
+    pd.fscl = 10 ** pd.gd.fraction
+
+
+def _x_units(pd, body, lines):
+    if body.startswith('MM'):
+        pd.gd.units = 0
+    elif body.startswith('IN'):
+        pd.gd.units = 1
+    else:
+        pd.error("Invalid unit specifier " + body)
+
+
+def _x_aperture(pd, body, lines):
+    m = _AD_RE.match(body)
+    if m is None:
+        pd.error("Aperture index must be specified after AD command")
+        return
+    pd.add_aperture(int(m.group(1)), m.group(2))
+
+
+def _x_macro(pd, body, lines):
+    pd.add_macro(body, lines)
+
+
+def _x_step_repeat(pd, body, lines):
+    pd.step_repeat(body)
+
+
+def _x_file_attribute(pd, body, lines):
+    pd.set_attribute("TF", body)
+
+
+def _x_aperture_attribute(pd, body, lines):
+    pd.set_attribute("TA", body)
+
+
+def _x_object_attribute(pd, body, lines):
+    pd.set_attribute("TO", body)
+
+
+def _x_delete_attribute(pd, body, lines):
+    pd.set_attribute("TD", body)
+
+
+def _x_polarity(pd, body, lines):
+    if body == 'D' or body == 'C':
+        pd.store_to_gd()
+        pd.isDark = body == 'D'
+    else:
+        pd.error("Command LP must be followed by C or D but found " + body)
+
+
+""" Extended command dispatch table. Each handler is called with (ParseData, block body, remaining blocks) """
+_X_CODES = {
+    "FS": _x_format,
+    "MO": _x_units,
+    "AD": _x_aperture,
+    "AM": _x_macro,
+    "SR": _x_step_repeat,
+    "LP": _x_polarity,
+    "TF": _x_file_attribute,
+    "TA": _x_aperture_attribute,
+    "TO": _x_object_attribute,
+    "TD": _x_delete_attribute,
+}
+
+
+def _parse_extended(pd, text):
+    """
+    Parses the content of an extended command (text between the % symbols)
+    """
+    blocks = text.split('*')
+    if blocks[-1] != '':
+        pd.error("Command missing '*' symbol")
+    else:
+        del blocks[-1]
+    for n in range(len(blocks)):
+        cmd = blocks[n][:2]
+        pd.commands[cmd] += 1
+        handler = _X_CODES.get(cmd)
+        if handler is None:
+            pd.error("Unknown command code " + cmd + ". Ignoring data: " + blocks[n])
+            continue
+        handler(pd, blocks[n][2:], blocks[n+1:])
+        if cmd == "AM": break  # the remaining blocks are the content of the macro
+
+
+def _strip_newlines(s):
+    return s.replace('\n', '').replace('\r', '')
+
+
+def _parse1(pd):
+    """
+    :type pd: ParseData
+    """
+    stt = time.time()
+    s = pd.str
+    strlen = pd.strlen
+    match = _BLOCK_RE.match
+    pos = 0
+    finished = False
+    while pos < strlen:
+        m = match(s, pos)
+        if m is None:
+            # Data without a terminating '*' (or an extended command without the closing '%')
+            pos = _SPACE_RE.match(s, pos).end()
+            if pos >= strlen: break
+            pd.pos = pos
+            if s[pos] == '%':
+                pd.diag.error("Command missing '%' symbol. Rest of file was not parsed", pos, s[pos:pos+30])
+                pos = strlen
+                break
+            end = s.find('%', pos)
+            if end < 0: end = strlen
+            data = _strip_newlines(s[pos:end]).strip()
+            pd.diag.error("Command missing '*' symbol", pos, data[:30])
+            pos = end
+            if _parse_data_block(pd, data):
+                finished = True
+                break
+            continue
+        pd.pos = pos
+        pos = m.end()
+        comment, ext, data = m.groups()
+        if data is not None:
+            if '\n' in data or '\r' in data: data = _strip_newlines(data)
+            if _parse_data_block(pd, data):
+                finished = True
+                break
+        elif ext is not None:
+            if '\n' in ext or '\r' in ext: ext = _strip_newlines(ext)
+            _parse_extended(pd, ext)
+        else:  # G04 comment - ignored
+            pd.commands["G04"] += 1
+
+    pd.pos = pos
+    if not finished:
+        pd.warn("File was not terminated with 'M02*' command")
+    elif _SPACE_RE.match(s, pos).end() < strlen:
+        pd.warn("Unparsed data: " + s[pos:pos+30] + ("..." if pos + 30 < strlen else ""))
+    pd.stats.add("parse", time.time() - stt - pd.stats.stages.get("store_to_gd", [0, 0.0])[1])
     # Finalise parsing
-    pd.store_to_gd()
-    print " Parsing completed with ", pd.warnings, " warnings, ", pd.deps, " deprecated commands and ", pd.errors, " errors"
+    pd.store_to_gd(True)
+    pd.diag.info(pd.diag.summary())
     return [pd.gd, pd.trackData]
 
+
 def replace_holes_with_seams(paths):
     """
     Removes holes and merge isolated polygons into one by adding seams
@@ -1048,6 +3380,13 @@ def mergePolys(poly1, poly2, isAdd=True):
         poly1.extend(result)  # add the merged results
 
 
+def translate_polys(polys, dx, dy):
+    """
+    :return: copy of a list of polygons moved by (dx, dy)
+    """
+    return [[[pt[0] + dx, pt[1] + dy] for pt in poly] for poly in polys]
+
+
 def rotPoint(pt, rot):
     """
     Rotate a point about origin and stores the results IN PLACE (i.e. if you need the original
@@ -1,12 +1,14 @@
 import math
+import os
 from string import join
 
 import time
 
 import ExcellonReader
 import GerberReader3
+import Toolpaths
 from wxGerberCanvas import GerberCanvas
-from GerberReader3 import load_file, GerberLayer, GerberData
+from GerberReader3 import load_file, GerberLayer, GerberData, PolygonSet, Diagnostics, chain_edges
 import pyclipper
 import wx
 import wx.grid
@@ -32,6 +34,13 @@ def sizedToFill(content, margin=0):
     content.GetParent().SetSizer(sizer)
 
 
+def printDiagnostics(diagnostics):
+    """ Prints the warnings and errors of loading a file - each distinct message once """
+    report = diagnostics.report()
+    if report: print report
+    print " " + diagnostics.summary()
+
+
 class DeviceProfile():
 
     def __init__(self,  name,
@@ -280,8 +289,10 @@ class LazorAppFrame(wx.Frame):
 
         button1 = wx.Button(panel, -1, "Output File")
         button2 = wx.Button(panel, -1, "Write Toolpath")
+        button3 = wx.Button(panel, -1, "Write Drill")
         panel.Bind(wx.EVT_BUTTON, self.OnChooseOutputFile, button1)
         panel.Bind(wx.EVT_BUTTON, self.OnWriteToolpath, button2)
+        panel.Bind(wx.EVT_BUTTON, self.OnWriteDrill, button3)
 
         self.feedrateinput = wx.TextCtrl(panel, -1, "100")
         self.spindlespeedinput = wx.TextCtrl(panel, -1, "1000")
@@ -289,6 +300,10 @@ class LazorAppFrame(wx.Frame):
         self.zupinput = wx.TextCtrl(panel, -1, "0.05")
         self.zdowninput = wx.TextCtrl(panel, -1, "-0.005")
         self.fileoutputinput = wx.TextCtrl(panel, -1, "out.g")
+        self.drilldepthinput = wx.TextCtrl(panel, -1, "-0.07")
+        self.drilldepthinput.SetToolTip(wx.ToolTip("Depth of drilled holes"))
+        self.peckinput = wx.TextCtrl(panel, -1, "")
+        self.peckinput.SetToolTip(wx.ToolTip("Peck depth (G83). Leave empty to drill in one go (G81)"))
 
         self.coolantcheckbox = wx.CheckBox(panel, -1, "Coolant")
 
@@ -312,10 +327,16 @@ class LazorAppFrame(wx.Frame):
         sizer.Add(self.zupinput, 0, wx.EXPAND)
         sizer.Add(wx.StaticText(panel, -1, "Z down"), 0, wx.EXPAND | wx.TOP, 4)
         sizer.Add(self.zdowninput, 0, wx.EXPAND)
+        sizer.Add(wx.StaticText(panel, -1, "Drill depth"), 0, wx.EXPAND | wx.TOP, 4)
+        sizer.Add(self.drilldepthinput, 0, wx.EXPAND)
+        sizer.Add(wx.StaticText(panel, -1, "Peck depth"), 0, wx.EXPAND | wx.TOP, 4)
+        sizer.Add(self.peckinput, 0, wx.EXPAND)
         sizer.Add(button1, 0, wx.EXPAND | wx.RIGHT, 4)
         sizer.Add(self.fileoutputinput, 0, wx.EXPAND)
         sizer.AddSpacer(0)
         sizer.Add(button2, 0, wx.EXPAND)
+        sizer.AddSpacer(0)
+        sizer.Add(button3, 0, wx.EXPAND)
 
         panel.SetSizer(sizer)
         panel.SetAutoLayout(True)
@@ -454,6 +475,12 @@ class LazorAppFrame(wx.Frame):
         else:
             self.write_l()
 
+    def OnWriteDrill(self, evt):
+        if len(self.canvas.drillPts) == 0 and self.canvas.drillPts.slotCount() == 0:
+            self.SetStatusText("No drill data loaded", 0)
+            return
+        self.write_D()
+
     def OnOriginChoose(self, evt):
         if self.data is None: return
         choice = self.origincombo.GetSelection()
@@ -507,7 +534,14 @@ class LazorAppFrame(wx.Frame):
 
         self.SetStatusText("Loading Gerber: " + filename + "...", 0)
 
-        [data, tracks] = load_file(filename)
+        # Arcs are tessellated to suit the tool so no more vertices are generated than the tool can resolve
+        try:
+            tooldia = float(self.tooldiainput.GetValue()) * (25.4 if self.unitcombo.GetCurrentSelection() == 1 else 1)
+            chordError = GerberReader3.chord_error_for_tool(tooldia) if tooldia > 0 else None
+        except ValueError:
+            chordError = None  # invalid tool diameter - use default tessellation
+        [data, tracks] = load_file(filename, chordError=chordError)
+        printDiagnostics(data.diagnostics)
         self.data = data
 
         xmin = 1E99
@@ -521,8 +555,6 @@ class LazorAppFrame(wx.Frame):
         sumTracks = 0
         sumPads = 0
 
-        cbounds = pyclipper.Pyclipper()
-        boundarys = []
         pcb_edges = []
 
         layers = list(data.layers)
@@ -530,15 +562,15 @@ class LazorAppFrame(wx.Frame):
             if gl.type == GerberLayer.TYPE_PCBEDGE:
                 data.layers.remove(gl)
                 pcb_edges.extend(gl.points)
-                for segment in gl.points:
-                    sum1 += len(segment)
-                    for vertex in segment:
-                        x = vertex[0]
-                        y = vertex[1]
-                        if x < xmin: xmin = x
-                        if x > xmax: xmax = x
-                        if y < ymin: ymin = y
-                        if y > ymax: ymax = y
+                sum1 += GerberReader3.vertex_count(gl.points)
+                stt = time.time()
+                bounds = GerberReader3.polygon_bounds(gl.points)
+                data.stats.add("bounds", time.time() - stt, gl.points)
+                if bounds is not None:
+                    if bounds[0] < xmin: xmin = bounds[0]
+                    if bounds[2] > xmax: xmax = bounds[2]
+                    if bounds[1] < ymin: ymin = bounds[1]
+                    if bounds[3] > ymax: ymax = bounds[3]
                 continue
             if gl.type == GerberLayer.TYPE_REGION:
                 sumReg += len(gl.points)
@@ -565,23 +597,16 @@ class LazorAppFrame(wx.Frame):
                 #     cbounds.AddPaths(gl.points, pyclipper.PT_CLIP)
                 #     boundarys = cbounds.Execute(pyclipper.CT_DIFFERENCE, pyclipper.PFT_EVENODD, pyclipper.PFT_EVENODD)
                 #     cbounds.Clear()
-                if gl.isDark:
-                    boundarys.extend(gl.points)
-                else:
-                    cbounds.AddPaths(boundarys, pyclipper.PT_SUBJECT)
-                    cbounds.AddPaths(gl.points, pyclipper.PT_CLIP)
-                    boundarys = cbounds.Execute(pyclipper.CT_DIFFERENCE, pyclipper.PFT_NONZERO, pyclipper.PFT_NONZERO)
-                    cbounds.Clear()
                 sumBound += len(gl.points)
-                for segment in gl.points:
-                    sum1 += len(segment)
-                    for vertex in segment:
-                        x = vertex[0]
-                        y = vertex[1]
-                        if x < xmin: xmin = x
-                        if x > xmax: xmax = x
-                        if y < ymin: ymin = y
-                        if y > ymax: ymax = y
+                sum1 += GerberReader3.vertex_count(gl.points)
+                stt = time.time()
+                bounds = GerberReader3.polygon_bounds(gl.points)
+                data.stats.add("bounds", time.time() - stt, gl.points)
+                if bounds is not None:
+                    if bounds[0] < xmin: xmin = bounds[0]
+                    if bounds[2] > xmax: xmax = bounds[2]
+                    if bounds[1] < ymin: ymin = bounds[1]
+                    if bounds[3] > ymax: ymax = bounds[3]
                 continue
             if gl.type == GerberLayer.TYPE_MERGEDCOPPER:
                 data.layers.remove(gl)
@@ -612,9 +637,15 @@ class LazorAppFrame(wx.Frame):
             pcb_edges.append(pcb_edge)
 
         self.pcb_edges = pcb_edges
-        self.boundarys = boundarys = pyclipper.SimplifyPolygons(boundarys, pyclipper.PFT_NONZERO)
-        # boundarys = GerberReader3.replace_holes_with_seams(boundarys)
-        GerberReader3.closeOffPolys(boundarys)
+        pool = GerberReader3.union_pool()
+        try:
+            boundarys = GerberReader3.merge_copper(data.layers, data.stats, pool)
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+        if GerberReader3.UsePackedPolygons: boundarys = PolygonSet(boundarys)  # shared with merged copper layer
+        self.boundarys = boundarys
 
         data.layers.append(GerberLayer(True, "PCB Edge", pcb_edges, True, False, "blue", GerberLayer.TYPE_PCBEDGE))
         data.layers.append(GerberLayer(True, "Merged Copper", boundarys, False, color="brown", type=GerberLayer.TYPE_MERGEDCOPPER))
@@ -655,7 +686,8 @@ class LazorAppFrame(wx.Frame):
             return
 
         dlg = wx.FileDialog(self, "Open edge file", "", "",
-                            "Gerber Files (*.gml;*.gbl;*.gtl;*.gbr;*.cmp)|*.gml;*.gbl;*.gtl;*.gbr;*.cmp|All Files (*.*)|*",
+                            "Gerber Files (*.gml;*.gbl;*.gtl;*.gbr;*.cmp)|*.gml;*.gbl;*.gtl;*.gbr;*.cmp|"
+                            "Rout files (*.drl;*.rou;*.txt)|*.drl;*.rou;*.txt|All Files (*.*)|*",
                             wx.FD_OPEN | wx.FD_FILE_MUST_EXIST)
 
         if dlg.ShowModal() == wx.ID_CANCEL:
@@ -666,50 +698,46 @@ class LazorAppFrame(wx.Frame):
 
         self.SetStatusText("Loading edge: " + filename + "...", 0)
 
-        [data, edges] = load_file(filename)
-        brdoutline = []
-        brdseg = -1
-
-        while len(edges) > 0:
-            brdoutline.append([])
-            brdseg += 1
-            brdoutline[brdseg].extend(edges[0])
-            edges.remove(edges[0])
-            startpnt = brdoutline[brdseg][0]
-            endpnt = brdoutline[brdseg][len(brdoutline[brdseg]) - 1]
-
-            while (abs(startpnt[0] - endpnt[0]) > 10) | (abs(startpnt[1] - endpnt[1]) > 10):
-                found = False
-                for seg in edges:
-                    if abs(seg[0][0] - endpnt[0]) < 10:
-                        if abs(seg[0][1] - endpnt[1]) < 10:
-                            brdoutline[brdseg].extend(seg)
-                            edges.remove(seg)
-                            endpnt = brdoutline[brdseg][len(brdoutline[brdseg]) - 1]
-                            found = True
-                            break
-                    if abs(seg[len(seg) - 1][0] - endpnt[0]) < 10:
-                        if abs(seg[len(seg) - 1][1] - endpnt[1]) < 10:
-                            edges.remove(seg)
-                            seg = seg[::-1]
-                            brdoutline[brdseg].extend(seg)
-                            endpnt = brdoutline[brdseg][len(brdoutline[brdseg]) - 1]
-                            found = True
-                            break
-                if not found:
-                    dlg = wx.MessageDialog(self, "Edge outline cannot contain any gaps.\n"
-                                                 "No changes were made.", "Load edge file failed",
-                                           wx.OK | wx.ICON_ERROR)
-                    dlg.ShowModal()
-                    dlg.Destroy()
-                    self.SetStatusText("Load edge failed", 0)
-                    return
+        slots = []
+        if ExcellonReader.is_excellon(filename):
+            # Excellon rout paths - scaled straight to the units of the loaded Gerber. Closed paths are offset by
+            # the tool radius to the board edge, open paths are slots
+            diagnostics = Diagnostics()
+            [drillData, units] = ExcellonReader.load_file(filename, diagnostics)
+            printDiagnostics(diagnostics)
+            routs = [([[int(x), int(y)] for (x, y) in path], dia)
+                     for (path, dia) in drillData.scaled(self.drillScale(units)).iterRouts()]
+            brdoutline, slots = GerberReader3.rout_outlines(routs)
+            edgeUnits = self.data.units
+            if len(brdoutline) == 0:
+                self.SetStatusText("Load edge failed - no closed rout paths in " + filename, 0)
+                return
+        else:
+            [data, edges] = load_file(filename)
+            printDiagnostics(data.diagnostics)
+            edgeUnits = data.units
+            brdoutline, chains = chain_edges(edges)
+            if len(chains) > 0:
+                # report where each open outline ends and starts, in the units of the edge file
+                unit = "mm" if edgeUnits == 0 else "in"
+                edgeScale = float(10**data.fraction)
+                msg = "Edge outline cannot contain any gaps.\n%d outline(s) are open between:\n" % len(chains)
+                for chain in chains[:10]:
+                    coords = [v / edgeScale for v in (chain[-1][0], chain[-1][1], chain[0][0], chain[0][1])]
+                    msg += "    (%0.4f, %0.4f) and (%0.4f, %0.4f) " % tuple(coords) + unit + "\n"
+                if len(chains) > 10: msg += "    ...\n"
+                dlg = wx.MessageDialog(self, msg + "No changes were made.", "Load edge file failed",
+                                       wx.OK | wx.ICON_ERROR)
+                dlg.ShowModal()
+                dlg.Destroy()
+                self.SetStatusText("Load edge failed", 0)
+                return
 
         xmin = 1E99
         xmax = -1E99
         ymin = 1E99
         ymax = -1E99
-        if data.units == self.data.units:
+        if edgeUnits == self.data.units:
             for poly in brdoutline:
                 for (x, y) in poly:
                     if x < xmin: xmin = x
@@ -718,7 +746,7 @@ class LazorAppFrame(wx.Frame):
                     if y > ymax: ymax = y
         else:
             # finx bounds and convert units of data at same time
-            conv = 25.4 if data.units == 1 else 1/25.4
+            conv = 25.4 if edgeUnits == 1 else 1/25.4
             print " Unit conversion of edge file data"
             for poly in brdoutline:
                 for pt in poly:
@@ -729,16 +757,15 @@ class LazorAppFrame(wx.Frame):
                     if y < ymin: ymin = y
                     if y > ymax: ymax = y
 
-        # Check if PCB fits inside edge. We're lazy so we just use box bounds (should really use
-        # polygon bounds checking).
-        eps = 10
-        if self.data.xmin2 + eps < xmin or self.data.xmax2 - eps > xmax or \
-                self.data.ymin2 + eps < ymin or self.data.ymax2 - eps > ymax:
-            print self.data.xmin, xmin
-            print self.data.ymin, ymin
-            print self.data.xmax, xmax
-            print self.data.ymax, ymax
+        # Check if the merged copper fits inside the edge
+        outside = GerberReader3.copper_outside_edge(self.boundarys, brdoutline, 10, self.data.stats)
+        if len(outside) > 0:
+            bounds = GerberReader3.polygon_bounds(outside)
+            print " ", len(outside), "copper regions outside the edge, within", bounds
+            for poly in outside[:10]:
+                print "   ", GerberReader3.polygon_bounds([poly])
             dlg = wx.MessageDialog(self, "The loaded edge does not fully contain the PCB board.\n"
+                                         "%d copper regions are outside the edge.\n" % len(outside) +
                                          "Do you still wish to proceed using this edge file?",
                                    "PCB board extends past edge boundary", wx.YES | wx.NO | wx.ICON_WARNING)
             ans = dlg.ShowModal()
@@ -783,6 +810,16 @@ class LazorAppFrame(wx.Frame):
 
         self.canvas.toolpaths = []
         self.canvas.loadData2(self.data, xmin, xmax, ymin, ymax)
+        if len(slots) > 0:
+            # open rout paths are milled with the drill data
+            drill = ExcellonReader.DrillData()
+            drill.units = self.data.units
+            for (path, dia) in slots:
+                tool = drill.tool_for(dia)
+                for i in range(1, len(path)):
+                    drill.add_slot(tool, path[i - 1][0], path[i - 1][1], path[i][0], path[i][1])
+            self.canvas.drillPts = drill
+            print "  Loaded ", drill.slotCount(), " slots from open rout paths"
         self.layersPanel.loadLayersPanel(self.data, self.NotifyDataChange)
         self.SetStatusText("Load edge file completed successfully", 0)
 
@@ -805,7 +842,19 @@ class LazorAppFrame(wx.Frame):
 
         self.SetStatusText("Loading drill: " + filename + "...", 0)
 
-        [drillPts, units] = ExcellonReader.load_file(filename)
+        diagnostics = Diagnostics()
+        [drillPts, units] = ExcellonReader.load_file(filename, diagnostics)
+        printDiagnostics(diagnostics)
+        self.canvas.drillPts = drillPts.scaled(self.drillScale(units))
+        print "  Loaded ", len(drillPts), " drill points and ", drillPts.slotCount(), " slots"
+        if len(drillPts.routs) > 0:
+            print "  Ignored ", len(drillPts.routs), " rout paths (load the file as the edge to use them)"
+
+        self.SetStatusText("Load drill file completed successfully", 0)
+        self.NotifyDataChange()
+
+    def drillScale(self, units):
+        """ :return: scale from the coordinates of a drill file in units to the coordinates of the loaded Gerber """
         fscale = 10**self.data.fraction
         if self.data.units != units:
             print "Conversion of drill file coords required"
@@ -815,17 +864,10 @@ class LazorAppFrame(wx.Frame):
             else:
                 # in -> mm
                 fscale /= 25.4
-        drillPts2 = []
-        for (x, y, dia) in drillPts:
-            drillPts2.append([int(x*fscale), int(y*fscale), int(dia*fscale)])
-        self.canvas.drillPts = drillPts2
-        print "  Loaded ", len(drillPts), " drill points"
-
-        self.SetStatusText("Load drill file completed successfully", 0)
-        self.NotifyDataChange()
+        return fscale
 
     def ClearDrillData(self, evt):
-        self.canvas.drillPts = []
+        self.canvas.drillPts = ExcellonReader.DrillData()
         self.NotifyDataChange()
         self.SetStatusText("Drill data removed", 0)
 
@@ -857,7 +899,10 @@ class LazorAppFrame(wx.Frame):
         for seg in toolpaths:
             if len(seg) > 0:
                 seg.append(seg[0])
-        self.contoolpaths = list(toolpaths)  # cache to allow multiple raster
+        if GerberReader3.UsePackedPolygons:
+            self.contours = PolygonSet(self.contours)
+            toolpaths = self.canvas.toolpaths = PolygonSet(toolpaths)
+        self.contoolpaths = toolpaths[:]  # cache to allow multiple raster
         self.canvas.updateToolpathData()  # update toolpath cahce of wxGerberCanvas - this is to workaround a bug
 
         print "   done"
@@ -878,7 +923,7 @@ class LazorAppFrame(wx.Frame):
         tooldia = float(self.tooldiainput.GetValue()) / self.canvas.mousescale
         if self.showcutwidthcheckbox.IsChecked(): self.canvas.toolpathlinewidth = float(self.tooldiainput.GetValue())
 
-        self.canvas.toolpaths = []
+        self.canvas.toolpaths = PolygonSet() if GerberReader3.UsePackedPolygons else []
         if self.contours == []:
             edgepath = self.boundarys
             delta = tooldia / 2.0
@@ -902,78 +947,12 @@ class LazorAppFrame(wx.Frame):
         self.NotifyDataChange()
 
     def raster_area(self, edgepath, pcbedges, delta, ymin1, ymax1, xmin1, xmax1):
-        #
-        # raster a 2D region
-        #
-        # find row-edge intersections
-        #
         overlap = float(self.rasteroverlapinput.GetValue())
         tooldia = float(self.tooldiainput.GetValue()) / self.canvas.mousescale
-        rastlines = []
-        starty = ymin1
-        endy = ymax1
-        startx = round(xmax1, 2)
-        endx = round(xmin1, 2)
-        numrows = int(math.floor((endy - starty) / (tooldia * overlap)))
-        crast = pyclipper.Pyclipper()
-        edgepath = self.offset_poly(edgepath, delta)
-        result = []
-
-        for row in range(numrows + 1):
-            rastlines.append([])
-            ty = round(starty + row * (tooldia * overlap), 4)
-            rastlines[row].append([startx, ty])
-            rastlines[row].append([endx, ty])
-            startx, endx = endx, startx
-
-        tmp = []
-        for i in range(numrows):
-            tmp.append(rastlines[i][0][1])
-
-        crast.AddPaths(pcbedges, pyclipper.PT_CLIP,True)
-        crast.AddPaths(rastlines, pyclipper.PT_SUBJECT, False)
-        rastlines = crast.Execute2(pyclipper.CT_INTERSECTION, pyclipper.PFT_EVENODD, pyclipper.PFT_EVENODD)
-
-        crast.Clear()
-        rastlines = pyclipper.PolyTreeToPaths(rastlines)
-
-        ##
-        crast.AddPaths(edgepath, pyclipper.PT_CLIP, True)
-        crast.AddPaths(rastlines, pyclipper.PT_SUBJECT, False)
-        rastlines = crast.Execute2(pyclipper.CT_DIFFERENCE, pyclipper.PFT_POSITIVE, pyclipper.PFT_POSITIVE)
-
-        crast.Clear()
-
-        rastlines = pyclipper.PolyTreeToPaths(rastlines)
-
-        # polyclip.sort(key=lambda x: (x[0][1],x[0][0]))
-        # polyclip.sort(key=lambda x: x[0][1])
-        # polyclip.sort(key=lambda x: x[0][0])
-        rastltor = []
-        rastrtol = []
-        for segs in rastlines:
-            if segs[0][0] < segs[1][0]:
-                rastltor.append(segs)
-            else:
-                rastrtol.append(segs)
-        rastltor.sort(key=lambda x: (x[0][1], x[0][0]))
-        rastrtol.sort(key=lambda x: (x[0][1], -x[0][0]))
-
-        result.extend(rastltor)
-        result.extend(rastrtol)
-        result.sort(key=lambda x: x[0][1])
-
-        return result
+        return Toolpaths.raster_area(edgepath, pcbedges, delta, ymin1, ymax1, xmin1, xmax1, tooldia, overlap)
 
     def offset_poly(self, path, toolrad):
-        c_osp = pyclipper.PyclipperOffset()
-        c_osp.AddPaths(path, pyclipper.JT_SQUARE, pyclipper.ET_CLOSEDPOLYGON)
-        polyclip = c_osp.Execute(toolrad)
-
-        polyclip = pyclipper.CleanPolygons(polyclip)
-
-        c_osp.Clear()
-        return polyclip
+        return Toolpaths.offset_poly(path, toolrad)
 
     def write_G(self):
         #
@@ -988,17 +967,6 @@ class LazorAppFrame(wx.Frame):
         yoff = -data.originy * scale
         cool = self.coolantcheckbox.IsChecked()
         text = self.fileoutputinput.GetValue()
-        file = open(text, 'w')
-        # file.write("%\n")
-        file.write("G20\n")
-        file.write("T" + self.toolinput.GetValue() + "M06\n")  # tool
-        file.write("G90 G54\n")  # absolute positioning with respect to set origin
-        file.write("F%0.3f\n" % feed)  # feed rate
-        file.write("S" + self.spindlespeedinput.GetValue() + "\n")  # spindle speed
-        if cool: file.write("M08\n")  # coolant on
-        file.write("G0 Z" + zup + "\n")  # move up before starting spindle
-        file.write("M3\n")  # spindle on clockwise
-        nsegment = 0
 
         if self.canvas.toolpaths == []:
             path = self.boundarys
@@ -1009,46 +977,12 @@ class LazorAppFrame(wx.Frame):
             # zdown = zoff + zmin + (layer-0.50)*dlayer
         else:
             zdown = float(self.zdowninput.GetValue())
-        for segment in range(len(path)):
-            nsegment += 1
-            vertex = 0
-            x = path[segment][vertex][0] * scale + xoff
-            y = path[segment][vertex][1] * scale + yoff
-            file.write("G0 X%0.4f " % x + "Y%0.4f " % y + "Z" + self.zupinput.GetValue() + "\n")  # rapid motion
-            file.write("G1 Z%0.4f " % zdown + "\n")  # linear motion
-            for vertex in range(1, len(path[segment])):
-                x = path[segment][vertex][0] * scale + xoff
-                y = path[segment][vertex][1] * scale + yoff
-                file.write("G1 X%0.4f " % x + "Y%0.4f" % y + "\n")
-            file.write("Z" + zup + "\n")
-        # for layer in range((len(boundarys) - 1), -1, -1):
-            # if (toolpaths[layer] == []):
-            #     path = boundarys[layer]
-            # else:
-            #     path = toolpaths[layer]
-            # if (szdown.get() == " "):
-            #     raise StandardError("This line has an error")
-            #     # zdown = zoff + zmin + (layer-0.50)*dlayer
-            # else:
-            #     zdown = float(szdown.get())
-            # for segment in range(len(path)):
-            #     nsegment += 1
-            #     vertex = 0
-            #     x = path[segment][vertex][0] * xyscale * (10 ** -gerber_data.fraction) + xoff
-            #     y = path[segment][vertex][1] * xyscale * (10 ** -gerber_data.fraction) + yoff
-            #     file.write("G0 X%0.4f " % x + "Y%0.4f " % y + "Z" + szup.get() + "\n")  # rapid motion
-            #     file.write("G1 Z%0.4f " % zdown + "\n")  # linear motion
-            #     for vertex in range(1, len(path[segment])):
-            #         x = path[segment][vertex][0] * xyscale * (10 ** -gerber_data.fraction) + xoff
-            #         y = path[segment][vertex][1] * xyscale * (10 ** -gerber_data.fraction) + yoff
-            #         file.write("G1 X%0.4f " % x + "Y%0.4f" % y + "\n")
-            #     file.write("Z" + szup.get() + "\n")
-        file.write("G0 Z" + zup + "\n")  # move up before stopping spindle
-        file.write("M5\n")  # spindle stop
-        if cool: file.write("M09\n")  # coolant off
-        file.write("M30\n")  # program end and reset
-        # file.write("%\n")
-        file.close()
+        file = open(text, 'w')
+        try:
+            nsegment = Toolpaths.write_gcode(file, path, scale, xoff, yoff, feed, zup, zdown,
+                                             self.toolinput.GetValue(), self.spindlespeedinput.GetValue(), cool)
+        finally:
+            file.close()
         self.SetStatusText("Successfully written " + str(nsegment) + " G code toolpath segments to " + text, 0)
 
     def write_l(self):
@@ -1064,52 +998,43 @@ class LazorAppFrame(wx.Frame):
         cool = self.coolantcheckbox.IsChecked()
         text = self.fileoutputinput.GetValue()
         file = open(text, 'w')
-        # file.write("%\n")
-        # file.write("O1234\n")
-        # file.write("T"+stool.get()+"M06\n") # tool
-        file.write("G90G54\n")  # absolute positioning with respect to set origin
-        # file.write("F%0.3f\n"%feed) # feed rate
-        file.write("S" + str(float(self.spindlespeedinput.GetValue()) / 100) + "\n")  # spindle speed
-        # if (cool == TRUE): file.write("M08\n") # coolant on
-        # file.write("G00Z"+szup.get()+"\n") # move up before starting spindle
-        # file.write("M03\n") # spindle on clockwise
-        nsegment = 0
-        for layer in range((len(self.boundarys) - 1), -1, -1):
-            # FIXME: toolpath will not have same number of layers as boundarys
-            if self.canvas.toolpaths[layer] == []:
-                path = self.boundarys[layer]
-            else:
-                path = self.canvas.toolpaths[layer]
-            ##      if (szdown.get() == " "):
-            ##         zdown = zoff + zmin + (layer-0.50)*dlayer
-            ##      else:
-            ##         zdown = float(szdown.get())
-            for segment in range(len(path)):
-                ##         if (len(path[segment])==0):
-                ##            continue
-                nsegment += 1
-                vertex = 0
-                x = path[segment][vertex][0] * scale + xoff
-                y = path[segment][vertex][1] * scale + yoff
-
-                file.write("G00X%0.4f" % x + "Y%0.4f" % y + "\n")  # rapid motion
-                # file.write("G01Z%0.4f"%zdown+"\n") # linear motion
-                file.write("M03\n")
-                for vertex in range(1, len(path[segment])):
-                    x = path[segment][vertex][0] * scale + xoff
-                    y = path[segment][vertex][1] * scale + yoff
-                    file.write("G01X%0.4f" % x + "Y%0.4f" % y + "F%0.3f\n" % feed + "\n")
-
-                # file.write("Z"+szup.get()+"\n")
-                file.write("M05\n")
-        # file.write("G00Z"+szup.get()+"\n") # move up before stopping spindle
-        file.write("M05\n")  # spindle stop
-        if cool: file.write("M09\n")  # coolant off
-        file.write("M30\n")  # program end and reset
-        # file.write("%\n")
-        file.close()
+        try:
+            nsegment = Toolpaths.write_lazor(file, self.boundarys, self.canvas.toolpaths, scale, xoff, yoff, feed,
+                                             self.spindlespeedinput.GetValue(), cool)
+        finally:
+            file.close()
         self.SetStatusText("Successfully written " + str(nsegment) + " LaZoR code toolpath segments to " + text, 0)
 
+    def write_D(self):
+        #
+        # G code drilling output - written next to the toolpath output file with "_drill" added to its name
+        #
+        data = self.data
+        scale = self.canvas.mousescale  # NOTE: this takes units into account as well!
+        feed = float(self.feedrateinput.GetValue())
+        zup = self.zupinput.GetValue()
+        zdrill = float(self.drilldepthinput.GetValue())
+        peck = float(self.peckinput.GetValue()) if self.peckinput.GetValue().strip() != "" else None
+        xoff = -data.originx * scale
+        yoff = -data.originy * scale
+        cool = self.coolantcheckbox.IsChecked()
+        base, ext = os.path.splitext(self.fileoutputinput.GetValue())
+        text = base + "_drill" + ext
+
+        print "ordering holes ..."
+        drillPts = self.canvas.drillPts
+        groups = Toolpaths.plan_drilling(drillPts, (data.originx, data.originy), slots=list(drillPts.iterSlots()))
+        print "   done"
+        file = open(text, 'w')
+        try:
+            nholes = Toolpaths.write_drill_gcode(file, groups, scale, xoff, yoff, feed, zup, zdrill,
+                                                 self.spindlespeedinput.GetValue(), cool, peck,
+                                                 units=self.canvas.displayunits)
+        finally:
+            file.close()
+        self.SetStatusText("Successfully written " + str(nholes) + " holes and slots using " + str(len(groups)) +
+                           " tools to " + text, 0)
+
     def NotifyDataChange(self):
         self.canvas.redraw()
         self.canvas.Refresh()
@@ -0,0 +1,188 @@
+"""
+Parts shared by the Gerber (GerberReader3) and Excellon (ExcellonReader) readers: the arc segmentation settings,
+arc point generation and the collection of load messages (Diagnostics)
+"""
+
+import collections
+import itertools
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None  # arcs are generated from cached unit circle tables instead
+
+# Alternative is a MIN_SEG_360_R which is like MIN_SEG_360 but also dependent on radius
+# Larger r should have slightly higher segment counts
+""" Maximum arc length when drawing arc segments in mm. The unit must be in MM and NOT INCHES """
+MAX_ARC_LENGTH = 0.25
+""" Minimum number of segs per 360 degrees. THIS MUST BE >= 1 """
+MIN_SEG_PER_360 = 16
+""" Absolute minimum number of segments no matter the arc angle. THIS MUST BE >= 1 """
+MIN_SEG = 1
+
+
+class Diagnostics:
+    """
+    Collects the messages of loading a file (GerberData.diagnostics). Repeated messages are only stored once with
+    the number of times they occurred and the positions (character offset in the data) of the first few
+    occurrences. Nothing is printed unless a verbosity is given.
+    """
+
+    INFO = 0
+    DEPRECATED = 1
+    WARNING = 2
+    ERROR = 3
+    LEVEL_NAMES = ("INFO", "DEPRECATED COMMAND", "WARNING", "ERROR")
+
+    """ Maximum number of positions stored for each message """
+    MAX_POSITIONS = 10
+
+    def __init__(self, verbosity=None):
+        """
+        :param verbosity: messages of this level and above are printed as they occur, e.g. Diagnostics.WARNING.
+            None prints nothing
+        """
+        self.verbosity = verbosity
+        self.messages = collections.OrderedDict()
+        """ (level, message) -> [count, list of positions] in order of first occurrence """
+        self.counts = [0, 0, 0, 0]
+        """ number of messages of each level (including repeats) """
+
+    def add(self, level, msg, pos=None, context=None):
+        """
+        :param pos: position of the cause in the data, None if not applicable
+        :param context: additional text that is printed with the message but not stored, e.g. the data ignored
+        """
+        self.counts[level] += 1
+        key = (level, msg)
+        entry = self.messages.get(key)
+        if entry is None: entry = self.messages[key] = [0, []]
+        entry[0] += 1
+        if pos is not None and len(entry[1]) < self.MAX_POSITIONS: entry[1].append(pos)
+        if self.verbosity is not None and level >= self.verbosity:
+            print "  " + self.LEVEL_NAMES[level] + ": " + msg + ("" if pos is None else "   (pos = " + str(pos) + ")") \
+                + ("" if context is None else " " + context)
+
+    def info(self, msg, pos=None):
+        self.add(self.INFO, msg, pos)
+
+    def dep(self, msg, pos=None):
+        self.add(self.DEPRECATED, msg, pos)
+
+    def warn(self, msg, pos=None, context=None):
+        self.add(self.WARNING, msg, pos, context)
+
+    def error(self, msg, pos=None, context=None):
+        self.add(self.ERROR, msg, pos, context)
+
+    @property
+    def warnings(self):
+        return self.counts[self.WARNING]
+
+    @property
+    def errors(self):
+        return self.counts[self.ERROR]
+
+    @property
+    def deps(self):
+        return self.counts[self.DEPRECATED]
+
+    def items(self, minLevel=INFO):
+        """
+        :return: list of (level, message, count, positions) of the messages of minLevel and above
+        """
+        return [(level, msg, entry[0], entry[1]) for ((level, msg), entry) in self.messages.items()
+                if level >= minLevel]
+
+    def extend(self, items):
+        """
+        Adds messages returned by items() (e.g. of another Diagnostics or cached). Messages that are printed are
+        printed once with their count
+        """
+        for (level, msg, count, positions) in items:
+            self.counts[level] += count
+            entry = self.messages.get((level, msg))
+            if entry is None: entry = self.messages[(level, msg)] = [0, []]
+            entry[0] += count
+            entry[1].extend(positions[:self.MAX_POSITIONS - len(entry[1])])
+            if self.verbosity is not None and level >= self.verbosity:
+                print "  " + self.LEVEL_NAMES[level] + ": " + msg + ("" if count == 1 else "   (x" + str(count) + ")")
+
+    def report(self, minLevel=WARNING):
+        """
+        :return: messages of minLevel and above with their counts and positions, one per line ("" if none)
+        """
+        lines = []
+        for (level, msg, count, positions) in self.items(minLevel):
+            line = "  " + self.LEVEL_NAMES[level] + ": " + msg
+            if count > 1: line += "   (x" + str(count) + ")"
+            if positions: line += "   (pos = " + ", ".join(str(p) for p in positions) + \
+                                  (", ..." if count > len(positions) else "") + ")"
+            lines.append(line)
+        return "\n".join(lines)
+
+    def summary(self):
+        return "Parsing completed with " + str(self.warnings) + " warnings, " + str(self.deps) + \
+               " deprecated commands and " + str(self.errors) + " errors"
+
+
+""" Cache of unit circle tables used by unit_arc """
+_unitArcs = {}
+
+""" Arcs with at least this many points are generated with numpy (if available). Shorter arcs are faster
+to generate in pure python. """
+NUMPY_MIN_STEPS = 64
+
+
+def unit_arc(steps, angleStep):
+    """
+    Returns the cos and sin tables of the angles i*angleStep for i in range(steps). Tables are cached
+    as the same arcs (e.g. every circle of one size) are drawn over and over.
+    :rtype: (tuple, tuple)
+    """
+    key = (steps, angleStep)
+    table = _unitArcs.get(key)
+    if table is None:
+        if len(_unitArcs) >= 4096: _unitArcs.clear()
+        table = _unitArcs[key] = (tuple([math.cos(i*angleStep) for i in range(steps)]),
+                                  tuple([math.sin(i*angleStep) for i in range(steps)]))
+    return table
+
+
+def arc_points(centreX, centreY, r, startAngle, angleStep, steps, dr=0.0, flat=False):
+    """
+    Computes all points of an arc at once. Point i is at angle startAngle + i*angleStep and
+    radius r + i*dr.
+    :param flat: True to return a flat coordinate array [x0, y0, x1, y1, ...] rather than [x,y] points
+    :return: list of [x,y] points or flat coordinate array (numpy array if flat and numpy is used)
+    """
+    if numpy is not None and steps >= NUMPY_MIN_STEPS:
+        i = numpy.arange(steps)
+        angles = startAngle + i*angleStep
+        radii = r + i*dr
+        pts = numpy.empty((steps, 2))
+        pts[:, 0] = centreX + radii*numpy.cos(angles)
+        pts[:, 1] = centreY + radii*numpy.sin(angles)
+        return pts.ravel() if flat else pts.tolist()
+
+    # Rotate the cached table of the unit arc onto the start angle
+    tcos, tsin = unit_arc(steps, angleStep)
+    c0 = math.cos(startAngle)
+    s0 = math.sin(startAngle)
+    if dr == 0:
+        rc = r*c0
+        rs = r*s0
+        if not flat:
+            return [[centreX + rc*c - rs*s, centreY + rs*c + rc*s] for (c, s) in itertools.izip(tcos, tsin)]
+        coords = [0.0] * (2*steps)
+        coords[0::2] = [centreX + rc*c - rs*s for (c, s) in itertools.izip(tcos, tsin)]
+        coords[1::2] = [centreY + rs*c + rc*s for (c, s) in itertools.izip(tcos, tsin)]
+        return coords
+
+    pts = []
+    for i in range(steps):
+        rc = (r + i*dr)*c0
+        rs = (r + i*dr)*s0
+        pts.append([centreX + rc*tcos[i] - rs*tsin[i], centreY + rs*tcos[i] + rc*tsin[i]])
+    return [v for pt in pts for v in pt] if flat else pts
@@ -0,0 +1,495 @@
+"""
+Toolpath generation and output.
+These are the CAM operations used by LazorApp. They only depend on pyclipper so they can also be run without
+the user interface (e.g. by benchmark.py).
+All coordinates are in the internal units of the Gerber data (see GerberData.fraction) unless noted otherwise.
+"""
+
+import math
+import time
+
+import pyclipper
+
+__author__ = 'Thompson'
+
+
+def offset_poly(path, toolrad):
+    """
+    Offsets closed polygons
+    :param path: list of polygons or PolygonSet
+    :param toolrad: offset distance (positive grows the polygons)
+    :return: list of polygons
+    """
+    c_osp = pyclipper.PyclipperOffset()
+    c_osp.AddPaths(path, pyclipper.JT_SQUARE, pyclipper.ET_CLOSEDPOLYGON)
+    polyclip = c_osp.Execute(toolrad)
+
+    polyclip = pyclipper.CleanPolygons(polyclip)
+
+    c_osp.Clear()
+    return polyclip
+
+
+def raster_area(edgepath, pcbedges, delta, ymin1, ymax1, xmin1, xmax1, tooldia, overlap):
+    """
+    Rasters the area inside pcbedges that is not covered by edgepath
+    :param edgepath: polygons to avoid (offset by delta first)
+    :param pcbedges: polygons bounding the area to raster
+    :param tooldia: tool diameter
+    :param overlap: distance between raster lines as a proportion of tooldia
+    :return: list of raster lines sorted by row (lines alternate in direction)
+    """
+    rastlines = []
+    starty = ymin1
+    endy = ymax1
+    startx = round(xmax1, 2)
+    endx = round(xmin1, 2)
+    numrows = int(math.floor((endy - starty) / (tooldia * overlap)))
+    crast = pyclipper.Pyclipper()
+    edgepath = offset_poly(edgepath, delta)
+    result = []
+
+    for row in range(numrows + 1):
+        rastlines.append([])
+        ty = round(starty + row * (tooldia * overlap), 4)
+        rastlines[row].append([startx, ty])
+        rastlines[row].append([endx, ty])
+        startx, endx = endx, startx
+
+    crast.AddPaths(pcbedges, pyclipper.PT_CLIP,True)
+    crast.AddPaths(rastlines, pyclipper.PT_SUBJECT, False)
+    rastlines = crast.Execute2(pyclipper.CT_INTERSECTION, pyclipper.PFT_EVENODD, pyclipper.PFT_EVENODD)
+
+    crast.Clear()
+    rastlines = pyclipper.PolyTreeToPaths(rastlines)
+
+    crast.AddPaths(edgepath, pyclipper.PT_CLIP, True)
+    crast.AddPaths(rastlines, pyclipper.PT_SUBJECT, False)
+    rastlines = crast.Execute2(pyclipper.CT_DIFFERENCE, pyclipper.PFT_POSITIVE, pyclipper.PFT_POSITIVE)
+
+    crast.Clear()
+
+    rastlines = pyclipper.PolyTreeToPaths(rastlines)
+
+    rastltor = []
+    rastrtol = []
+    for segs in rastlines:
+        if segs[0][0] < segs[1][0]:
+            rastltor.append(segs)
+        else:
+            rastrtol.append(segs)
+    rastltor.sort(key=lambda x: (x[0][1], x[0][0]))
+    rastrtol.sort(key=lambda x: (x[0][1], -x[0][0]))
+
+    result.extend(rastltor)
+    result.extend(rastrtol)
+    result.sort(key=lambda x: x[0][1])
+
+    return result
+
+
+def write_gcode(file, path, scale, xoff, yoff, feed, zup, zdown, tool, spindlespeed, cool):
+    """
+    Writes G code
+    :param file: file object to write to
+    :param path: toolpath segments (list of polylines or PolygonSet)
+    :param scale: scale from internal units to output units
+    :param xoff: x offset in output units (applied after scaling)
+    :param zup: travel height (str)
+    :param zdown: cutting depth
+    :param tool: tool number (str)
+    :param spindlespeed: spindle speed (str)
+    :param cool: True to turn on the coolant
+    :return: number of segments written
+    """
+    file.write("G20\n")
+    file.write("T" + tool + "M06\n")  # tool
+    file.write("G90 G54\n")  # absolute positioning with respect to set origin
+    file.write("F%0.3f\n" % feed)  # feed rate
+    file.write("S" + spindlespeed + "\n")  # spindle speed
+    if cool: file.write("M08\n")  # coolant on
+    file.write("G0 Z" + zup + "\n")  # move up before starting spindle
+    file.write("M3\n")  # spindle on clockwise
+    nsegment = 0
+
+    for segment in path:  # iterate rather than index as path may be a PolygonSet
+        nsegment += 1
+        vertex = 0
+        x = segment[vertex][0] * scale + xoff
+        y = segment[vertex][1] * scale + yoff
+        file.write("G0 X%0.4f " % x + "Y%0.4f " % y + "Z" + zup + "\n")  # rapid motion
+        file.write("G1 Z%0.4f " % zdown + "\n")  # linear motion
+        for vertex in range(1, len(segment)):
+            x = segment[vertex][0] * scale + xoff
+            y = segment[vertex][1] * scale + yoff
+            file.write("G1 X%0.4f " % x + "Y%0.4f" % y + "\n")
+        file.write("Z" + zup + "\n")
+    file.write("G0 Z" + zup + "\n")  # move up before stopping spindle
+    file.write("M5\n")  # spindle stop
+    if cool: file.write("M09\n")  # coolant off
+    file.write("M30\n")  # program end and reset
+    return nsegment
+
+
+def write_lazor(file, boundarys, toolpaths, scale, xoff, yoff, feed, spindlespeed, cool):
+    """
+    Writes LaZoR Mk1 code
+    :param file: file object to write to
+    :param boundarys: boundary polygons, used where there is no toolpath
+    :param toolpaths: toolpath segments
+    :param spindlespeed: spindle speed (str)
+    :return: number of segments written
+    """
+    file.write("G90G54\n")  # absolute positioning with respect to set origin
+    file.write("S" + str(float(spindlespeed) / 100) + "\n")  # spindle speed
+    nsegment = 0
+    for layer in range((len(boundarys) - 1), -1, -1):
+        # boundarys without a toolpath of their own (toolpaths may have fewer entries) are cut as they are
+        if layer >= len(toolpaths) or len(toolpaths[layer]) == 0:
+            path = boundarys[layer]
+        else:
+            path = toolpaths[layer]
+        for segment in range(len(path)):
+            nsegment += 1
+            vertex = 0
+            x = path[segment][vertex][0] * scale + xoff
+            y = path[segment][vertex][1] * scale + yoff
+
+            file.write("G00X%0.4f" % x + "Y%0.4f" % y + "\n")  # rapid motion
+            file.write("M03\n")
+            for vertex in range(1, len(path[segment])):
+                x = path[segment][vertex][0] * scale + xoff
+                y = path[segment][vertex][1] * scale + yoff
+                file.write("G01X%0.4f" % x + "Y%0.4f" % y + "F%0.3f\n" % feed + "\n")
+
+            file.write("M05\n")
+    file.write("M05\n")  # spindle stop
+    if cool: file.write("M09\n")  # coolant off
+    file.write("M30\n")  # program end and reset
+    return nsegment
+
+
+# ===== Drilling =====
+# Holes are grouped by tool diameter and each group is ordered to keep the rapid moves between holes short. A
+# nearest neighbour tour is refined with 2-opt and Or-opt moves restricted to the nearest holes of each hole until
+# no move shortens the tour or the time budget (DrillOrderTime) runs out. Nearest holes are found with a grid of
+# cells holding about two holes each.
+# Slots (G85) are milled with the tool of their diameter after its holes, each from whichever end is nearest.
+
+""" Time budget in seconds for refining the order of the holes of each tool. 0 uses the nearest neighbour order """
+DrillOrderTime = 1.0
+""" Number of nearest holes considered for each hole when refining the order """
+DrillNeighbours = 8
+
+
+def group_holes(drillPts):
+    """
+    :param drillPts: list of [x, y, diameter]
+    :return: list of (diameter, list of [x, y]) sorted by diameter (smallest first)
+    """
+    groups = {}
+    for (x, y, dia) in drillPts:
+        groups.setdefault(dia, []).append([x, y])
+    return sorted(groups.items())
+
+
+def plan_drilling(drillPts, start=(0, 0), timeLimit=None, slots=()):
+    """
+    Groups holes and slots by tool and orders each group (see order_holes and order_slots). Each group starts from
+    where the previous group ended
+    :param drillPts: list of [x, y, diameter]
+    :param start: position of the tool before the first hole
+    :param timeLimit: see order_holes
+    :param slots: list of [x1, y1, x2, y2, diameter]
+    :return: list of (diameter, list of [x, y] in drilling order, list of [x1, y1, x2, y2] in milling order)
+        sorted by diameter
+    """
+    slotGroups = {}
+    for (x1, y1, x2, y2, dia) in slots:
+        slotGroups.setdefault(dia, []).append([x1, y1, x2, y2])
+    holeGroups = dict(group_holes(drillPts))
+    groups = []
+    for dia in sorted(set(holeGroups) | set(slotGroups)):
+        holes = order_holes(holeGroups.get(dia, []), start, timeLimit)
+        if len(holes) > 0: start = holes[-1]
+        cuts = order_slots(slotGroups.get(dia, []), start)
+        if len(cuts) > 0: start = cuts[-1][2:]
+        groups.append((dia, holes, cuts))
+    return groups
+
+
+def travel_length(holes, start=(0, 0)):
+    """
+    :return: length of the rapid moves from start through the holes in order
+    """
+    length = 0.0
+    x, y = start
+    for (x1, y1) in holes:
+        length += math.hypot(x1 - x, y1 - y)
+        x, y = x1, y1
+    return length
+
+
+def order_holes(holes, start=(0, 0), timeLimit=None):
+    """
+    Orders holes to minimise the rapid travel between them
+    :param holes: list of [x, y]
+    :param start: position of the tool before the first hole
+    :param timeLimit: time budget in seconds for refining the nearest neighbour order. None uses DrillOrderTime
+    :return: list of [x, y] in drilling order
+    """
+    if timeLimit is None: timeLimit = DrillOrderTime
+    n = len(holes)
+    if n < 2: return list(holes)
+    deadline = time.time() + timeLimit
+    xs = [float(p[0]) for p in holes] + [float(start[0])]  # the start is a fixed extra point at index n
+    ys = [float(p[1]) for p in holes] + [float(start[1])]
+    grid = _HoleGrid(xs[:n], ys[:n])
+
+    # Nearest neighbour tour
+    tour = [n]
+    x, y = xs[n], ys[n]
+    for k in range(n):
+        i = grid.nearest(x, y, True)
+        tour.append(i)
+        x, y = xs[i], ys[i]
+
+    if timeLimit > 0 and n > 2:
+        grid = _HoleGrid(xs[:n], ys[:n])
+        neighbours = [grid.nearestK(xs[i], ys[i], DrillNeighbours + 1)[1:] for i in range(n)]
+        while time.time() < deadline:
+            improved = _two_opt(tour, xs, ys, neighbours, deadline)
+            improved = _or_opt(tour, xs, ys, neighbours, deadline) or improved
+            if not improved: break
+    return [holes[i] for i in tour[1:]]
+
+
+def order_slots(slots, start=(0, 0)):
+    """
+    Orders slots nearest first, each cut from the end nearest to the end of the previous slot
+    :param slots: list of [x1, y1, x2, y2]
+    :param start: position of the tool before the first slot
+    :return: list of [x1, y1, x2, y2] in milling order (reversed where cut from the other end)
+    """
+    if len(slots) < 2: return list(slots)
+    xs = []  # both ends of each slot: slot k has its ends at 2k and 2k + 1
+    ys = []
+    for (x1, y1, x2, y2) in slots:
+        xs += [float(x1), float(x2)]
+        ys += [float(y1), float(y2)]
+    grid = _HoleGrid(xs, ys)
+    ordered = []
+    x, y = start
+    for k in range(len(slots)):
+        i = grid.nearest(x, y, True)
+        grid.remove(i ^ 1)
+        x1, y1, x2, y2 = slots[i // 2]
+        ordered.append([x1, y1, x2, y2] if i % 2 == 0 else [x2, y2, x1, y1])
+        x, y = ordered[-1][2:]
+    return ordered
+
+
+class _HoleGrid:
+    """ Grid of square cells holding the indices of the points in them """
+
+    def __init__(self, xs, ys):
+        self.xs = xs
+        self.ys = ys
+        self.x0 = min(xs)
+        self.y0 = min(ys)
+        w = max(xs) - self.x0
+        h = max(ys) - self.y0
+        self.cell = max(math.sqrt(2.0 * w * h / len(xs)), 2.0 * (w + h) / len(xs)) or 1.0
+        self.cols = int(w / self.cell) + 1
+        self.rows = int(h / self.cell) + 1
+        self.cells = {}
+        for i in range(len(xs)):
+            self.cells.setdefault(self.key(xs[i], ys[i]), []).append(i)
+
+    def key(self, x, y):
+        """ :return: (column, row) of the cell nearest to x, y """
+        return (min(max(int((x - self.x0) / self.cell), 0), self.cols - 1),
+                min(max(int((y - self.y0) / self.cell), 0), self.rows - 1))
+
+    def ring(self, key, r):
+        """ :return: keys of the cells r cells away from key """
+        c, w = key
+        if r == 0: return [key]
+        keys = [(c + d, w - r) for d in range(-r, r + 1)] + [(c + d, w + r) for d in range(-r, r + 1)]
+        keys += [(c - r, w + d) for d in range(1 - r, r)] + [(c + r, w + d) for d in range(1 - r, r)]
+        return keys
+
+    def nearest(self, x, y, remove=False):
+        """
+        :param remove: True to remove the point found from the grid
+        :return: index of the point nearest to x, y or None if the grid is empty
+        """
+        key = self.key(x, y)
+        best = None
+        bestDist = 0
+        for r in range(max(self.cols, self.rows) + 1):
+            if best is not None and bestDist <= (r - 1) * self.cell: break  # cells further out are too far
+            for k in self.ring(key, r):
+                cell = self.cells.get(k)
+                if cell is None: continue
+                for i in cell:
+                    d = math.hypot(self.xs[i] - x, self.ys[i] - y)
+                    if best is None or d < bestDist:
+                        best, bestDist = i, d
+        if remove and best is not None: self.remove(best)
+        return best
+
+    def remove(self, i):
+        """ Removes point i from the grid """
+        k = self.key(self.xs[i], self.ys[i])
+        cell = self.cells[k]
+        cell.remove(i)
+        if len(cell) == 0: del self.cells[k]
+
+    def nearestK(self, x, y, count):
+        """
+        :return: indices of the count points nearest to x, y (nearest first)
+        """
+        key = self.key(x, y)
+        found = []
+        for r in range(max(self.cols, self.rows) + 1):
+            if len(found) >= count:
+                found.sort()
+                if found[count - 1][0] <= (r - 1) * self.cell: break
+            for k in self.ring(key, r):
+                for i in self.cells.get(k, ()):
+                    found.append((math.hypot(self.xs[i] - x, self.ys[i] - y), i))
+        found.sort()
+        return [i for (d, i) in found[:count]]
+
+
+def _two_opt(tour, xs, ys, neighbours, deadline):
+    """
+    Reverses parts of the tour (an open path starting at tour[0]) while that shortens it
+    :return: True if the tour was changed
+    """
+    dist = lambda a, b: math.hypot(xs[a] - xs[b], ys[a] - ys[b])
+    pos = [0] * len(tour)
+    for (k, i) in enumerate(tour): pos[i] = k
+    last = len(tour) - 1
+    improved = False
+    for k in range(last):
+        if k % 64 == 0 and time.time() >= deadline: break
+        a = tour[k]
+        b = tour[k + 1]
+        dab = dist(a, b)
+        for c in neighbours[a] if a < len(neighbours) else ():
+            j = pos[c]
+            if j <= k + 1: continue
+            dac = dist(a, c)
+            if dac >= dab: break  # neighbours are sorted by distance
+            # replace edges a-b and c-d with a-c and b-d (there is no edge after the last hole)
+            if j == last:
+                delta = dac - dab
+            else:
+                d = tour[j + 1]
+                delta = dac + dist(b, d) - dab - dist(c, d)
+            if delta < -1e-9:
+                tour[k + 1:j + 1] = tour[j:k:-1]
+                for m in range(k + 1, j + 1): pos[tour[m]] = m
+                improved = True
+                b = tour[k + 1]
+                dab = dist(a, b)
+    return improved
+
+
+def _or_opt(tour, xs, ys, neighbours, deadline):
+    """
+    Moves runs of 1 to 3 holes (either way round) next to one of the nearest holes of their ends while that
+    shortens the tour
+    :return: True if the tour was changed
+    """
+    dist = lambda a, b: math.hypot(xs[a] - xs[b], ys[a] - ys[b])
+    improved = False
+    for length in (1, 2, 3):
+        pos = [0] * len(tour)  # position of each hole in tour
+        for (k, i) in enumerate(tour): pos[i] = k
+        k = 1  # tour[0] is the start
+        while k + length <= len(tour):
+            if k % 64 == 0 and time.time() >= deadline: return improved
+            s0 = tour[k]
+            s1 = tour[k + length - 1]
+            p = tour[k - 1]
+            nx = tour[k + length] if k + length < len(tour) else None
+            removed = dist(p, s0) + (dist(s1, nx) - dist(p, nx) if nx is not None else 0)
+            best = None
+            for c in neighbours[s0] + neighbours[s1]:
+                j = pos[c]
+                if k - 1 <= j < k + length: continue
+                e = tour[j + 1] if j + 1 < len(tour) else None
+                base = -dist(c, e) if e is not None else 0
+                for (first, second, reverse) in ((s0, s1, False), (s1, s0, True)):
+                    added = dist(c, first) + (dist(second, e) if e is not None else 0) + base
+                    if added - removed < -1e-9 and (best is None or added - removed < best[0]):
+                        best = (added - removed, c, reverse)
+            if best is None:
+                k += 1
+                continue
+            run = tour[k:k + length]
+            if best[2]: run.reverse()
+            del tour[k:k + length]
+            j = pos[best[1]]
+            if j > k: j -= length
+            tour[j + 1:j + 1] = run
+            # only the holes between the old and the new place of the run have moved
+            for m in range(min(k, j + 1), max(k, j + 1) + length): pos[tour[m]] = m
+            improved = True
+    return improved
+
+
+def write_drill_gcode(file, groups, scale, xoff, yoff, feed, zup, zdrill, spindlespeed, cool, peck=None,
+                      firstTool=1, units=1):
+    """
+    Writes G code drilling the holes with canned cycles (G81, or G83 peck drilling) and milling the slots at the
+    drill depth, with a tool change for each group
+    :param file: file object to write to
+    :param groups: list of (diameter, list of [x, y], list of [x1, y1, x2, y2]) in drilling order (see plan_drilling)
+    :param scale: scale from internal units to output units
+    :param xoff: x offset in output units (applied after scaling)
+    :param zup: travel height and retract plane (str)
+    :param zdrill: depth of the holes
+    :param spindlespeed: spindle speed (str)
+    :param cool: True to turn on the coolant
+    :param peck: peck depth for G83. None drills each hole in one go (G81)
+    :param firstTool: tool number of the first group. The groups use consecutive tool numbers
+    :param units: output units (scale converts to these) - 0 for mm (G21), 1 for inches (G20)
+    :return: number of holes and slots written
+    """
+    file.write("G21\n" if units == 0 else "G20\n")
+    file.write("G90 G54\n")  # absolute positioning with respect to set origin
+    file.write("G0 Z" + zup + "\n")
+    nholes = 0
+    tool = firstTool
+    for (dia, holes, slots) in groups:
+        if len(holes) == 0 and len(slots) == 0: continue
+        file.write("T%dM06 (DIA %0.4f)\n" % (tool, dia * scale))  # tool change
+        file.write("S" + spindlespeed + "\n")  # spindle speed
+        if cool: file.write("M08\n")  # coolant on
+        file.write("M3\n")  # spindle on clockwise
+        if len(holes) > 0:
+            x = holes[0][0] * scale + xoff
+            y = holes[0][1] * scale + yoff
+            if peck is None:
+                file.write("G81 X%0.4f Y%0.4f Z%0.4f R" % (x, y, zdrill) + zup + " F%0.3f\n" % feed)
+            else:
+                file.write("G83 X%0.4f Y%0.4f Z%0.4f R" % (x, y, zdrill) + zup + " Q%0.4f F%0.3f\n" % (peck, feed))
+            for (x, y) in holes[1:]:
+                file.write("X%0.4f Y%0.4f\n" % (x * scale + xoff, y * scale + yoff))
+            file.write("G80\n")  # cancel canned cycle
+        for (x1, y1, x2, y2) in slots:
+            file.write("G0 X%0.4f Y%0.4f\n" % (x1 * scale + xoff, y1 * scale + yoff))
+            file.write("G1 Z%0.4f F%0.3f\n" % (zdrill, feed))  # plunge at the drilling feed
+            file.write("G1 X%0.4f Y%0.4f\n" % (x2 * scale + xoff, y2 * scale + yoff))
+            file.write("G0 Z" + zup + "\n")
+        file.write("M5\n")  # spindle stop
+        if cool: file.write("M09\n")  # coolant off
+        nholes += len(holes) + len(slots)
+        tool += 1
+    file.write("G0 Z" + zup + "\n")
+    file.write("M30\n")  # program end and reset
+    return nholes
@@ -0,0 +1,349 @@
+"""
+Scaling benchmark.
+Generates deterministic synthetic boards (Gerber and Excellon) of several sizes and times each step of the
+pipeline without the user interface:
+    gerber_parse    GerberReader3.parse
+    excellon_parse  ExcellonReader.parse
+    drill_order     Toolpaths.plan_drilling (ordering the holes of each tool)
+    merged_copper   GerberReader3.merge_copper
+    offset_poly     Toolpaths.offset_poly (one contour)
+    raster_area     Toolpaths.raster_area
+    write_gcode     Toolpaths.write_gcode
+    write_lazor     Toolpaths.write_lazor
+Each size is run in its own process so the peak memory reported is that of the size alone.
+The results are written as JSON (sorted keys) so the files of two versions can be diffed.
+--workers sets GerberReader3.PipelineWorkers and UnionWorkers (everything runs in one process by default).
+--check-union instead compares the merged copper of a partitioned union (see GerberReader3.tile_union) with that
+of a single union on each board (which has clear layers, so holes) and exits with status 1 if they differ.
+
+Usage:
+    python benchmark.py [--sizes 1000,10000] [--output benchmark.json] [--seed 1] [--workers 4] [--check-union]
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import ExcellonReader
+import GerberReader3
+import Toolpaths
+import pyclipper
+
+try:
+    import resource
+except ImportError:
+    resource = None  # peak memory is not available (Windows)
+
+__author__ = 'Thompson'
+
+""" Default board sizes: number of tracks and number of flashes (and drill holes) of each board """
+SIZES = [1000, 10000, 100000, 1000000]
+
+""" Tool diameter (mm) and raster overlap used for the toolpath steps """
+TOOL_DIA = 0.2
+RASTER_OVERLAP = 0.5
+
+""" Coordinates are written with 4 decimal places (mm) """
+FRACTION = 4
+
+
+# ===== Workload generator =====
+# The boards have a constant density so the area grows with the size. Every board has standard and macro
+# apertures, tracks with arcs, regions and a clear (LPC) layer in every few dark layers.
+
+def _coord(v):
+    return int(round(v * 10 ** FRACTION))
+
+
+def generate_gerber(n, seed=1):
+    """
+    :param n: number of tracks and number of flashes
+    :return: Gerber file content (str)
+    """
+    rnd = random.Random(seed)
+    side = max(20.0, math.sqrt(n) * 1.5)  # board size in mm
+    out = ["G04 synthetic board n=%d seed=%d*" % (n, seed),
+           "%%FSLAX3%dY3%d*%%" % (FRACTION, FRACTION),
+           "%MOMM*%",
+           "%AMPAD1*1,1,$1,0,0*21,1,$1,$1,0,0,45*4,1,4,-0.4,-0.4,0.4,-0.4,0.4,0.4,-0.4,0.4,-0.4,-0.4,0*%",
+           "%ADD10C,0.15*%",
+           "%ADD11C,0.25*%",
+           "%ADD12R,0.6X0.4*%",
+           "%ADD13O,0.5X1.0*%",
+           "%ADD14P,0.8X6*%",
+           "%ADD15PAD1,0.5*%",
+           "G75*"]
+
+    blocks = 4 + n // 100000  # number of dark layers, each followed by a clear layer
+    for block in range(blocks):
+        first = block * n // blocks
+        last = (block + 1) * n // blocks
+        out.append("%LPD*%")
+
+        # Tracks: short random walks, about one in ten segments is an arc
+        out.append("D10*" if block % 2 == 0 else "D11*")
+        out.append("G01*")
+        mode = 1
+        for i in range(first, last):
+            x = rnd.uniform(0, side)
+            y = rnd.uniform(0, side)
+            out.append("X%dY%dD02*" % (_coord(x), _coord(y)))
+            for seg in range(rnd.randint(1, 3)):
+                arc = rnd.random() < 0.1
+                if arc != (mode == 3):
+                    mode = 3 if arc else 1
+                    out.append("G%02d*" % mode)
+                if arc:
+                    r = rnd.uniform(0.3, 1.5)
+                    a0 = rnd.uniform(0, 2 * math.pi)
+                    a1 = a0 + rnd.uniform(0.3, 2.5)
+                    cx = x - r * math.cos(a0)
+                    cy = y - r * math.sin(a0)
+                    i = _coord(cx) - _coord(x)
+                    j = _coord(cy) - _coord(y)
+                    x = cx + r * math.cos(a1)
+                    y = cy + r * math.sin(a1)
+                    out.append("X%dY%dI%dJ%dD01*" % (_coord(x), _coord(y), i, j))
+                else:
+                    x += rnd.uniform(-2, 2)
+                    y += rnd.uniform(-2, 2)
+                    out.append("X%dY%dD01*" % (_coord(x), _coord(y)))
+
+        # Flashes
+        aperture = None
+        for i in range(first, last):
+            d = 12 + 4 * (i - first) // (last - first)  # the four pad apertures in turn
+            if d != aperture:
+                out.append("D%d*" % d)
+                aperture = d
+            out.append("X%dY%dD03*" % (_coord(rnd.uniform(0, side)), _coord(rnd.uniform(0, side))))
+
+        # Regions (pours)
+        if mode != 1:
+            out.append("G01*")
+            mode = 1
+        for i in range(max(1, (last - first) // 200)):
+            cx = rnd.uniform(0, side)
+            cy = rnd.uniform(0, side)
+            r = rnd.uniform(1, 4)
+            out.append("G36*")
+            out.append("X%dY%dD02*" % (_coord(cx + r), _coord(cy)))
+            for k in range(1, 7):
+                out.append("X%dY%dD01*" % (_coord(cx + r * math.cos(k * math.pi / 3)),
+                                          _coord(cy + r * math.sin(k * math.pi / 3))))
+            out.append("G37*")
+
+        # Knockouts
+        out.append("%LPC*%")
+        out.append("D11*")
+        for i in range(max(1, (last - first) // 100)):
+            out.append("X%dY%dD03*" % (_coord(rnd.uniform(0, side)), _coord(rnd.uniform(0, side))))
+
+    out.append("M02*")
+    return "\n".join(out) + "\n"
+
+
+def generate_excellon(n, seed=1):
+    """
+    :param n: number of drill holes
+    :return: Excellon file content (str)
+    """
+    rnd = random.Random(seed)
+    side = max(20.0, math.sqrt(n) * 1.5)
+    tools = [0.4, 0.6, 0.8, 1.0, 3.2]
+    out = ["M48", "METRIC,TZ"]
+    for t in range(len(tools)):
+        out.append("T%dC%.3f" % (t + 1, tools[t]))
+    out.append("%")
+    for t in range(len(tools)):
+        out.append("T%d" % (t + 1))
+        for i in range(t * n // len(tools), (t + 1) * n // len(tools)):
+            out.append("X%.4fY%.4f" % (rnd.uniform(0, side), rnd.uniform(0, side)))
+    out.append("M30")
+    return "\n".join(out)
+
+
+# ===== Benchmark =====
+
+def _record(seconds, lines=0, vertices=0):
+    return {"seconds": seconds,
+            "lines": lines,
+            "vertices": vertices,
+            "lines_per_s": lines / seconds if seconds > 0 else 0,
+            "vertices_per_s": vertices / seconds if seconds > 0 else 0}
+
+
+def run_size(n, seed=1):
+    """
+    Runs every step on a board of size n
+    :return: dictionary of results
+    """
+    result = {"size": n, "steps": {}}
+    steps = result["steps"]
+
+    gerber = generate_gerber(n, seed)
+    excellon = generate_excellon(n, seed)
+
+    stt = time.time()
+    gd, tracks = GerberReader3.parse(gerber, useCache=False)
+    steps["gerber_parse"] = _record(time.time() - stt, gerber.count("\n"),
+                                    sum(GerberReader3.vertex_count(gl.points) for gl in gd.layers))
+
+    stt = time.time()
+    drillPts, units = ExcellonReader.parse(excellon)
+    steps["excellon_parse"] = _record(time.time() - stt, excellon.count("\n") + 1, len(drillPts))
+
+    stt = time.time()
+    groups = Toolpaths.plan_drilling(drillPts)
+    steps["drill_order"] = _record(time.time() - stt, 0, len(drillPts))
+
+    stt = time.time()
+    pool = GerberReader3.union_pool()  # started and stopped within the step, as LazorApp does for each load
+    try:
+        boundarys = GerberReader3.merge_copper(gd.layers, gd.stats, pool)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    steps["merged_copper"] = _record(time.time() - stt, 0, GerberReader3.vertex_count(boundarys))
+    result["gerber_stats"] = gd.stats.asDict()  # includes the stages of the parse and the merged copper
+
+    toolrad = TOOL_DIA / 2.0 * 10 ** FRACTION
+    stt = time.time()
+    contours = Toolpaths.offset_poly(boundarys, toolrad)
+    steps["offset_poly"] = _record(time.time() - stt, 0, GerberReader3.vertex_count(contours))
+
+    bounds = GerberReader3.polygon_bounds(boundarys) or [0, 0, 1, 1]
+    xmin, ymin, xmax, ymax = bounds
+    pcbedges = [[[xmax, ymax], [xmax, ymin], [xmin, ymin], [xmin, ymax]]]
+    stt = time.time()
+    raster = Toolpaths.raster_area(contours, pcbedges, 0, ymin, ymax, xmin, xmax, TOOL_DIA * 10 ** FRACTION,
+                                   RASTER_OVERLAP)
+    steps["raster_area"] = _record(time.time() - stt, 0, GerberReader3.vertex_count(raster))
+
+    toolpaths = [path for path in contours + raster if len(path) > 0]
+    vertices = GerberReader3.vertex_count(toolpaths)
+    scale = 10 ** -FRACTION
+    fd, filename = tempfile.mkstemp(".nc")
+    os.close(fd)
+    try:
+        f = open(filename, 'w')
+        stt = time.time()
+        Toolpaths.write_gcode(f, toolpaths, scale, 0, 0, 100.0, "1", -0.1, "1", "10000", False)
+        f.close()
+        steps["write_gcode"] = _record(time.time() - stt, _count_lines(filename), vertices)
+
+        f = open(filename, 'w')
+        stt = time.time()
+        Toolpaths.write_lazor(f, [boundarys], [toolpaths], scale, 0, 0, 100.0, "10000", False)
+        f.close()
+        steps["write_lazor"] = _record(time.time() - stt, _count_lines(filename), vertices)
+    finally:
+        os.remove(filename)
+
+    # ru_maxrss is in kilobytes on Linux and bytes on OS X
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        result["peak_memory_kb"] = peak // 1024 if sys.platform == "darwin" else peak
+    else:
+        result["peak_memory_kb"] = None
+    return result
+
+
+def check_union(n, seed=1):
+    """
+    Compares the merged copper of a board made with partitioned unions with that made with single unions
+    :return: True if they cover the same area (up to the rounding of intersection points)
+    """
+    gd, tracks = GerberReader3.parse(generate_gerber(n, seed), useCache=False)
+    minPolygons = GerberReader3.TileUnionMinPolygons
+    pool = GerberReader3.union_pool()
+    try:
+        GerberReader3.TileUnionMinPolygons = min(minPolygons, 500) or 500
+        tiled = GerberReader3.merge_copper(gd.layers, None, pool)
+        GerberReader3.TileUnionMinPolygons = 0
+        single = GerberReader3.merge_copper(gd.layers)
+    finally:
+        GerberReader3.TileUnionMinPolygons = minPolygons
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    c = pyclipper.Pyclipper()
+    c.AddPaths(single, pyclipper.PT_SUBJECT)
+    c.AddPaths(tiled, pyclipper.PT_CLIP)
+    xor = sum(abs(pyclipper.Area(poly)) for poly in c.Execute(pyclipper.CT_XOR, pyclipper.PFT_NONZERO,
+                                                               pyclipper.PFT_NONZERO))
+    area = sum(pyclipper.Area(poly) for poly in single)
+    print "  area %.6g, difference %.3g" % (area, xor)
+    return xor <= 1e-6 * abs(area)
+
+
+def _count_lines(filename):
+    f = open(filename, 'r')
+    try:
+        return sum(1 for line in f)
+    finally:
+        f.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scaling benchmark of the Gerber/Excellon pipeline")
+    parser.add_argument("--sizes", default=",".join(str(n) for n in SIZES),
+                        help="comma separated board sizes (number of tracks and flashes)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=0, help="worker processes for layers and unions")
+    parser.add_argument("--output", default="benchmark.json", help="JSON results file")
+    parser.add_argument("--check-union", action="store_true",
+                        help="compare partitioned and single unions of the merged copper instead")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    sizes = [int(s) for s in args.sizes.split(",")]
+    GerberReader3.PipelineWorkers = args.workers
+    GerberReader3.UnionWorkers = args.workers
+
+    if args.check_union:
+        ok = True
+        for n in sizes:
+            print "Board size", n, "..."
+            ok = check_union(n, args.seed) and ok
+        print "Partitioned union", "matches" if ok else "DIFFERS"
+        sys.exit(0 if ok else 1)
+
+    if args.child:  # single size run by the parent - result is written to stdout
+        result = run_size(sizes[0], args.seed)
+        sys.stdout.write("\nRESULT " + json.dumps(result) + "\n")
+        return
+
+    results = []
+    for n in sizes:
+        print "Board size", n, "..."
+        proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--child", "--sizes", str(n),
+                                 "--seed", str(args.seed), "--workers", str(args.workers)], stdout=subprocess.PIPE)
+        output = proc.communicate()[0]
+        if proc.returncode != 0:
+            print "  failed with exit code", proc.returncode
+            continue
+        result = json.loads(output[output.rindex("\nRESULT ") + 8:])
+        results.append(result)
+        for (step, rec) in sorted(result["steps"].items()):
+            print "  %-15s %9.3fs %12.0f lines/s %12.0f vertices/s" % (step, rec["seconds"], rec["lines_per_s"],
+                                                                       rec["vertices_per_s"])
+        print "  peak memory", result["peak_memory_kb"], "kB"
+
+    f = open(args.output, 'w')
+    try:
+        json.dump({"python": sys.version.split()[0], "seed": args.seed, "results": results}, f,
+                  indent=1, sort_keys=True)
+    finally:
+        f.close()
+    print "Results written to", args.output
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Drill ordering and drill G code output (Toolpaths)
+"""
+
+import os
+import random
+import sys
+import time
+import unittest
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import Toolpaths
+
+
+def random_holes(n, seed=1):
+    rnd = random.Random(seed)
+    return [[rnd.randint(0, 100000), rnd.randint(0, 100000)] for i in range(n)]
+
+
+class DrillOrderTest(unittest.TestCase):
+
+    def test_or_opt(self):
+        holes = random_holes(500)
+        n = len(holes)
+        xs = [float(x) for (x, y) in holes] + [0.0]
+        ys = [float(y) for (x, y) in holes] + [0.0]
+        grid = Toolpaths._HoleGrid(xs[:n], ys[:n])
+        neighbours = [grid.nearestK(xs[i], ys[i], Toolpaths.DrillNeighbours + 1)[1:] for i in range(n)]
+        tour = [n] + random.Random(2).sample(range(n), n)
+        before = Toolpaths.travel_length([holes[i] for i in tour[1:]])
+        while Toolpaths._or_opt(tour, xs, ys, neighbours, time.time() + 60): pass
+        self.assertEqual(tour[0], n)
+        self.assertEqual(sorted(tour), range(n + 1))
+        self.assertTrue(Toolpaths.travel_length([holes[i] for i in tour[1:]]) < before)
+
+    def test_order_holes(self):
+        holes = random_holes(300, 3)
+        ordered = Toolpaths.order_holes(holes, (0, 0), 1.0)
+        self.assertEqual(sorted(ordered), sorted(holes))
+
+
+class DrillGcodeTest(unittest.TestCase):
+
+    def write(self, **kwargs):
+        groups = [(0.8, [[0, 0], [1, 1]], [[0, 0, 2, 2]])]
+        f = StringIO()
+        nholes = Toolpaths.write_drill_gcode(f, groups, 1.0, 0, 0, 100.0, "1", -2.0, "10000", False, **kwargs)
+        self.assertEqual(nholes, 3)
+        return f.getvalue().splitlines()
+
+    def test_units(self):
+        self.assertEqual(self.write()[0], "G20")
+        self.assertEqual(self.write(units=1)[0], "G20")
+        self.assertEqual(self.write(units=0)[0], "G21")
+
+    def test_peck(self):
+        lines = self.write(peck=0.5)
+        self.assertTrue(any(line.startswith("G83 ") and " Q0.5000 " in line for line in lines))
+
+
+if __name__ == '__main__':
+    unittest.main()
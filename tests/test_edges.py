@@ -0,0 +1,125 @@
+"""
+Board edges: chaining edge segments into outlines (chain_edges) and checking the copper against the edge
+(copper_outside_edge)
+"""
+
+import math
+import os
+import random
+import sys
+import unittest
+
+import pyclipper
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import GerberReader3
+
+
+def segments(points):
+    """ :return: the segments between consecutive points """
+    return [[points[i], points[i + 1]] for i in range(len(points) - 1)]
+
+
+def rect(x0, y0, x1, y1):
+    return [[x0, y0], [x1, y0], [x1, y1], [x0, y1]]
+
+
+def shuffled(edges, seed=1):
+    """ :return: edges in random order, some reversed """
+    rnd = random.Random(seed)
+    edges = [seg[::-1] if rnd.random() < 0.5 else list(seg) for seg in edges]
+    rnd.shuffle(edges)
+    return edges
+
+
+class ChainEdgesTest(unittest.TestCase):
+
+    def test_closed(self):
+        square = [[0, 0], [1000, 0], [1000, 1000], [0, 1000], [0, 0]]
+        outlines, chains = GerberReader3.chain_edges(shuffled(segments(square)))
+        self.assertEqual(chains, [])
+        self.assertEqual(len(outlines), 1)
+        outline = outlines[0]
+        self.assertEqual(outline[0], outline[-1])
+        self.assertEqual(set(map(tuple, outline)), set(map(tuple, square)))
+
+    def test_snap(self):
+        # ends that miss each other by less than the tolerance are joined
+        edges = [[[0, 0], [1000, 3]], [[1004, 0], [1000, 1000]], [[998, 1002], [0, 1000]], [[2, 1000], [5, 5]]]
+        outlines, chains = GerberReader3.chain_edges(shuffled(edges, 2))
+        self.assertEqual((len(outlines), chains), (1, []))
+        outlines, chains = GerberReader3.chain_edges(edges, 2)
+        self.assertEqual(len(outlines), 0)
+        self.assertEqual(len(chains), 4)
+
+    def test_gap(self):
+        # a square with its left side missing and a closed triangle: the open chain runs from one end of the gap
+        # to the other, whichever segment it starts from
+        square = segments([[0, 1000], [0, 0], [1000, 0], [1000, 1000], [0, 1000]])[1:]
+        triangle = segments([[2000, 0], [3000, 0], [2500, 800], [2000, 0]])
+        for seed in range(5):
+            outlines, chains = GerberReader3.chain_edges(shuffled(square + triangle, seed))
+            self.assertEqual(len(outlines), 1)
+            self.assertEqual(len(chains), 1)
+            chain = chains[0]
+            self.assertEqual(sorted([chain[0], chain[-1]]), [[0, 0], [0, 1000]])
+            self.assertEqual(len(chain), 6)
+
+    def test_several_gaps(self):
+        edges = [[[i * 100, 0], [i * 100 + 50, 0]] for i in range(4)]
+        outlines, chains = GerberReader3.chain_edges(edges)
+        self.assertEqual(outlines, [])
+        self.assertEqual(sorted(sorted(chain) for chain in chains), edges)
+
+    def test_many_segments(self):
+        # a circle of small segments, as exported by some CAD programs
+        n = 20000
+        points = [[int(round(1e6 * math.cos(2 * math.pi * i / n))), int(round(1e6 * math.sin(2 * math.pi * i / n)))]
+                  for i in range(n)]
+        outlines, chains = GerberReader3.chain_edges(shuffled(segments(points + points[:1]), 3))
+        self.assertEqual(chains, [])
+        self.assertEqual(len(outlines), 1)
+        self.assertEqual(len(set(map(tuple, outlines[0]))), n)
+
+
+class CopperOutsideEdgeTest(unittest.TestCase):
+
+    # L shaped board with a cut out
+    edges = [[[0, 0], [10000, 0], [10000, 4000], [4000, 4000], [4000, 10000], [0, 10000]],
+             rect(1000, 5000, 3000, 8000)]
+
+    def outside(self, copper):
+        return GerberReader3.copper_outside_edge(copper, self.edges)
+
+    def area(self, polys):
+        return sum(abs(pyclipper.Area(poly)) for poly in polys)
+
+    def test_fits(self):
+        copper = [rect(500, 500, 9500, 3500), rect(500, 4500, 900, 9500), rect(3100, 4100, 3900, 9900)]
+        self.assertEqual(self.outside(copper), [])
+
+    def test_outside_in_bounding_box(self):
+        # in the bounding box of the board but off the board (the notch of the L and the cut out)
+        outside = self.outside([rect(500, 500, 2000, 2000), rect(6000, 6000, 8000, 8000)])
+        self.assertEqual(self.area(outside), 2000 * 2000)
+        outside = self.outside([rect(1500, 6000, 2500, 7000)])
+        self.assertEqual(self.area(outside), 1000 * 1000)
+
+    def test_crossing(self):
+        outside = self.outside([rect(9000, 1000, 11000, 2000), rect(3000, 9000, 5000, 9500)])
+        self.assertEqual(self.area(outside), 1000 * 1000 + 1000 * 500)
+
+    def test_tolerance(self):
+        self.assertEqual(self.outside([rect(9000, 3000, 10005, 3005)]), [])
+
+    def test_packed(self):
+        copper = GerberReader3.PolygonSet([rect(500, 500, 2000, 2000), rect(6000, 6000, 8000, 8000)])
+        self.assertEqual(self.area(self.outside(copper)), 2000 * 2000)
+
+    def test_no_edge(self):
+        copper = [rect(0, 0, 10, 10)]
+        self.assertEqual(GerberReader3.copper_outside_edge(copper, []), copper)
+
+
+if __name__ == '__main__':
+    unittest.main()
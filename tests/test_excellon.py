@@ -0,0 +1,132 @@
+"""
+Excellon drill file reader (ExcellonReader)
+"""
+
+import math
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+import ExcellonReader
+import GerberReader3
+
+
+def drill(body, header=""):
+    """ :return: (DrillData, units) of a drill file with the given header lines and body """
+    return ExcellonReader.parse("M48\n" + header + "T1C0.8\n%\nT1\n" + body + "M30\n")
+
+
+def holes(dd):
+    return [[round(x, 6), round(y, 6)] for (x, y, dia) in dd]
+
+
+class NumberFormatTest(unittest.TestCase):
+
+    def test_metric_without_header(self):
+        dd, units = drill("X012500Y003000\n")
+        self.assertEqual(units, 0)
+        self.assertEqual(holes(dd), [[12.5, 3.0]])
+
+    def test_metric(self):
+        self.assertEqual(holes(drill("X012500Y003000\n", "METRIC,LZ\n")[0]), [[12.5, 3.0]])
+        self.assertEqual(holes(drill("X12500Y3000\n", "METRIC,TZ\n")[0]), [[12.5, 3.0]])
+        self.assertEqual(holes(drill("X0125Y0030\n", "METRIC,LZ,00.00\n")[0]), [[1.25, 0.3]])
+
+    def test_inch(self):
+        dd, units = drill("X012500Y003000\n", "INCH,LZ\n")
+        self.assertEqual(units, 1)
+        self.assertEqual(holes(dd), [[1.25, 0.3]])
+        self.assertEqual(holes(drill("X12500Y3000\n", "INCH,TZ\n")[0]), [[1.25, 0.3]])
+
+    def test_decimal_point(self):
+        self.assertEqual(holes(drill("X1.5Y-2.25\nX+3.Y.5\n", "INCH,LZ\n")[0]), [[1.5, -2.25], [3.0, 0.5]])
+
+    def test_incremental(self):
+        dd = drill("X1.0Y1.0\nICI,ON\nX0.5\nY0.25\n")[0]
+        self.assertEqual(holes(dd), [[1.0, 1.0], [1.5, 1.0], [1.5, 1.25]])
+
+
+class RepeatSlotTest(unittest.TestCase):
+
+    def test_repeat(self):
+        dd = drill("X1.0Y1.0\nR3X0.5\nR2Y-0.25\nR0X1.0\nX5.0Y5.0\n")[0]
+        self.assertEqual(len(dd), 7)
+        self.assertEqual(sorted(holes(dd)), sorted([[1.0, 1.0], [5.0, 5.0], [1.5, 1.0], [2.0, 1.0], [2.5, 1.0],
+                                                    [2.5, 0.75], [2.5, 0.5]]))
+        self.assertEqual(len(dd.repeats[1]), 10)  # kept as two records, not expanded
+
+    def test_repeat_scaled(self):
+        dd = drill("X1.0Y1.0\nR2X0.5\n")[0].scaled(10)
+        self.assertEqual(sorted(holes(dd)), [[10.0, 10.0], [15.0, 10.0], [20.0, 10.0]])
+
+    def test_slot(self):
+        dd = drill("X1.0Y1.0G85X2.0Y1.0\nX1.0Y2.0G85X3.0\nX012000Y001000G85X012000Y004000\n")[0]
+        self.assertEqual(len(dd), 0)
+        self.assertEqual(dd.slotCount(), 3)
+        self.assertEqual(list(dd.iterSlots()), [[1.0, 1.0, 2.0, 1.0, 0.8], [1.0, 2.0, 3.0, 2.0, 0.8],
+                                                [12.0, 1.0, 12.0, 4.0, 0.8]])
+
+    def test_invalid_slot(self):
+        diagnostics = ExcellonReader.Diagnostics()
+        dd, units = ExcellonReader.parse("M48\nT1C0.8\n%\nT1\nX1.0G85Q1\nM30\n", diagnostics)
+        self.assertEqual(dd.slotCount(), 0)
+        self.assertEqual(diagnostics.warnings, 1)
+
+
+class RoutTest(unittest.TestCase):
+
+    def rout(self, body):
+        diagnostics = ExcellonReader.Diagnostics()
+        dd, units = ExcellonReader.parse("M48\nMETRIC\nT1C2.0\n%\nT1\n" + body + "G05\nM30\n", diagnostics)
+        return dd, diagnostics
+
+    def test_lines(self):
+        dd, diagnostics = self.rout("G00X0.0Y0.0\nM15\nG01X10.0Y0.0\nX10.0Y10.0\nX0.0Y10.0\nX0.0Y0.0\nM16\n"
+                                    "G00X20.0Y0.0\nM15\nG01X30.0Y0.0\nM17\nG00X40.0Y0.0\nG01X50.0Y0.0\n")
+        self.assertEqual(diagnostics.warnings, 0)
+        self.assertEqual(len(dd), 0)  # rout moves are not holes
+        self.assertEqual(list(dd.iterRouts()), [([[0, 0], [10, 0], [10, 10], [0, 10], [0, 0]], 2.0),
+                                                ([[20, 0], [30, 0]], 2.0)])
+
+    def test_arcs(self):
+        # a circle of radius 5 about (5, 0) from a clockwise arc given by its radius and one given by its centre
+        dd, diagnostics = self.rout("G00X0.0Y0.0\nM15\nG02X10.0Y0.0A5.0\nG02X0.0Y0.0I-5.0J0.0\nM16\n")
+        [(path, dia)] = list(dd.iterRouts())
+        self.assertEqual(path[0], [0, 0])
+        self.assertEqual(path[-1], [0, 0])
+        for (x, y) in path: self.assertAlmostEqual(math.hypot(x - 5, y), 5, 6)
+        self.assertAlmostEqual(max(y for (x, y) in path), 5, 1)
+        self.assertAlmostEqual(min(y for (x, y) in path), -5, 1)
+        half = path.index([10, 0])
+        self.assertTrue(all(y >= 0 for (x, y) in path[:half]) and all(y <= 0 for (x, y) in path[half:]))
+
+    def test_compensation_ignored(self):
+        dd, diagnostics = self.rout("G00X0.0Y0.0\nG41\nM15\nG01X10.0Y0.0\nM16\nG40\n")
+        self.assertEqual(list(dd.iterRouts()), [([[0, 0], [10, 0]], 2.0)])
+        self.assertEqual(diagnostics.warnings, 1)
+
+    def test_outlines(self):
+        # board routed around with a 2 mm tool, a cut out and a slot - in thousandths of a mm
+        dd = self.rout("G00X0.0Y0.0\nM15\nG01X50.0Y0.0\nX50.0Y40.0\nX0.0Y40.0\nX0.0Y0.0\nM16\n"
+                       "G00X10.0Y10.0\nM15\nG01X20.0Y10.0\nX20.0Y20.0\nX10.0Y20.0\nX10.0Y10.0\nM16\n"
+                       "G00X30.0Y10.0\nM15\nG01X40.0Y10.0\nM16\n")[0].scaled(1000)
+        routs = [([[int(round(x)), int(round(y))] for (x, y) in path], dia) for (path, dia) in dd.iterRouts()]
+        outlines, slots = GerberReader3.rout_outlines(routs)
+        self.assertEqual([(sorted(path), dia) for (path, dia) in slots], [([[30000, 10000], [40000, 10000]], 2000.0)])
+        self.assertEqual(len(outlines), 2)
+        boxes = sorted(GerberReader3.polygon_bounds([poly]) for poly in outlines)
+        self.assertEqual(boxes, [[1000, 1000, 49000, 39000], [9000, 9000, 21000, 21000]])
+
+
+class DependencyTest(unittest.TestCase):
+
+    def test_no_gerber_reader(self):
+        code = "import sys, ExcellonReader; sys.exit('GerberReader3' in sys.modules)"
+        self.assertEqual(subprocess.call([sys.executable, "-c", code], cwd=ROOT), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
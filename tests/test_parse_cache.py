@@ -0,0 +1,60 @@
+"""
+Parse result cache (ParseCacheDir) round trip
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import GerberReader3
+
+GERBER_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "gerber files", "test1.gbl")
+
+
+def layer_points(gd):
+    return [(gl.isDark, gl.name, gl.type, [[list(pt) for pt in poly] for poly in gl.points]) for gl in gd.layers]
+
+
+def from_cache(gd):
+    return any(msg.startswith("Loaded from parse cache") for (level, msg, count, positions) in gd.diagnostics.items())
+
+
+class ParseCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cacheDir = GerberReader3.ParseCacheDir
+        self.codeHash = GerberReader3._codeHash
+        GerberReader3.ParseCacheDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(GerberReader3.ParseCacheDir)
+        GerberReader3.ParseCacheDir = self.cacheDir
+        GerberReader3._codeHash = self.codeHash
+
+    def test_default_off(self):
+        self.assertTrue(self.cacheDir is None)
+
+    def test_round_trip(self):
+        gd, tracks = GerberReader3.load_file(GERBER_FILE)
+        self.assertFalse(from_cache(gd))
+        gd2, tracks2 = GerberReader3.load_file(GERBER_FILE)
+        self.assertTrue(from_cache(gd2))
+        self.assertEqual(layer_points(gd), layer_points(gd2))
+        self.assertEqual(tracks, tracks2)
+        self.assertEqual((gd.units, gd.digits, gd.fraction), (gd2.units, gd2.digits, gd2.fraction))
+
+        gd3, tracks3 = GerberReader3.load_file(GERBER_FILE, useCache=False)
+        self.assertFalse(from_cache(gd3))
+
+    def test_code_change_misses(self):
+        GerberReader3.load_file(GERBER_FILE)
+        GerberReader3._codeHash = "changed"
+        gd, tracks = GerberReader3.load_file(GERBER_FILE)
+        self.assertFalse(from_cache(gd))
+
+
+if __name__ == "__main__":
+    unittest.main()
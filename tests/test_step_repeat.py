@@ -0,0 +1,54 @@
+"""
+Step and repeat blocks with polarity changes (gerber files/sr_polarity.gbr)
+"""
+
+import os
+import sys
+import unittest
+
+import pyclipper
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import GerberReader3
+
+SR_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "gerber files", "sr_polarity.gbr")
+
+
+def holes(polys):
+    return sorted(GerberReader3.polygon_bounds([poly]) for poly in polys if not pyclipper.Orientation(poly))
+
+
+class StepRepeatTest(unittest.TestCase):
+
+    def setUp(self):
+        self.gd, self.tracks = GerberReader3.load_file(SR_FILE, useCache=False)
+        self.copper = GerberReader3.merge_copper(self.gd.layers)
+
+    def test_polarity_sequence_per_copy(self):
+        # every copy clears its own hole after the dark area of the copy before, only the hole of the last copy
+        # of the overlapping block is left. The second block leaves a hole in each copy.
+        expected = [[22000, 4000, 24000, 6000]] + [[4000 + i*20000, 34000, 6000 + i*20000, 36000] for i in range(3)]
+        self.assertEqual(holes(self.copper), sorted(expected))
+        area = sum(pyclipper.Area(poly) for poly in self.copper)
+        self.assertAlmostEqual(area, 25000 * 10000 - 2000 * 2000 + 3 * (10000 * 10000 - 2000 * 2000), delta=1000)
+
+    def test_layers(self):
+        # the overlapping block takes a layer per copy and polarity, the other block one per polarity
+        layers = [gl for gl in self.gd.layers if gl.type == GerberReader3.GerberLayer.TYPE_BOUNDARY]
+        self.assertEqual([(gl.isDark, len(gl.points)) for gl in layers if len(gl.points) > 0],
+                         [(True, 1), (False, 1), (True, 1), (False, 1), (True, 3), (False, 3)])
+
+    def test_tokenizer(self):
+        f = open(SR_FILE, 'r')
+        try:
+            data = f.read()
+        finally:
+            f.close()
+        results = [GerberReader3.parse(data, tokenize=tokenize, useCache=False) for tokenize in (False, True)]
+        (gd0, tracks0), (gd1, tracks1) = results
+        self.assertEqual([(gl.isDark, gl.type, gl.points) for gl in gd0.layers],
+                         [(gl.isDark, gl.type, gl.points) for gl in gd1.layers])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+"""
+The block tokenizer (_parse1) against the character walking parser (_parse0)
+Run from the repository root: python -m unittest discover -s tests
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import GerberReader3
+
+GERBER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "gerber files")
+
+
+def parse_both(data):
+    return [GerberReader3.parse(data, tokenize=tokenize, useCache=False) for tokenize in (False, True)]
+
+
+def layer_points(gd):
+    return [(gl.isDark, gl.name, gl.type, [[list(pt) for pt in poly] for poly in gl.points]) for gl in gd.layers]
+
+
+class TokenizerTest(unittest.TestCase):
+
+    def assertSameResult(self, data):
+        (gd0, tracks0), (gd1, tracks1) = parse_both(data)
+        self.assertEqual(layer_points(gd0), layer_points(gd1))
+        self.assertEqual(tracks0, tracks1)
+        self.assertEqual((gd0.units, gd0.fraction), (gd1.units, gd1.fraction))
+
+    def test_sample_files(self):
+        for name in sorted(os.listdir(GERBER_DIR)):
+            if os.path.splitext(name)[1].lower() not in (".gbl", ".gtl", ".gbr"): continue
+            f = open(os.path.join(GERBER_DIR, name), 'r')
+            try:
+                data = f.read()
+            finally:
+                f.close()
+            self.assertSameResult(data)
+
+    def test_unterminated_data(self):
+        data = "%FSLAX24Y24*%\n%MOIN*%\n%ADD10C,0.0100*%\nD10*\nX100Y100D02*\nX200D01"
+        self.assertSameResult(data)
+        gd, tracks = GerberReader3.parse(data, tokenize=True, useCache=False)
+        self.assertTrue(gd.diagnostics.errors > 0)
+        self.assertEqual(tracks[-1], [[100, 100], [200, 100]])
+
+    def test_not_gerber(self):
+        f = open(os.path.join(GERBER_DIR, "out.g"), 'r')
+        try:
+            data = f.read()
+        finally:
+            f.close()
+        for (gd, tracks) in parse_both(data):
+            self.assertTrue(gd.diagnostics.errors > 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+"""
+Track expansion (TrackShape) - the analytic sweep of convex apertures against the Minkowski sum fallback
+"""
+
+import math
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import pyclipper
+from GerberReader3 import TrackShape
+
+APERTURES = {
+    "rectangle": [[-50, -20], [50, -20], [50, 20], [-50, 20]],
+    "square": [[-30, -30], [30, -30], [30, 30], [-30, 30]],
+    "octagon": [[-20, -50], [20, -50], [50, -20], [50, 20], [20, 50], [-20, 50], [-50, 20], [-50, -20]],
+    "triangle": [[0, 0], [80, 10], [30, 60]],
+}
+
+
+def convex_hull(points):
+    """ :return: convex hull of the points (monotone chain, counter clockwise) """
+    points = sorted(set(tuple(pt) for pt in points))
+    hull = []
+    for chain in (points, points[::-1]):
+        start = len(hull)
+        for pt in chain:
+            while len(hull) >= start + 2 and ((hull[-1][0] - hull[-2][0]) * (pt[1] - hull[-2][1]) -
+                                               (hull[-1][1] - hull[-2][1]) * (pt[0] - hull[-2][0])) <= 0:
+                hull.pop()
+            hull.append(pt)
+        hull.pop()
+    return [list(pt) for pt in hull]
+
+
+def union_area(polys):
+    c = pyclipper.Pyclipper()
+    c.AddPaths(polys, pyclipper.PT_SUBJECT)
+    return c.Execute(pyclipper.CT_UNION, pyclipper.PFT_NONZERO, pyclipper.PFT_NONZERO)
+
+
+def xor_area(a, b):
+    c = pyclipper.Pyclipper()
+    c.AddPaths(a, pyclipper.PT_SUBJECT)
+    c.AddPaths(b, pyclipper.PT_CLIP)
+    return sum(abs(pyclipper.Area(poly)) for poly in c.Execute(pyclipper.CT_XOR, pyclipper.PFT_NONZERO,
+                                                                   pyclipper.PFT_NONZERO))
+
+
+class TrackShapeTest(unittest.TestCase):
+
+    def setUp(self):
+        rnd = random.Random(7)
+        self.paths = [[[0, 0], [1000, 0]], [[0, 0], [0, 1000]], [[0, 0], [700, 700]], [[0, 0], [-300, 1000]],
+                      [[-1161, 1783], [-1157, 326]]]
+        for i in range(20):
+            self.paths.append([[rnd.randint(-2000, 2000), rnd.randint(-2000, 2000)]
+                               for j in range(rnd.randint(2, 6))])
+
+    def test_convex_sweep_is_hull_of_segment(self):
+        for (name, aperture) in sorted(APERTURES.items()):
+            shape = TrackShape(aperture)
+            self.assertTrue(shape.convex, name)
+            for path in self.paths:
+                swept = []
+                shape.sweep(path, swept)
+                self.assertEqual(len(swept), len(path) - 1)  # one polygon per segment
+                for i in range(len(path) - 1):
+                    hull = convex_hull([[x + vx, y + vy] for (x, y) in path[i:i + 2] for (vx, vy) in aperture])
+                    self.assertEqual(xor_area([swept[i]], [hull]), 0, (name, path[i:i + 2]))
+
+    def test_convex_sweep_matches_minkowski(self):
+        for (name, aperture) in sorted(APERTURES.items()):
+            shape = TrackShape(aperture)
+            for path in self.paths:
+                swept = []
+                shape.sweep(path, swept)
+                # the Minkowski sum only sweeps the aperture edges, the aperture itself is added at each point
+                reference = [[[x + vx, y + vy] for (vx, vy) in aperture] for (x, y) in path]
+                shape.sweep_minkowski(path, reference)
+                swept = union_area(swept)
+                reference = union_area(reference)
+                # the Minkowski sums lose slivers less than a unit wide along edges almost parallel to a segment
+                length = sum(math.hypot(path[i + 1][0] - path[i][0], path[i + 1][1] - path[i][1])
+                             for i in range(len(path) - 1))
+                self.assertTrue(xor_area(swept, reference) <= length, (name, path))
+
+    def test_concave_aperture_uses_minkowski(self):
+        shape = TrackShape([[0, 0], [100, 0], [100, 100], [50, 30], [0, 100]])
+        self.assertFalse(shape.convex)
+
+
+if __name__ == "__main__":
+    unittest.main()
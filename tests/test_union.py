@@ -0,0 +1,131 @@
+"""
+Partitioned union (tile_union, _split_touching) against a single union
+"""
+
+import os
+import random
+import sys
+import unittest
+
+import pyclipper
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import GerberReader3
+
+
+def square(x, y, size, ccw=True):
+    poly = [[x, y], [x + size, y], [x + size, y + size], [x, y + size]]
+    return poly if ccw else poly[::-1]
+
+
+def plain_union(polys):
+    c = pyclipper.Pyclipper()
+    c.AddPaths(polys, pyclipper.PT_SUBJECT, True)
+    return c.Execute(pyclipper.CT_UNION, pyclipper.PFT_NONZERO, pyclipper.PFT_NONZERO)
+
+
+def area(polys):
+    return sum(pyclipper.Area(poly) for poly in polys)
+
+
+def xor_area(a, b):
+    c = pyclipper.Pyclipper()
+    c.AddPaths(a, pyclipper.PT_SUBJECT, True)
+    c.AddPaths(b, pyclipper.PT_CLIP, True)
+    return abs(area(c.Execute(pyclipper.CT_XOR, pyclipper.PFT_NONZERO, pyclipper.PFT_NONZERO)))
+
+
+def board(n, seed=1):
+    """
+    Overlapping squares with clockwise squares (holes) cut into some of them and across others
+    """
+    rnd = random.Random(seed)
+    polys = []
+    for i in range(n):
+        x = rnd.randint(0, 2000)
+        y = rnd.randint(0, 2000)
+        size = rnd.randint(20, 120)
+        polys.append(square(x, y, size))
+        if rnd.random() < 0.3: polys.append(square(x + size // 4, y + size // 4, size // 2, False))
+    return polys
+
+
+class TileUnionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tilePolygons = GerberReader3.TileUnionPolygons
+        self.unionWorkers = GerberReader3.UnionWorkers
+        GerberReader3.TileUnionPolygons = 20  # many tiles and merge levels on a small board
+
+    def tearDown(self):
+        GerberReader3.TileUnionPolygons = self.tilePolygons
+        GerberReader3.UnionWorkers = self.unionWorkers
+
+    def assertSameArea(self, tiled, polys):
+        single = plain_union(polys)
+        self.assertAlmostEqual(area(tiled), area(single), delta=1)
+        self.assertTrue(xor_area(tiled, single) <= 1)
+
+    def test_holes(self):
+        polys = board(400)
+        tiled = GerberReader3.tile_union(polys)
+        self.assertSameArea(tiled, polys)
+        self.assertTrue(any(not pyclipper.Orientation(poly) for poly in tiled))
+
+    def test_strictly_simple(self):
+        polys = board(400, 2)
+        tiled = GerberReader3.tile_union(polys, True)
+        self.assertSameArea(tiled, polys)
+        for poly in tiled:
+            self.assertEqual(len(set((pt[0], pt[1]) for pt in poly)), len(poly))
+
+    def test_touching_vertices(self):
+        # squares touching at corners, and a ring of squares that touch around an enclosed pocket
+        polys = [square(i * 10, i * 10, 10) for i in range(30)]
+        polys += [square(500 + 10 * i, 500, 10) for i in range(3)] + [square(500, 510, 10), square(520, 510, 10)]
+        polys += [square(500 + 10 * i, 520, 10) for i in range(3)]
+        polys += [square(600, 600, 10), square(610, 610, 10), square(600, 620, 10), square(590, 610, 10)]
+        tiled = GerberReader3.tile_union(polys, True)
+        self.assertSameArea(tiled, polys)
+        for poly in tiled:
+            self.assertEqual(len(set((pt[0], pt[1]) for pt in poly)), len(poly))
+
+    def test_pool(self):
+        GerberReader3.UnionWorkers = 2
+        pool = GerberReader3.union_pool()
+        try:
+            polys = board(300, 3)
+            self.assertEqual(sorted(GerberReader3.tile_union(polys, True, pool)),
+                             sorted(GerberReader3.tile_union(polys, True)))
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def test_no_pool_by_default(self):
+        self.assertTrue(self.unionWorkers == 0 and GerberReader3.union_pool() is None)
+
+
+class SplitTouchingTest(unittest.TestCase):
+
+    def test_figure_eight(self):
+        # two squares joined at (10, 10) keep their direction
+        poly = [[0, 0], [10, 0], [10, 10], [20, 10], [20, 20], [10, 20], [10, 10], [0, 10]]
+        loops = GerberReader3._split_touching(poly)
+        self.assertEqual(len(loops), 2)
+        self.assertTrue(all(pyclipper.Orientation(loop) for loop in loops))
+        self.assertEqual(area(loops), pyclipper.Area(poly))
+
+    def test_pocket(self):
+        # an outline that touches itself at (10, 0) closes off a pocket, which becomes a hole
+        poly = [[0, 0], [10, 0], [5, 5], [10, 10], [15, 5], [10, 0], [20, 0], [20, 20], [0, 20]]
+        loops = GerberReader3._split_touching(poly)
+        self.assertEqual(sorted(pyclipper.Orientation(loop) for loop in loops), [False, True])
+        self.assertEqual(area(loops), pyclipper.Area(poly))
+
+    def test_simple(self):
+        poly = square(0, 0, 10)
+        self.assertEqual(GerberReader3._split_touching(poly), [poly])
+
+
+if __name__ == '__main__':
+    unittest.main()
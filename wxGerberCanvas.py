@@ -1,7 +1,8 @@
 import math
 import wx
 import wx.lib.scrolledpanel
-from GerberReader3 import GerberData, GerberLayer
+from ExcellonReader import DrillData
+from GerberReader3 import GerberData, GerberLayer, polygon_bounds
 
 __author__ = 'Thompson'
 
@@ -56,7 +57,8 @@ class GerberCanvas(wx.lib.scrolledpanel.ScrolledPanel):
         self.toolpaths = []
         self.toolpathlinewidth = 0
         self.bufferAll = True
-        self.drillPts = []
+        self.drillPts = DrillData()
+        """ :type drillPts: DrillData """
 
         self.measureX = -1
         self.measureY = -1
@@ -238,7 +240,7 @@ class GerberCanvas(wx.lib.scrolledpanel.ScrolledPanel):
             #         gc.DrawLines(seg, fillStyle=wx.WINDING_RULE)
             # print("   Drawn layer: " + tmp.name + ",  # of poly: " + str(len(tmp.points)))
 
-        if self.drillPts != []:
+        if len(self.drillPts) > 0 or self.drillPts.slotCount() > 0:
             gc.SetPen(wx.Pen("yellow", 0))
             # Style 1 - circle with small plus
             for (x, y, dia) in self.drillPts:
@@ -247,6 +249,16 @@ class GerberCanvas(wx.lib.scrolledpanel.ScrolledPanel):
                 gc.DrawEllipse(x - hdia, y - hdia, dia, dia)
                 gc.StrokeLine(x - hdia2, y, x + hdia2, y)
                 gc.StrokeLine(x, y - hdia2, x, y + hdia2)
+            # Slots - outline of the cut: circles at the ends joined by the sides
+            for (x1, y1, x2, y2, dia) in self.drillPts.iterSlots():
+                hdia = dia/2
+                length = math.hypot(x2 - x1, y2 - y1) or 1
+                nx = (y1 - y2) * hdia / length
+                ny = (x2 - x1) * hdia / length
+                gc.DrawEllipse(x1 - hdia, y1 - hdia, dia, dia)
+                gc.DrawEllipse(x2 - hdia, y2 - hdia, dia, dia)
+                gc.StrokeLine(x1 + nx, y1 + ny, x2 + nx, y2 + ny)
+                gc.StrokeLine(x1 - nx, y1 - ny, x2 - nx, y2 - ny)
             # # Style 2 - circle with slightly larger cross
             # mult = 0.98
             # for (x, y, dia) in self.drillPts:
@@ -333,7 +345,7 @@ class GerberCanvas(wx.lib.scrolledpanel.ScrolledPanel):
         self.measureX = -1
         self.measureY = -1
         self.gerber_data = gerber_data
-        self.drillPts = []
+        self.drillPts = DrillData()
         self.toolpaths = []
         self.toolpaths2 = []
 
@@ -360,12 +372,12 @@ class GerberCanvas(wx.lib.scrolledpanel.ScrolledPanel):
         self.ymin = 0
         self.ymax = 0
         for gl in self.gerber_data.layers:
-            for pol in gl.points:
-                for seg in pol:
-                    if seg[0] < self.xmin: self.xmin = seg[0]
-                    elif seg[0] > self.xmax: self.xmax = seg[0]
-                    if seg[1] < self.ymin: self.ymin = seg[1]
-                    elif seg[1] > self.ymax: self.ymax = seg[1]
+            bounds = polygon_bounds(gl.points)
+            if bounds is None: continue
+            if bounds[0] < self.xmin: self.xmin = bounds[0]
+            if bounds[2] > self.xmax: self.xmax = bounds[2]
+            if bounds[1] < self.ymin: self.ymin = bounds[1]
+            if bounds[3] > self.ymax: self.ymax = bounds[3]
 
         # Apply margin
         ww = (self.xmax - self.xmin)*0.1